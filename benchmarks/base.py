@@ -0,0 +1,86 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Shared helpers for Sellmo's benchmarks. Benchmarks run against an
+existing Sellmo project, point DJANGO_SETTINGS_MODULE to its settings:
+
+    DJANGO_SETTINGS_MODULE=example.settings python benchmarks/chaining.py
+"""
+
+import os
+import sys
+import time
+
+
+def setup():
+    if 'DJANGO_SETTINGS_MODULE' not in os.environ:
+        sys.exit("DJANGO_SETTINGS_MODULE is not set.")
+    import django
+    django.setup()
+
+
+def measure(func, number=1000, repeat=3):
+    """
+    Calls func 'number' times, 'repeat' times in a row. Returns the
+    best average time per call in microseconds.
+    """
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        for j in xrange(number):
+            func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / number * 1000000
+
+
+def count_queries(func):
+    """
+    Calls func once and returns the amount of executed queries.
+    """
+    from django.db import connection
+    debug = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        before = len(connection.queries)
+        func()
+        return len(connection.queries) - before
+    finally:
+        connection.use_debug_cursor = debug
+
+
+def report(title, rows, columns):
+    print title
+    print '  '.join(column.ljust(16) for column in columns)
+    for row in rows:
+        print '  '.join(str(value).ljust(16) for value in row)
+    print
@@ -0,0 +1,94 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Measures cart and order calculation for large amounts of purchases,
+along with the summation of their totals. Purchases are created for
+the first products of the project and rolled back afterwards.
+"""
+
+import operator
+
+from base import setup, measure, report
+setup()
+
+from django.db import transaction
+
+from sellmo import modules
+from sellmo.api.pricing import Price
+from sellmo.core.local import new_context, release_context
+
+
+class Rollback(Exception):
+    pass
+
+
+def compare(products, number=10):
+    cart = modules.cart.Cart()
+    cart.save()
+    purchases = []
+    for product in products:
+        purchase = modules.store.Purchase(product=product, qty=2)
+        purchase.calculate(save=False)
+        cart.add(purchase, calculate=False)
+        purchases.append(purchase)
+
+    order = modules.checkout.Order()
+    order.proxy(purchases)
+
+    totals = [purchase.total for purchase in purchases]
+    return (len(purchases),
+            '%.2f' % (measure(lambda: cart.calculate(save=False),
+                              number) / 1000),
+            '%.2f' % (measure(lambda: order.calculate(save=False),
+                              number) / 1000),
+            '%.2f' % (measure(lambda: reduce(operator.add, totals),
+                              number) / 1000),
+            '%.2f' % (measure(lambda: Price.sum(totals), number) / 1000))
+
+
+def main():
+    new_context()
+    queryset = modules.product.Product.objects.polymorphic()
+    rows = []
+    try:
+        with transaction.atomic():
+            for n in (10, 200, 1000):
+                rows.append(compare(list(queryset[:n])))
+            raise Rollback()
+    except Rollback:
+        pass
+    release_context()
+    report("Calculation (msec)", rows,
+           ['purchases', 'cart', 'order', 'sum (+)', 'sum (Price.sum)'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Compares the precompiled chain dispatch against the former dispatch,
+which inspected every link on every call.
+"""
+
+import inspect
+
+from base import setup, measure, report
+setup()
+
+from django.test import RequestFactory
+from django.contrib.sessions.backends.cache import SessionStore
+
+from sellmo import modules
+from sellmo.core.chaining import Chain
+from sellmo.core.local import new_context, release_context
+
+
+class LegacyChain(Chain):
+
+    def handle(self, module, **kwargs):
+        func = self._func
+        out = self._loop(reversed(self._capture_queue), **kwargs)
+        if not out[1] is None:
+            if inspect.isfunction(out[1]):
+                func = out[1]
+            else:
+                return out[1]
+        kwargs = out[0]
+        return func(module, self, **kwargs)
+
+    def _loop(self, queue, **kwargs):
+        for func in queue:
+            if inspect.isgeneratorfunction(func):
+                responses = list(func(**kwargs))
+            else:
+                responses = [func(**kwargs)]
+            for response in responses:
+                if self.should_return(response):
+                    return (kwargs, response)
+                elif isinstance(response, dict):
+                    kwargs.update(response)
+                elif response is False:
+                    break
+                elif response is None:
+                    continue
+            else:
+                continue
+            break
+        return (kwargs, None)
+
+    def execute(self, **kwargs):
+        out = self._loop(self._queue, **kwargs)
+        if not out[1] is None:
+            return out[1]
+        return out[0]
+
+    @property
+    def can_execute(self):
+        return len(self._queue) > 0
+
+    def __nonzero__(self):
+        return self.can_execute
+
+
+def compare(name, chain, func, number):
+    cls = chain.__class__
+    # Bypass memoization wrapping the compiled handle
+    handle = chain.__dict__.pop('handle', None)
+    chain.__class__ = LegacyChain
+    try:
+        legacy = measure(func, number)
+    finally:
+        chain.__class__ = cls
+        if handle is not None:
+            chain.handle = handle
+    compiled = measure(func, number)
+    return (name, '%.2f' % legacy, '%.2f' % compiled,
+            '%.2fx' % (legacy / compiled))
+
+
+def main(number=1000):
+    request = RequestFactory().get('/')
+    request.session = SessionStore()
+    new_context()
+
+    product = modules.product.Product.objects.polymorphic().first()
+    purchase = modules.store.Purchase(product=product, qty=1)
+    cart = modules.cart.Cart()
+
+    # Unknown arguments keep get_price from using the price memo
+    rows = [
+        compare('get_price', modules.pricing.get_price._chain,
+                lambda: modules.pricing.get_price(
+                    product=product, benchmark=True), number),
+        compare('get_price (raw)', modules.pricing.get_price._chain,
+                lambda: modules.pricing.get_price(), number),
+        compare('retrieve', modules.pricing.retrieve._chain,
+                lambda: modules.pricing.retrieve(
+                    stampable=purchase, prop='total'), number),
+        compare('get_cart', modules.cart.get_cart._chain,
+                lambda: modules.cart.get_cart(request=request, cart=cart),
+                number),
+    ]
+
+    release_context()
+    report("Chain dispatch (usec per call)", rows,
+           ['chain', 'legacy', 'compiled', 'speedup'])
+
+
+if __name__ == '__main__':
+    main()
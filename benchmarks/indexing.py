@@ -0,0 +1,105 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Compares writing the product index one record at a time (through
+update_or_create) against the diff based bulk writes of the database
+adapter, for an empty and for an up to date index. Requires the
+product index to be built.
+"""
+
+from base import setup, measure, count_queries, report
+setup()
+
+from django.db import transaction
+from django.utils import six
+
+from sellmo import modules
+from sellmo.core.local import new_context, release_context
+
+
+def update_legacy(index, documents):
+    model = index.adapter.index_model_factory(index)
+    with transaction.atomic():
+        with index.prefetching(documents):
+            for document in documents:
+                for record in index.build_records(document):
+                    model.objects.update_or_create(**dict(
+                        defaults=record, **{
+                            field_name: record[field_name]
+                            for field_name
+                            in six.iterkeys(index._unique_together)
+                        }))
+
+
+def compare(index, documents):
+    model = index.adapter.index_model_factory(index)
+    queryset = index.get_queryset().filter(
+        pk__in=[document.pk for document in documents])
+
+    def legacy():
+        update_legacy(index, documents)
+
+    def bulk():
+        index.update(queryset)
+
+    def clear():
+        model.objects.filter(document__in=documents).delete()
+
+    rows = []
+    for state, prepare in [('empty', clear), ('up to date', lambda: None)]:
+        timings = []
+        for func in (legacy, bulk):
+            prepare()
+            queries = count_queries(func)
+            prepare()
+            timings.append((queries, measure(func, number=1, repeat=1)))
+        rows.append((len(documents), state,
+                     timings[0][0], timings[1][0],
+                     '%.2f' % (timings[0][1] / 1000),
+                     '%.2f' % (timings[1][1] / 1000)))
+    return rows
+
+
+def main():
+    new_context()
+    index = modules.indexing.get_index(name='product')
+    queryset = index.get_queryset()
+    rows = []
+    for n in (10, 100, 1000):
+        rows.extend(compare(index, list(queryset[:n])))
+    release_context()
+    report("Index updates (queries, msec)", rows,
+           ['documents', 'index', 'queries', 'queries (bulk)', 'msec',
+            'msec (bulk)'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Compares downcasting polymorphic querysets with a query per content
+type against joining all subtypes in a single query, for 2, 5 and 10
+subtypes. Temporary models and tables are created for each amount of
+subtypes and dropped afterwards.
+"""
+
+from base import setup, measure, count_queries, report
+setup()
+
+from django.apps import apps
+from django.db import connection, models, transaction
+from django.contrib.contenttypes.models import ContentType
+
+from sellmo.core.polymorphism import PolymorphicModel
+
+
+APP_LABEL = 'contenttypes'
+
+
+def create_models(n):
+    class Meta:
+        app_label = APP_LABEL
+
+    base = type('BenchItem%s' % n, (PolymorphicModel,), {
+        '__module__': __name__,
+        'Meta': Meta,
+        'name': models.CharField(max_length=100),
+    })
+    subtypes = [
+        type('BenchItem%sSubtype%s' % (n, i), (base,), {
+            '__module__': __name__,
+            'Meta': Meta,
+            'value': models.IntegerField(default=0),
+        })
+        for i in range(n)
+    ]
+    return base, subtypes
+
+
+def compare(n):
+    base, subtypes = create_models(n)
+    with connection.schema_editor() as editor:
+        for model in [base] + subtypes:
+            editor.create_model(model)
+    try:
+        def query():
+            list(base.objects.polymorphic())
+
+        def join():
+            list(base.objects.polymorphic(strategy='join'))
+
+        rows = []
+        created = 0
+        for items in (10, 100, 1000):
+            with transaction.atomic():
+                for i in range(created, items):
+                    subtypes[i % n].objects.create(name='item %s' % i,
+                                                   value=i)
+            created = items
+            rows.append((n, items,
+                         count_queries(query), count_queries(join),
+                         '%.2f' % (measure(query, number=10) / 1000),
+                         '%.2f' % (measure(join, number=10) / 1000)))
+        return rows
+    finally:
+        with connection.schema_editor() as editor:
+            for model in reversed([base] + subtypes):
+                editor.delete_model(model)
+                del apps.all_models[APP_LABEL][model._meta.model_name]
+        apps.clear_cache()
+        # Rows were dropped along with the tables, don't cascade
+        connection.cursor().execute(
+            "DELETE FROM {0} WHERE app_label = %s AND model LIKE %s".format(
+                ContentType._meta.db_table),
+            [APP_LABEL, 'benchitem%s%%' % n])
+        ContentType.objects.clear_cache()
+
+
+def main():
+    rows = []
+    for n in (2, 5, 10):
+        rows.extend(compare(n))
+    report("Polymorphic downcasts (queries, msec)", rows,
+           ['subtypes', 'objects', 'queries', 'queries (join)', 'msec',
+            'msec (join)'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Compares resolving prices one product at a time against resolving
+them at once through modules.pricing.get_prices. Uses the first 10, 100
+and 1000 products of the project.
+"""
+
+from base import setup, measure, count_queries, report
+setup()
+
+from sellmo import modules
+from sellmo.core.local import new_context, release_context
+
+
+def compare(products):
+    def single():
+        modules.pricing.price_memo.clear()
+        for product in products:
+            modules.pricing.get_price(product=product)
+
+    def bulk():
+        modules.pricing.get_prices(products=products)
+
+    return (len(products),
+            count_queries(single), count_queries(bulk),
+            '%.2f' % (measure(single, number=1) / 1000),
+            '%.2f' % (measure(bulk, number=1) / 1000))
+
+
+def main():
+    new_context()
+    queryset = modules.product.Product.objects.polymorphic()
+    rows = [compare(list(queryset[:n])) for n in (10, 100, 1000)]
+    release_context()
+    report("Price resolution (queries, msec)", rows,
+           ['products', 'queries', 'queries (bulk)', 'msec',
+            'msec (bulk)'])
+
+
+if __name__ == '__main__':
+    main()
@@ -243,6 +243,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'sellmo.core.middleware.LocalContextMiddleware',
+    'sellmo.core.middleware.IndexingMiddleware',
 )
 
 TEMPLATE_CONTEXT_PROCESSORS = (
@@ -158,14 +158,15 @@ class Cart(trackable('sellmo_cart')):
     def calculate(self, subtotal=None, total=None, save=True):
         if total is None:
             if subtotal is None:
-                subtotal = Price()
-                for purchase in self:
+                purchases = list(self)
+                for purchase in purchases:
                     if not purchase.calculated:
                         # Sanity check
                         raise Exception(
                             "Cannot calculate cart, "
                             "purchase was not calculated.")
-                    subtotal += purchase.total
+                subtotal = Price.sum(
+                    modules.pricing.retrieve_many(purchases, 'total'))
             total = modules.pricing.get_price(price=subtotal, cart=self)
 
         if subtotal is None:
@@ -185,7 +186,8 @@ class Cart(trackable('sellmo_cart')):
     @property
     def _purchases(self):
         if self.__purchases is None:
-            self.__purchases = self.purchases.polymorphic().all()
+            self.__purchases = self.purchases.polymorphic(
+                strategy='join').all()
         return self.__purchases
 
     def __contains__(self, purchase):
@@ -38,8 +38,11 @@ from sellmo.api.pricing import Price
 from sellmo.api.decorators import load
 from sellmo.core.polymorphism import (PolymorphicModel,
                                       PolymorphicManager,
-                                      PolymorphicOneToOneField)
-from sellmo.utils.tracking import trackable
+                                      PolymorphicOneToOneField,
+                                      PolymorphicPrefetchMixin,
+                                      downcast_many)
+from sellmo.utils.tracking import (trackable, TrackingManager,
+                                   TrackingQuerySet)
 from sellmo.signals.checkout import *
 
 
@@ -198,7 +201,22 @@ def finalize_model():
     modules.checkout.Payment = Payment
 
 
-class Order(trackable('sellmo_order')):
+class OrderQuerySet(PolymorphicPrefetchMixin, TrackingQuerySet):
+    pass
+
+
+class OrderManager(TrackingManager):
+
+    def prefetch_polymorphic(self, *args, **kwargs):
+        return self.get_queryset().prefetch_polymorphic(*args, **kwargs)
+
+    def get_queryset(self):
+        qs = OrderQuerySet(self.model, using=self._db)
+        qs._session_key = self._session_key
+        return qs
+
+
+class Order(trackable('sellmo_order', manager=OrderManager())):
 
     _proxy = None
     
@@ -271,8 +289,9 @@ class Order(trackable('sellmo_order')):
         self._proxy = purchases
     
     def needs_shipping(self):
-        for purchase in self:
-            if getattr(purchase.product.downcast(), 'needs_shipping', True):
+        products = downcast_many(purchase.product for purchase in self)
+        for product in products:
+            if getattr(product, 'needs_shipping', True):
                 return True
         return False
     
@@ -320,9 +339,8 @@ class Order(trackable('sellmo_order')):
         
         if total is None:
             if subtotal is None:
-                subtotal = Price()
-                for purchase in self:
-                    subtotal += purchase.total
+                subtotal = Price.sum(
+                    modules.pricing.retrieve_many(self, 'total'))
             
             total = subtotal
             
@@ -537,7 +555,12 @@ class Order(trackable('sellmo_order')):
     def __iter__(self):
         purchases = self._proxy if self._proxy else []
         if not purchases and hasattr(self, 'purchases'):
-            purchases = self.purchases.polymorphic().all()
+            purchases = self.purchases.all()
+            if purchases._result_cache is not None:
+                # Prefetched, only downcast
+                purchases = downcast_many(purchases)
+            else:
+                purchases = self.purchases.polymorphic(strategy='join').all()
 
         for purchase in purchases:
             yield purchase
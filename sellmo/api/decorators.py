@@ -29,6 +29,7 @@
 
 
 from sellmo import params
+from sellmo.caching import ChainCache
 from sellmo.core.chaining import (Chain, ViewChain, 
                                   ContextProcessorChain)
 
@@ -47,6 +48,18 @@ def link(name=None, namespace=None, capture=False):
     return decorator
 
 
+def batch(link):
+    """
+    Declares the decorated function as the batch variant of the given
+    link. It receives a list of kwargs dicts and returns a list of
+    responses, one for each item.
+    """
+    def decorator(func):
+        link._batch = func
+        return func
+    return decorator
+
+
 def view(regex=None):
     def decorator(func):
         chain = ViewChain(func, regex)
@@ -61,8 +74,15 @@ def context_processor():
     return decorator
 
 
-def chainable():
+def chainable(cache=None):
     def decorator(func):
-        chain = Chain(func)
+        chain = Chain(func, cache=cache)
         return params.chainer.chain(chain)
     return decorator
+
+
+def cached_chain(key, timeout=None, tier='shared', invalidate=None,
+                 pickler=None):
+    return chainable(cache=ChainCache(
+        key=key, timeout=timeout, tier=tier, invalidate=invalidate,
+        pickler=pickler))
@@ -36,4 +36,5 @@ from sellmo.api.indexing.fields import (BooleanField,
                                         FloatField,
                                         DecimalField,
                                         CharField,
+                                        TextField,
                                         ModelField)
\ No newline at end of file
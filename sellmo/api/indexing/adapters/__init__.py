@@ -56,9 +56,39 @@ class IndexAdapter(object):
         
     def rebuild_index(self, index, added_fields, deleted_fields, changed_fields):
         """
-        Rebuild internal index structure.
+        Rebuild internal index structure. An adapter rebuilding online
+        builds the new structure alongside the current one and marks
+        the index as `rebuilding`, the new structure is then filled
+        with `backfill_index` and swapped in with `swap_index`.
         """
         raise NotImplementedError()
+        
+    def backfill_index(self, index, documents):
+        """
+        (Re)indexes each document from the given iterable into the
+        structure being rebuilt.
+        """
+        raise NotImplementedError()
+        
+    def swap_index(self, index):
+        """
+        Replaces the current index structure with the rebuilt one.
+        """
+        raise NotImplementedError()
+        
+    def get_structure_name(self, index):
+        """
+        Identifies the structure documents are written to, the one
+        being rebuilt while rebuilding.
+        """
+        return None
+        
+    def is_stale(self, index):
+        """
+        Whether the index structure has been replaced (possibly by
+        another process) since the given index was created.
+        """
+        return False
 
     def update_index(self, index, documents):
         """
@@ -76,4 +106,20 @@ class IndexAdapter(object):
         """
         Searches the index
         """
+        raise NotImplementedError()
+        
+    def facet_index(self, index, query):
+        """
+        Counts the documents matching the query for each facet of the
+        query. Returns a mapping of field name to a mapping of value
+        (or range) to count.
+        """
+        raise NotImplementedError()
+        
+    def join_index(self, index, queryset, filters=None, order_by=None,
+                   **variety):
+        """
+        Filters and orders the given queryset on index values for the
+        given variety, within the queryset's own query.
+        """
         raise NotImplementedError()
\ No newline at end of file
@@ -29,17 +29,22 @@
 
 
 import logging
+import uuid
+import hashlib
+import weakref
 from collections import OrderedDict
 
 from django.apps import apps
 from django.db import models
-from django.db.models import Q
-from django.db import transaction
+from django.db.models import Q, Count, Min, Max
+from django.db import transaction, DatabaseError
 from django.db import DEFAULT_DB_ALIAS, connections
-from django.core.management import call_command
+from django.core.cache import cache
 from django.utils import six
 
+from sellmo import modules
 from sellmo.api import indexing
+from sellmo.api.indexing.search import SQ
 
 
 logger = logging.getLogger('sellmo')
@@ -47,9 +52,6 @@ logger = logging.getLogger('sellmo')
 
 class DatabaseIndexAdapter(indexing.IndexAdapter):
     
-    # Shared among adapters
-    _models = {}
-    
     INDEX_TO_DB_FIELDS = {
         indexing.BooleanField: lambda field: (models.BooleanField, [], {}),
         indexing.CharField: lambda field: (models.CharField, [], {
@@ -57,6 +59,7 @@ class DatabaseIndexAdapter(indexing.IndexAdapter):
         }),
         indexing.FloatField: lambda field: (models.FloatField, [], {}),
         indexing.IntegerField: lambda field: (models.IntegerField, [], {}),
+        indexing.TextField: lambda field: (models.TextField, [], {}),
         indexing.DecimalField: lambda field: (models.DecimalField, [], {
             # Introspection can't always resolve max_digits and decimal_places
             # (sqllite for instance)
@@ -73,6 +76,7 @@ class DatabaseIndexAdapter(indexing.IndexAdapter):
         }),
         'FloatField': lambda field_params: (indexing.FloatField, [], {}),
         'IntegerField': lambda field_params: (indexing.IntegerField, [], {}),
+        'TextField': lambda field_params: (indexing.TextField, [], {}),
         'DecimalField': lambda field_params: (indexing.DecimalField, [], {
             'max_digits': field_params['max_digits'],
             'decimal_places': field_params['decimal_places']
@@ -80,6 +84,12 @@ class DatabaseIndexAdapter(indexing.IndexAdapter):
         'ForeignKey': lambda field_params: (indexing.ModelField, [field_params['model']], {}),
     }
     
+    def __init__(self):
+        super(DatabaseIndexAdapter, self).__init__()
+        # Models for each index instance
+        self._models = weakref.WeakKeyDictionary()
+        self._db_models = {}
+    
     def supports_runtime_build(self):
         return False
         
@@ -100,29 +110,59 @@ class DatabaseIndexAdapter(indexing.IndexAdapter):
             }, **kwargs))
         raise TypeError(field_type)
         
-    def index_model_factory(self, index, building=False):
-        if index.name not in self._models:
+    def index_model_factory(self, index, building=False, shadow=False):
+        """
+        Returns the model for the given index' table. Unless building,
+        the model reflects the introspected table. The shadow model
+        reflects the table being rebuilt.
+        """
+        models_ = self._models.setdefault(index, {})
+        key = (building, shadow)
+        if key not in models_:
+            if shadow:
+                name = '%sShadowIndex' % index.name
+                db_table = index.shadow_db_table
+                fields = index.original_fields
+            else:
+                name = '%sIndex' % index.name
+                db_table = self.get_index_db_table(index)
+                fields = (index.fields if building
+                          else index.introspected_fields)
+                
             class Meta:
                 app_label = index.model._meta.app_label
-                db_table = self.get_index_db_table(index)
+                # Never migrated, the adapter manages the table
+                managed = False
+            Meta.db_table = db_table
             attrs = {
                 'Meta': Meta,
                 '__module__': index.__module__
             }
             
-            for field_name, index_field in six.iteritems(index.fields if building else index.introspected_fields):
+            for field_name, index_field in six.iteritems(fields):
                 db_field = self.db_field_for_index_field(index_field)
                 if db_field:
                     attrs[field_name] = db_field
-    
-            model = type('%sIndex' % index.name, (models.Model,), attrs)
-            self._models[index.name] = model
-        return self._models[index.name]    
+            
+            # Replace a model from a previous index instance
+            self.unregister_model(Meta.app_label, name)
+            models_[key] = type(str(name), (models.Model,), attrs)
+        return models_[key]
+        
+    def unregister_model(self, app_label, name):
+        if apps.all_models[app_label].pop(name.lower(), None) is not None:
+            apps.clear_cache()
     
     def get_index_db_table(self, index):
         info = (index.model._meta.app_label, index.name)
         return "%s_%s_index" % info
         
+    def get_shadow_db_table_prefix(self, index):
+        return '%s_shadow_' % self.get_index_db_table(index)
+        
+    def get_version_key(self, index):
+        return 'sellmo_%s_version' % self.get_index_db_table(index)
+        
     def get_db_connection(self):
         return connections[DEFAULT_DB_ALIAS]
         
@@ -132,40 +172,102 @@ class DatabaseIndexAdapter(indexing.IndexAdapter):
             db_models[model._meta.db_table] = model
         return db_models
         
+    def get_db_model(self, db_table):
+        if db_table not in self._db_models:
+            self._db_models = self.get_db_models()
+        return self._db_models.get(db_table, None)
+        
+    def get_introspection_key(self, index):
+        return 'sellmo_%s_introspection' % self.get_index_db_table(index)
+        
+    def get_fingerprint(self, index):
+        """
+        Describes the table the declared fields of the given index
+        result in.
+        """
+        description = []
+        for field_name, index_field in sorted(six.iteritems(index.fields)):
+            db_field = self.db_field_for_index_field(index_field)
+            name, path, args, kwargs = db_field.deconstruct()
+            description.append((field_name, path, args, sorted(kwargs.items())))
+        return hashlib.md5(repr(description)).hexdigest()
+        
     def introspect_index(self, index):
+        db_table = self.get_index_db_table(index)
+        if not modules.indexing.cache_introspection:
+            columns = self.introspect_table(db_table)
+        else:
+            # Reuse a previous introspection as long as the declared
+            # fields and the table's columns still match.
+            key = self.get_introspection_key(index)
+            fingerprint = self.get_fingerprint(index)
+            cached = cache.get(key)
+            if (cached is not None
+                    and cached['fingerprint'] == fingerprint
+                    and self.validate_table(db_table, cached['columns'])):
+                columns = cached['columns']
+            else:
+                columns = self.introspect_table(db_table)
+                if columns is not False:
+                    cache.set(key, {
+                        'fingerprint': fingerprint,
+                        'columns': columns
+                    }, None)
         
+        if columns is False:
+            return False
+        return self.index_fields_for_columns(columns)
+        
+    def reset_introspection(self, index):
+        """
+        Forgets the cached introspection of the given index, processes
+        using the index will introspect it again.
+        """
+        cache.delete(self.get_introspection_key(index))
+        cache.set(self.get_version_key(index), uuid.uuid4().hex, None)
+        
+    def validate_table(self, db_table, columns):
+        """
+        Cheaply checks whether the table still has the given columns.
+        """
         connection = self.get_db_connection()
-        db_table = self.get_index_db_table(index)
-        db_models = self.get_db_models()
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT * FROM %s WHERE 1 = 0'
+                                   % connection.ops.quote_name(db_table))
+                    names = [column[0] for column in cursor.description]
+        except DatabaseError:
+            return False
+        return (sorted(names) ==
+                sorted(column_name for column_name, _, _ in columns))
         
-        exists = False
+    def introspect_table(self, db_table):
+        """
+        Returns a description of each column in the given table, or
+        False if the table does not exist.
+        """
+        connection = self.get_db_connection()
         
-        # Map models to db_name
-        fields = {}
+        columns = []
         with connection.cursor() as cursor:
             
+            if db_table not in connection.introspection.table_names(cursor):
+                # Index does not yet exist
+                return False
+            
             try:
                 relations = connection.introspection.get_relations(cursor, db_table)
             except NotImplementedError:
                 raise Exception("")
-            try:
-                indexes = connection.introspection.get_indexes(cursor, db_table)
-            except NotImplementedError:
-                raise Exception("")
-            try:
-                constraints = connection.introspection.get_constraints(cursor, db_table)
-            except NotImplementedError:
-                raise Exception("")
             
             for i, row in enumerate(connection.introspection.get_table_description(cursor, db_table)):
                 
-                # We got a result, index exists
-                exists = True
-                
                 column_name = row[0]
                 
                 # Ignore fixed fields
                 if column_name in ['id', 'document_id']:
+                    columns.append((column_name, None, None))
                     continue
                 
                 field_type = None
@@ -173,13 +275,7 @@ class DatabaseIndexAdapter(indexing.IndexAdapter):
                 
                 if i in relations:
                     field_type = 'ForeignKey'
-                    model = db_models.get(relations[i][1], None)
-                    if not model:
-                        raise Exception("")
-                    if not column_name.endswith('_id'):
-                        raise Exception("")
-                    column_name = column_name[:-3]
-                    field_params['model'] = model
+                    field_params['db_table'] = relations[i][1]
                 else:
                     try:
                         field_type = connection.introspection.get_field_type(row[1], row)
@@ -205,15 +301,33 @@ class DatabaseIndexAdapter(indexing.IndexAdapter):
                             field_params['decimal_places'] = row[5]
                     
                 field_params['null'] = row[6]
-                            
-                index_field = self.index_field_for_db_field(field_type, field_params)
-                if index_field:
-                    fields[column_name] = index_field
+                columns.append((column_name, field_type, field_params))
         
-        if exists:
-            return fields
+        if columns:
+            return columns
         return False
         
+    def index_fields_for_columns(self, columns):
+        fields = {}
+        for column_name, field_type, field_params in columns:
+            # Ignore fixed fields
+            if field_type is None:
+                continue
+            
+            if field_type == 'ForeignKey':
+                model = self.get_db_model(field_params['db_table'])
+                if not model:
+                    raise Exception("")
+                if not column_name.endswith('_id'):
+                    raise Exception("")
+                column_name = column_name[:-3]
+                field_params = dict(field_params, model=model)
+            
+            index_field = self.index_field_for_db_field(field_type, field_params)
+            if index_field:
+                fields[column_name] = index_field
+        return fields
+        
     def initialize_index(self, index):
         model = self.index_model_factory(index)
         
@@ -237,44 +351,316 @@ class DatabaseIndexAdapter(indexing.IndexAdapter):
         
         index._unique_together = unique_together
         index._unused_fields = unused_fields
+        index._version = cache.get(self.get_version_key(index))
+        
+    def get_structure_name(self, index):
+        if index.rebuilding:
+            return index.shadow_db_table
+        return self.get_index_db_table(index)
         
+    def is_stale(self, index):
+        return cache.get(self.get_version_key(index)) != index._version
+        
+    def drop_table(self, editor, db_table):
+        editor.execute(editor.sql_delete_table % {
+            'table': editor.quote_name(db_table)
+        })
 
     def build_index(self, index):
         model = self.index_model_factory(index, building=True)
-        call_command('makemigrations', index.model._meta.app_label)
-        call_command('migrate', index.model._meta.app_label)
+        connection = self.get_db_connection()
+        with connection.schema_editor() as editor:
+            editor.create_model(model)
+        self.reset_introspection(index)
         
     def rebuild_index(self, index, added_fields, deleted_fields, changed_fields):
-        self.build_index(index)
+        connection = self.get_db_connection()
+        if not modules.indexing.online_rebuild:
+            # Rebuild in place, the index remains empty until it is
+            # updated.
+            model = self.index_model_factory(index, building=True)
+            with connection.schema_editor() as editor:
+                self.drop_table(editor, model._meta.db_table)
+                editor.create_model(model)
+            self.reset_introspection(index)
+            return
+        
+        # Build a shadow table, an (interrupted) rebuild's shadow table
+        # is resumed if it's structure is still up to date.
+        prefix = self.get_shadow_db_table_prefix(index)
+        with connection.cursor() as cursor:
+            shadow_db_tables = [
+                db_table for db_table
+                in connection.introspection.table_names(cursor)
+                if db_table.startswith(prefix)]
+        
+        index.shadow_db_table = None
+        for db_table in shadow_db_tables:
+            columns = self.introspect_table(db_table)
+            if columns is False:
+                continue
+            fields = self.index_fields_for_columns(columns)
+            fields['document'] = index.fields['document']
+            if (set(fields) == set(index.fields)
+                    and all(fields[field_name] == field
+                            for field_name, field
+                            in six.iteritems(index.fields))):
+                index.shadow_db_table = db_table
+                break
+        
+        with connection.schema_editor() as editor:
+            for db_table in shadow_db_tables:
+                if db_table != index.shadow_db_table:
+                    self.drop_table(editor, db_table)
+            if index.shadow_db_table is None:
+                # Use a unique name, names of indexes and sequences
+                # are derived from it.
+                index.shadow_db_table = prefix + uuid.uuid4().hex[:8]
+                editor.create_model(
+                    self.index_model_factory(index, shadow=True))
+        
+        index.rebuilding = True
+        
+    def backfill_index(self, index, documents):
+        self.update_index(index, documents, shadow=True)
+        
+    def swap_index(self, index):
+        connection = self.get_db_connection()
+        db_table = self.get_index_db_table(index)
+        shadow_model = self.index_model_factory(index, shadow=True)
+        
+        with connection.cursor() as cursor:
+            exists = db_table in connection.introspection.table_names(cursor)
+        
+        # Rename the shadow table to the index table. The schema editor
+        # does so within a single transaction where DDL can be rolled
+        # back, MySQL renames both tables in a single statement.
+        old_db_table = '%s_old_%s' % (db_table, uuid.uuid4().hex[:8])
+        with connection.schema_editor() as editor:
+            qn = editor.quote_name
+            if not exists:
+                editor.alter_db_table(
+                    shadow_model, index.shadow_db_table, db_table)
+            elif connection.vendor == 'mysql':
+                editor.execute('RENAME TABLE %s TO %s, %s TO %s' % (
+                    qn(db_table), qn(old_db_table),
+                    qn(index.shadow_db_table), qn(db_table)))
+            else:
+                editor.alter_db_table(
+                    shadow_model, db_table, old_db_table)
+                editor.alter_db_table(
+                    shadow_model, index.shadow_db_table, db_table)
+            if exists:
+                self.drop_table(editor, old_db_table)
+        
+        self.unregister_model(shadow_model._meta.app_label,
+                              shadow_model.__name__)
+        self._models.pop(index, None)
+        index.shadow_db_table = None
+        
+        # Let other processes know
+        self.reset_introspection(index)
 
-    def update_index(self, index, documents):
-        model = self.index_model_factory(index)
-        with transaction.atomic():
-            
-            # We won't allow records who utilize unused fields
-            # Delete them so are always getting unique query results.
-            if index._unused_fields:
-                q = Q()
-                for field_name in six.iterkeys(index._unused_fields):
-                    q |= Q(**{'%s__isnull' % field_name: False})
-                invalid = model.objects.filter(q, document__in=documents)
-                invalid.delete()
+    def update_index(self, index, documents, shadow=False):
+        # Update in chunks, each within it's own transaction. This
+        # keeps locks short lived.
+        chunk_size = modules.indexing.update_chunk_size
+        pks = list(documents.values_list('pk', flat=True))
+        for i in six.moves.range(0, len(pks), chunk_size):
+            chunk = documents.filter(pk__in=pks[i:i + chunk_size])
+            with transaction.atomic():
+                self.update_index_chunk(index, list(chunk), shadow=shadow)
                 
-            # We also won't allow records who have haven't all 
-            # _unique_together fields populated. Clean them up.
-            q = Q()
-            for field_name in six.iterkeys(index._unique_together):
-                q |= Q(**{'%s__isnull' % field_name: True})
-            stale = model.objects.filter(q, document__in=documents)
-            stale.delete()
-            
+    def update_index_chunk(self, index, documents, shadow=False):
+        """
+        Writes the records for the given documents by comparing them
+        against the existing records. Only new, changed and vanished
+        records are written.
+        """
+        if shadow:
+            model = self.index_model_factory(index, shadow=True)
+            index_fields = index.original_fields
+        else:
+            model = self.index_model_factory(index)
+            index_fields = index.fields
+        connection = self.get_db_connection()
+        
+        fields = [field for field in model._meta.concrete_fields
+                  if not field.primary_key]
+        attnames = [field.attname for field in fields]
+        unique_together = [
+            model._meta.get_field(field_name).attname
+            for field_name, field in six.iteritems(index_fields)
+            if field_name == 'document' or field.varieties]
+        
+        def prepare(field, value):
+            # Compare values the way they are stored
+            return field.get_db_prep_save(value, connection)
+        
+        # Collect existing records for each unique key. Records lacking
+        # unique values are never matched and thus deleted. Unused
+        # fields are cleared on matched records.
+        existing = {}
+        obsolete = []
+        rows = (model.objects
+                .filter(document__in=[document.pk for document in documents])
+                .values_list('pk', *attnames))
+        for row in rows:
+            values = dict(zip(attnames, row[1:]))
+            key = tuple(values[attname] for attname in unique_together)
+            if key in existing:
+                obsolete.append(row[0])
+            else:
+                existing[key] = (row[0], values)
+        
+        created = []
+        updates = {}
+        with index.prefetching(documents):
             for document in documents:
-                records = index.build_records(document)
-                for record in records:
-                    model.objects.update_or_create(**dict(defaults=record, **{
-                        field_name: record[field_name]
-                        for field_name in six.iterkeys(index._unique_together)
-                    }))   
+                for record in index.build_records(document,
+                                                  fields=index_fields):
+                    values = {}
+                    for field in fields:
+                        value = record.get(field.name, None)
+                        if isinstance(value, models.Model):
+                            value = value.pk
+                        values[field.attname] = value
+                    
+                    key = tuple(values[attname] for attname in unique_together)
+                    if key not in existing:
+                        created.append(model(**values))
+                        continue
+                    
+                    pk, current = existing.pop(key)
+                    changed = tuple(sorted(
+                        (field.attname, values[field.attname])
+                        for field in fields
+                        if (values[field.attname] != current[field.attname]
+                            and prepare(field, values[field.attname])
+                            != prepare(field, current[field.attname]))
+                    ))
+                    if changed:
+                        # Group identical changes in a single update
+                        updates.setdefault(changed, []).append(pk)
+        
+        # Whatever remains has vanished
+        obsolete.extend(pk for pk, current in six.itervalues(existing))
+        
+        # Keep the amount of query parameters bounded
+        batch_size = modules.indexing.update_chunk_size
+        for i in six.moves.range(0, len(obsolete), batch_size):
+            model.objects.filter(pk__in=obsolete[i:i + batch_size]).delete()
+        for changed, pks in six.iteritems(updates):
+            for i in six.moves.range(0, len(pks), batch_size):
+                model.objects.filter(pk__in=pks[i:i + batch_size]) \
+                             .update(**dict(changed))
+        if created:
+            model.objects.bulk_create(created, batch_size=batch_size)
+
+    def facet_index(self, index, query):
+        model = self.index_model_factory(index)
+        queryset = self.get_search_queryset(index, query).order_by()
+        
+        facets = OrderedDict()
+        # Within a savepoint, so that a failure (on a stale structure)
+        # doesn't break the surrounding transaction.
+        with transaction.atomic():
+            for field_name, ranges in six.iteritems(query.facets):
+                field = model._meta.get_field(field_name)
+                if ranges is None:
+                    facets[field_name] = self.facet_values(queryset, field)
+                else:
+                    facets[field_name] = self.facet_ranges(
+                        queryset, field, ranges)
+        return facets
+        
+    def facet_values(self, queryset, field):
+        # Count in a single grouped query
+        rows = (queryset
+                .filter(**{'%s__isnull' % field.attname: False})
+                .values_list(field.attname)
+                .annotate(count=Count('pk'))
+                .order_by(field.attname))
+        return OrderedDict(rows)
+        
+    def facet_ranges(self, queryset, field, ranges):
+        # Assign each record to the first matching range and count
+        # for each range in a single grouped query.
+        qn = self.get_db_connection().ops.quote_name
+        column = '%s.%s' % (qn(field.model._meta.db_table), qn(field.column))
+        cases = []
+        params = []
+        for i, (low, high) in enumerate(ranges):
+            conditions = []
+            if low is not None:
+                conditions.append('%s >= %%s' % column)
+                params.append(low)
+            if high is not None:
+                conditions.append('%s < %%s' % column)
+                params.append(high)
+            cases.append('WHEN %s THEN %s' % (
+                ' AND '.join(conditions or ['1 = 1']), i))
+        
+        rows = (queryset
+                .filter(**{'%s__isnull' % field.attname: False})
+                .extra(select={'facet_range': 'CASE %s ELSE NULL END'
+                                              % ' '.join(cases)},
+                       select_params=params)
+                .values_list('facet_range')
+                .annotate(count=Count('pk')))
+        counts = dict(rows)
+        return OrderedDict(
+            (value, counts.get(i, 0)) for i, value in enumerate(ranges))
+        
+    JOIN_LOOKUPS = {
+        'exact': '= %s',
+        'gt': '> %s',
+        'gte': '>= %s',
+        'lt': '< %s',
+        'lte': '<= %s',
+    }
+    
+    def join_index(self, index, queryset, filters=None, order_by=None,
+                   **variety):
+        model = self.index_model_factory(index)
+        qn = self.get_db_connection().ops.quote_name
+        db_table = model._meta.db_table
+        
+        def column(field_name):
+            field = model._meta.get_field(field_name)
+            return '%s.%s' % (qn(db_table), qn(field.column))
+        
+        # Join the index on the queryset's documents
+        where = ['%s = %s.%s' % (
+            column('document'),
+            qn(queryset.model._meta.db_table),
+            qn(queryset.model._meta.pk.column))]
+        params = []
+        
+        # Only join records for the given variety
+        filters = dict(filters or {}, **variety)
+        for lookup, value in six.iteritems(filters):
+            field_name, _, lookup_type = lookup.partition('__')
+            lookup_type = lookup_type or 'exact'
+            if lookup_type not in self.JOIN_LOOKUPS:
+                raise ValueError("Unsupported lookup '%s'" % lookup)
+            where.append('%s %s' % (
+                column(field_name), self.JOIN_LOOKUPS[lookup_type]))
+            params.append(value)
+        
+        # Ordering is passed verbatim, so use the table name instead
+        # of a quoted column
+        ordering = []
+        for field_name in order_by or []:
+            prefix = '-' if field_name.startswith('-') else ''
+            field = model._meta.get_field(field_name.lstrip('-'))
+            ordering.append('%s%s.%s' % (prefix, db_table, field.column))
+        
+        queryset = queryset.extra(tables=[db_table], where=where,
+                                  params=params)
+        if ordering:
+            queryset = queryset.extra(order_by=ordering)
+        return queryset
 
     def clear_index(self, index, documents):
         """
@@ -282,8 +668,82 @@ class DatabaseIndexAdapter(indexing.IndexAdapter):
         """
         raise NotImplementedError()
 
-    def search_index(self, index, query):
+    def compile_filter(self, index, sq):
+        """
+        Compiles a search filter into Q objects for the index model.
         """
-        Searches the index
+        q = Q()
+        for child in sq.children:
+            if isinstance(child, SQ):
+                child = self.compile_filter(index, child)
+            else:
+                child = self.compile_lookup(index, *child)
+            if sq.connector == SQ.OR:
+                q |= child
+            else:
+                q &= child
+        if sq.negated:
+            q = ~q
+        return q
+        
+    def compile_lookup(self, index, lookup, value):
+        return Q(**{lookup: value})
+        
+    def get_search_queryset(self, index, query):
         """
-        raise NotImplementedError()
\ No newline at end of file
+        Returns the index records matching the given query.
+        """
+        model = self.index_model_factory(index)
+        queryset = model.objects.filter(
+            self.compile_filter(index, query.query_filter))
+        
+        # Search within a single variety, varieties which aren't
+        # filtered on default to their first variety.
+        filtered = query.get_filter_fields()
+        queryset = queryset.filter(**{
+            field_name: value
+            for field_name, value in six.iteritems(index.get_default_variety())
+            if field_name not in filtered
+        })
+        
+        # Only existing documents, records of deleted documents remain
+        # until these are cleared
+        documents = query.documents
+        if documents is None:
+            documents = index.get_queryset()
+        return queryset.filter(document__in=documents.values('pk'))
+        
+    def search_index(self, index, query):
+        queryset = self.get_search_queryset(index, query)
+        
+        # Records of several varieties can match a document, which is
+        # returned once. It is ordered on the lowest (or highest when
+        # descending) value among its records.
+        aggregates = {}
+        order_by = []
+        for i, field_name in enumerate(query.order_by):
+            descending = field_name.startswith('-')
+            field_name = field_name.lstrip('-')
+            if field_name == 'document':
+                # Order on the column itself to prevent a join with
+                # the document's table.
+                alias = 'document_id'
+            else:
+                alias = 'order_%s' % i
+                aggregate = Max if descending else Min
+                aggregates[alias] = aggregate(field_name)
+            order_by.append('-' + alias if descending else alias)
+        # Make sure ordering is consistent
+        if not any(field_name.lstrip('-') == 'document_id'
+                   for field_name in order_by):
+            order_by.append('document_id')
+        
+        queryset = queryset.values('document')
+        if aggregates:
+            queryset = queryset.annotate(**aggregates)
+        else:
+            queryset = queryset.distinct()
+        queryset = queryset.order_by(*order_by)
+        with transaction.atomic():
+            return [row['document'] for row
+                    in queryset[query.low_mark:query.high_mark]]
\ No newline at end of file
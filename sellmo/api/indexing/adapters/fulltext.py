@@ -0,0 +1,314 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import re
+import math
+import hashlib
+from collections import Counter, defaultdict
+
+from django.db import models
+from django.db.models import Q, Count, Avg
+from django.utils import six
+from django.utils.encoding import force_text
+
+from sellmo import modules
+from sellmo.api import indexing
+from sellmo.api.indexing.search import SQ
+from sellmo.api.indexing.adapters.database import DatabaseIndexAdapter
+
+
+class FullTextIndexAdapter(DatabaseIndexAdapter):
+    
+    """
+    Adds full text search to the database adapter. Text fields are
+    tokenized into an inverted index, kept in tables next to the index
+    table, which is searched with the `search` lookup:
+    
+        products.indexed_filter(description__search='red sho*')
+    
+    All terms need to match, a trailing * matches terms by prefix.
+    Unless ordered otherwise, matches are ranked using BM25.
+    """
+    
+    #: BM25 term frequency saturation
+    k1 = 1.2
+    #: BM25 document length normalization
+    b = 0.75
+    
+    term_max_length = 64
+    
+    TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+    QUERY_RE = re.compile(r'(\w+)(\*?)', re.UNICODE)
+    
+    def __init__(self):
+        super(FullTextIndexAdapter, self).__init__()
+        self._text_models = {}
+        
+    def get_text_fields(self, fields):
+        return [field_name for field_name, field in six.iteritems(fields)
+                if isinstance(field, indexing.TextField)]
+        
+    def text_model_factory(self, index):
+        """
+        Returns the term and length models of the given index, their
+        tables are created when missing.
+        """
+        if index.name not in self._text_models:
+            app_label = index.model._meta.app_label
+            db_table = self.get_index_db_table(index)
+            
+            class TermMeta:
+                managed = False
+                index_together = [('field', 'term')]
+            TermMeta.app_label = app_label
+            TermMeta.db_table = '%s_terms' % db_table
+            
+            class LengthMeta:
+                managed = False
+            LengthMeta.app_label = app_label
+            LengthMeta.db_table = '%s_lengths' % db_table
+            
+            name = '%sIndexTerm' % index.name
+            self.unregister_model(app_label, name)
+            term_model = type(str(name), (models.Model,), {
+                'Meta': TermMeta,
+                '__module__': index.__module__,
+                'document': models.IntegerField(db_index=True),
+                'field': models.CharField(max_length=64),
+                'term': models.CharField(max_length=self.term_max_length),
+                'frequency': models.IntegerField(),
+            })
+            
+            name = '%sIndexLength' % index.name
+            self.unregister_model(app_label, name)
+            length_model = type(str(name), (models.Model,), {
+                'Meta': LengthMeta,
+                '__module__': index.__module__,
+                'document': models.IntegerField(db_index=True),
+                'field': models.CharField(max_length=64),
+                'length': models.IntegerField(),
+                'digest': models.CharField(max_length=32),
+            })
+            
+            connection = self.get_db_connection()
+            with connection.cursor() as cursor:
+                db_tables = connection.introspection.table_names(cursor)
+            missing = [model for model in [term_model, length_model]
+                       if model._meta.db_table not in db_tables]
+            if missing:
+                with connection.schema_editor() as editor:
+                    for model in missing:
+                        editor.create_model(model)
+            
+            self._text_models[index.name] = (term_model, length_model)
+        return self._text_models[index.name]
+        
+    def tokenize(self, text):
+        return [token[:self.term_max_length]
+                for token in self.TOKEN_RE.findall(force_text(text).lower())]
+        
+    def parse_query(self, text):
+        """
+        Returns a (term, prefix) tuple for each term in the given query.
+        """
+        return [(term[:self.term_max_length], bool(prefix))
+                for term, prefix
+                in self.QUERY_RE.findall(force_text(text).lower())]
+        
+    def get_term_filter(self, field_name, term, prefix):
+        if prefix:
+            return Q(field=field_name, term__startswith=term)
+        return Q(field=field_name, term=term)
+        
+    def update_index(self, index, documents, shadow=False):
+        # Make sure the text tables exist before writing in chunks
+        fields = index.original_fields if shadow else index.fields
+        if self.get_text_fields(fields):
+            self.text_model_factory(index)
+        super(FullTextIndexAdapter, self).update_index(
+            index, documents, shadow=shadow)
+        
+    def update_index_chunk(self, index, documents, shadow=False):
+        super(FullTextIndexAdapter, self).update_index_chunk(
+            index, documents, shadow=shadow)
+        fields = index.original_fields if shadow else index.fields
+        text_fields = self.get_text_fields(fields)
+        if text_fields:
+            model = self.index_model_factory(index, shadow=shadow)
+            self.update_terms(index, model, text_fields,
+                              [document.pk for document in documents])
+            
+    def update_terms(self, index, model, text_fields, pks):
+        """
+        Tokenizes the text fields of the given documents, taken from
+        the record of their default variety. Only changed texts are
+        written.
+        """
+        term_model, length_model = self.text_model_factory(index)
+        variety = index.get_default_variety()
+        
+        texts = {}
+        rows = (model.objects.filter(document__in=pks, **variety)
+                             .values_list('document', *text_fields))
+        for row in rows:
+            for field_name, text in zip(text_fields, row[1:]):
+                texts[(row[0], field_name)] = text or u''
+        
+        digests = {
+            (document, field_name): digest
+            for document, field_name, digest
+            in length_model.objects.filter(document__in=pks)
+                                   .values_list('document', 'field', 'digest')
+        }
+        
+        changed = []
+        terms = []
+        lengths = []
+        for (document, field_name), text in six.iteritems(texts):
+            digest = hashlib.md5(force_text(text).encode('utf-8')).hexdigest()
+            if digests.pop((document, field_name), None) == digest:
+                continue
+            changed.append((document, field_name))
+            tokens = self.tokenize(text)
+            lengths.append(length_model(
+                document=document, field=field_name,
+                length=len(tokens), digest=digest))
+            terms.extend(
+                term_model(document=document, field=field_name,
+                           term=term, frequency=frequency)
+                for term, frequency in six.iteritems(Counter(tokens)))
+        
+        # Whatever remains has vanished
+        changed.extend(six.iterkeys(digests))
+        
+        grouped = defaultdict(list)
+        for document, field_name in changed:
+            grouped[field_name].append(document)
+        for field_name, documents in six.iteritems(grouped):
+            term_model.objects.filter(
+                field=field_name, document__in=documents).delete()
+            length_model.objects.filter(
+                field=field_name, document__in=documents).delete()
+        
+        batch_size = modules.indexing.update_chunk_size
+        term_model.objects.bulk_create(terms, batch_size=batch_size)
+        length_model.objects.bulk_create(lengths, batch_size=batch_size)
+        
+    def compile_lookup(self, index, lookup, value):
+        field_name, _, lookup_type = lookup.rpartition('__')
+        if lookup_type != 'search':
+            return super(FullTextIndexAdapter, self).compile_lookup(
+                index, lookup, value)
+        if field_name not in self.get_text_fields(index.fields):
+            raise ValueError("Field '%s' is not a text field" % field_name)
+        
+        # Each term needs to match
+        term_model, length_model = self.text_model_factory(index)
+        terms = self.parse_query(value)
+        if not terms:
+            return Q(pk__in=[])
+        q = Q()
+        for term, prefix in terms:
+            q &= Q(document__in=(
+                term_model.objects
+                .filter(self.get_term_filter(field_name, term, prefix))
+                .values('document')))
+        return q
+        
+    def get_searches(self, sq):
+        """
+        Returns a (field name, text) tuple for each search lookup in
+        the given filter which doesn't exclude.
+        """
+        searches = []
+        if sq.negated:
+            return searches
+        for child in sq.children:
+            if isinstance(child, SQ):
+                searches.extend(self.get_searches(child))
+            else:
+                lookup, value = child
+                field_name, _, lookup_type = lookup.rpartition('__')
+                if lookup_type == 'search':
+                    searches.append((field_name, value))
+        return searches
+        
+    def search_index(self, index, query):
+        searches = self.get_searches(query.query_filter)
+        if not searches or query.order_by:
+            return super(FullTextIndexAdapter, self).search_index(
+                index, query)
+        
+        queryset = self.get_search_queryset(index, query)
+        documents = queryset.values('document')
+        scores = defaultdict(float)
+        for field_name, text in searches:
+            self.score(index, field_name, text, documents, scores)
+        
+        # Rank by score, ties are broken by document
+        pks = list(queryset.order_by().values_list('document', flat=True)
+                   .distinct())
+        pks.sort(key=lambda pk: (-scores[pk], pk))
+        return pks[query.low_mark:query.high_mark]
+        
+    def score(self, index, field_name, text, documents, scores):
+        """
+        Adds the BM25 score of the given text for each of the given
+        documents to scores.
+        """
+        term_model, length_model = self.text_model_factory(index)
+        
+        totals = (length_model.objects.filter(field=field_name)
+                  .aggregate(count=Count('pk'), length=Avg('length')))
+        count = float(totals['count'])
+        average_length = totals['length'] or 1.0
+        lengths = dict(length_model.objects
+                       .filter(field=field_name, document__in=documents)
+                       .values_list('document', 'length'))
+        
+        for term, prefix in self.parse_query(text):
+            term_filter = self.get_term_filter(field_name, term, prefix)
+            matches = (term_model.objects.filter(term_filter)
+                       .values('document').distinct().count())
+            idf = math.log(1 + (count - matches + 0.5) / (matches + 0.5))
+            
+            # A prefix can match multiple terms within a document
+            frequencies = defaultdict(int)
+            rows = (term_model.objects
+                    .filter(term_filter, document__in=documents)
+                    .values_list('document', 'frequency'))
+            for document, frequency in rows:
+                frequencies[document] += frequency
+            
+            for document, frequency in six.iteritems(frequencies):
+                length = lengths.get(document, 0)
+                scores[document] += idf * frequency * (self.k1 + 1) / (
+                    frequency + self.k1 * (
+                        1 - self.b + self.b * length / average_length))
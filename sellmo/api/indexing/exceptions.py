@@ -41,4 +41,8 @@ class IndexInvalidatedException(IndexExceptionBase):
 
 
 class IndexFieldException(IndexExceptionBase):
+    pass
+    
+    
+class IndexBackendException(IndexExceptionBase):
     pass
\ No newline at end of file
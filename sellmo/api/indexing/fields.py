@@ -34,9 +34,12 @@ class IndexField(object):
     creation_counter = 0
     
     def __init__(self, populate_value_cb=None,
-                    varieties=None, **kwargs):
+                    varieties=None, depends_on=None, **kwargs):
         self.populate_value_cb = populate_value_cb
         self.varieties = varieties
+        # Names of the variety fields this field's value depends on,
+        # None if it (possibly) depends on all of them.
+        self.depends_on = depends_on
         self.required = varieties is not None
         if 'default' in kwargs:
             self.default = kwargs['default']
@@ -87,10 +90,14 @@ class CharField(IndexField):
         self.max_length = max_length
         
     def __eq__(self, other):
-        return (super(ModelField, self).__eq__(other)
+        return (super(CharField, self).__eq__(other)
                 and self.max_length == other.max_length)
     
     
+class TextField(IndexField):
+    pass
+    
+    
 class IntegerField(IndexField):
     pass
     
@@ -31,12 +31,15 @@
 import logging
 import copy
 import itertools
+import threading
+from contextlib import contextmanager
 from collections import OrderedDict
 
 from django.utils import six
 from django.db import models
 
 from sellmo import modules
+from sellmo.signals.indexing import index_updated
 from sellmo.api.indexing.fields import IndexField, ModelField
 from sellmo.api.indexing.exceptions import IndexInvalidatedException, IndexFieldException
 from sellmo.api.indexing.query import indexed_queryset_factory
@@ -84,7 +87,8 @@ class IndexMetaClass(type):
             declared_fields['document'] = ModelField(
                 model,
                 required=True,
-                populate_value_cb=(lambda document, **variety: document))
+                populate_value_cb=(lambda document, **variety: document),
+                depends_on=[])
         
         new_class.base_fields = declared_fields
         new_class.declared_fields = declared_fields
@@ -105,6 +109,16 @@ class Index(six.with_metaclass(IndexMetaClass, object)):
     introspected_fields = None
     difference = None
     
+    # When the index was last checked for being stale
+    checked = None
+    
+    # Whether a new structure is being built alongside the current one
+    rebuilding = False
+    
+    # Whether the structure was (re)built empty when this index was
+    # created
+    built = False
+    
     _invalidated = False
     
     def __init__(self, name, adapter):
@@ -113,6 +127,7 @@ class Index(six.with_metaclass(IndexMetaClass, object)):
         self.name = name
         self.adapter = adapter
         self.fields = self.get_fields()
+        self._prefetched = threading.local()
         
     def get_fields(self):
         return copy.deepcopy(self.base_fields)
@@ -120,38 +135,119 @@ class Index(six.with_metaclass(IndexMetaClass, object)):
     def populate(self, document, values, **variety):
         return values
         
-    def build_records(self, document):
-        # Create all possible varieties
+    def populate_document(self, document):
+        """
+        Returns values which are the same for each variety of the given
+        document, these are resolved once per document.
+        """
+        return {}
+        
+    def iter_varieties(self, fields=None):
+        if fields is None:
+            fields = self.fields
+        
+        # Lazily create all possible varieties
         varieties = itertools.product(*[
             [(field_name, variety) for variety in field.varieties] 
-            for field_name, field in six.iteritems(self.fields)
+            for field_name, field in six.iteritems(fields)
             if field.varieties
         ])
         
-        results = []
-        for variety in  varieties:
+        # Unpack to dicts
+        for variety in varieties:
+            yield { key: value for key, value in variety }
+        
+    def get_varieties(self):
+        return list(self.iter_varieties())
+        
+    def get_default_variety(self):
+        # The first variety of each field
+        return {
+            field_name: field.varieties[0]
+            for field_name, field in six.iteritems(self.fields)
+            if field.varieties
+        }
+        
+    def get_variety(self, **kwargs):
+        """
+        Resolves the variety matching the given context (for instance
+        the kwargs of a chain), varieties missing from the context
+        fall back to the default variety.
+        """
+        variety = self.get_default_variety()
+        for field_name in variety:
+            value = kwargs.get(field_name, None)
+            if value is not None and value in self.fields[field_name].varieties:
+                variety[field_name] = value
+        return variety
+        
+    def prefetch(self, documents):
+        """
+        Called with the documents about to be build, allowing the index to
+        resolve values for all of them at once. Should return a mapping
+        which is available through `self.prefetched` during `populate`.
+        """
+        return {}
+        
+    @contextmanager
+    def prefetching(self, documents):
+        self._prefetched.value = self.prefetch(documents)
+        try:
+            yield
+        finally:
+            del self._prefetched.value
             
-            # Unpack to dict
-            variety = { key: value for key, value in variety }
+    @property
+    def prefetched(self):
+        return getattr(self._prefetched, 'value', {})
+        
+    def build_records(self, document, fields=None):
+        """
+        Yields a record for each variety of the given document. Values
+        which don't depend on (all) varieties are resolved only once.
+        """
+        if fields is None:
+            fields = self.fields
+        
+        populated = {}
+        document_values = self.populate_document(document)
+        
+        for variety in self.iter_varieties(fields):
             
-            values = {}
+            values = dict(document_values)
             missing = {}
             
             # First get values from each seperate field
-            for field_name, field in six.iteritems(self.fields):
+            for field_name, field in six.iteritems(fields):
                 if field_name in variety:
                     values[field_name] = variety[field_name]
-                else:
+                    continue
+                
+                if field.depends_on is None:
                     has_value, value = field.populate_field(document, **variety)
-                    if has_value:
-                        values[field_name] = value
-                    else:
-                        missing[field_name] = field
+                else:
+                    # Only pass (and cache on) the varieties this field
+                    # depends on.
+                    depends_on = {
+                        key: variety[key]
+                        for key in field.depends_on
+                        if key in variety
+                    }
+                    key = (field_name, tuple(sorted(depends_on.items())))
+                    if key not in populated:
+                        populated[key] = field.populate_field(
+                            document, **depends_on)
+                    has_value, value = populated[key]
+                
+                if has_value:
+                    values[field_name] = value
+                else:
+                    missing[field_name] = field
             
             # Now allow index to provide additonal values
             result = {}
             for field_name, value in six.iteritems(self.populate(document, values, **variety)):
-                if field_name not in self.fields:
+                if field_name not in fields:
                     logger.info("Value %s for field %s will be omitted from index" % (value, field_name))
                     continue
                 missing.pop(field_name, None)
@@ -161,9 +257,7 @@ class Index(six.with_metaclass(IndexMetaClass, object)):
                 if field.required:
                     raise IndexFieldException("%s is required" % field_name)
                     
-            results.append(result)
-        
-        return results
+            yield result
         
     def _not_invalidated(self):
         if self._invalidated:
@@ -181,17 +275,85 @@ class Index(six.with_metaclass(IndexMetaClass, object)):
         modules.indexing._invalidate_index(self)
         self._invalidated = True
         
+    def _call_adapter(self, method, *args, **kwargs):
+        """
+        Calls the given adapter method. Another process might have
+        swapped in a rebuilt structure, which would otherwise only be
+        noticed after INDEX_STALE_CHECK_INTERVAL seconds. Should the
+        call fail because of that, the index is re-created right away
+        and the call is retried on the new index.
+        """
+        if self._invalidated:
+            # Re-created after a failed call, for instance while an
+            # indexed queryset still refers to this index.
+            index = modules.indexing.get_index(name=self.name)
+            return getattr(index.adapter, method)(index, *args, **kwargs)
+        try:
+            return getattr(self.adapter, method)(self, *args, **kwargs)
+        except Exception:
+            if self.rebuilding or not self.adapter.is_stale(self):
+                raise
+        self.invalidate()
+        index = modules.indexing.get_index(name=self.name)
+        return getattr(index.adapter, method)(index, *args, **kwargs)
+        
     def search(self, query):
-        self._not_invalidated()
-        return self.adapter.search_index(self, query)
+        return self._call_adapter('search_index', query)
+        
+    def facet(self, query):
+        return self._call_adapter('facet_index', query)
         
     def update(self, queryset=None):
         self._not_invalidated()
-        self.adapter.update_index(self, self.get_queryset(queryset))
+        queryset = self.get_queryset(queryset)
+        self._call_adapter('update_index', queryset)
+        if self.rebuilding:
+            # Keep the structure being rebuilt up to date as well
+            self.adapter.backfill_index(self, queryset)
+        index_updated.send(sender=self.__class__, index=self)
+        
+    def backfill(self, queryset=None):
+        """
+        Indexes documents into the structure being rebuilt. Searches
+        keep using the current structure until it is swapped.
+        """
+        self._not_invalidated()
+        if not self.rebuilding:
+            raise ValueError("Index is not being rebuilt.")
+        self.adapter.backfill_index(self, self.get_queryset(queryset))
+        
+    def swap(self):
+        """
+        Swaps in the rebuilt structure, from then on all declared
+        fields are used.
+        """
+        self._not_invalidated()
+        if not self.rebuilding:
+            raise ValueError("Index is not being rebuilt.")
+        self.adapter.swap_index(self)
+        self.rebuilding = False
+        self.fields = self.original_fields
+        self.introspected_fields = self.original_fields
+        self.difference = None
+        self.adapter.initialize_index(self)
+        index_updated.send(sender=self.__class__, index=self)
         
     def clear(self, queryset=None):
         self._not_invalidated()
-        self.adapter.clear_index(self, self.get_queryset(queryset))
+        self._call_adapter('clear_index', self.get_queryset(queryset))
+        index_updated.send(sender=self.__class__, index=self)
+        
+    def join(self, queryset, filters=None, order_by=None, **variety):
+        """
+        Filters (a mapping of field lookups to values) and orders the
+        given queryset on the indexed values of a single variety,
+        the default variety unless given. Only indexed documents
+        remain.
+        """
+        self._not_invalidated()
+        variety = dict(self.get_default_variety(), **variety)
+        return self.adapter.join_index(self, queryset, filters=filters,
+                                       order_by=order_by, **variety)
         
     def get_indexed_queryset(self, queryset=None):
         self._not_invalidated()
@@ -29,7 +29,11 @@
 
 
 from django.db.models.query import QuerySet
+from django.utils import six
 
+from sellmo import modules
+
+from sellmo.core.query import PKIterator
 from sellmo.api.indexing.search import SQ, SearchQuery
 
 
@@ -54,10 +58,82 @@ def indexed_queryset_factory(queryset, index):
 
 class IndexedQuerySet(QuerySet):
 
+    """
+    Once filtered, ordered or sliced on the index, documents are
+    searched for in the index first and fetched by their pks
+    afterwards, keeping the order of the index.
+    """
+
+    def _is_indexed(self):
+        return not self.index_query.is_empty()
+
+    def _get_search_query(self):
+        # Restrict the search to the documents matching this queryset,
+        # adapters are free to use the queryset as a subquery.
+        documents = self._clone(klass=QuerySet)
+        query = self.index_query.clone()
+        if documents.query.where:
+            query.documents = documents
+        return documents, query
+
+    def _search(self):
+        documents, query = self._get_search_query()
+        return documents, self.index.search(query)
+
+    def facet(self, *fields, **ranges):
+        """
+        Counts the matching documents for each value of the given
+        fields, or for each of the given (low, high) ranges of a field:
+        
+            products.facet('color_attr', price_eur_amount=[(0, 10),
+                                                           (10, None)])
+        """
+        documents, query = self._get_search_query()
+        query.clear_order_by()
+        query.clear_limits()
+        for field_name in fields:
+            query.add_facet(field_name)
+        for field_name, value in sorted(six.iteritems(ranges)):
+            query.add_facet(field_name, value)
+        return modules.indexing.get_facets(name=self.index.name, query=query)
+
     def iterator(self):
-        indexes = self.index.search(self.index_query)
-        for row in super(IndexedQuerySet, self).iterator():
+        if not self._is_indexed():
+            for row in super(IndexedQuerySet, self).iterator():
+                yield row
+            return
+
+        documents, pks = self._search()
+        for row in PKIterator(documents, pks, stream=True):
             yield row
+
+    def count(self):
+        if not self._is_indexed() or self._result_cache is not None:
+            return super(IndexedQuerySet, self).count()
+        return len(self._search()[1])
+
+    def exists(self):
+        if not self._is_indexed() or self._result_cache is not None:
+            return super(IndexedQuerySet, self).exists()
+        return bool(self.count())
+
+    def __getitem__(self, k):
+        if not self._is_indexed() or self._result_cache is not None:
+            return super(IndexedQuerySet, self).__getitem__(k)
+
+        # Slice the index instead
+        if isinstance(k, slice):
+            if ((k.start is not None and k.start < 0) or 
+                    (k.stop is not None and k.stop < 0)):
+                raise ValueError("Negative indexing is not supported.")
+            clone = self._clone()
+            clone.index_query.set_limits(k.start, k.stop)
+            return list(clone)[::k.step] if k.step else clone
+        if k < 0:
+            raise ValueError("Negative indexing is not supported.")
+        clone = self._clone()
+        clone.index_query.set_limits(k, k + 1)
+        return list(clone)[0]
             
     def _indexed_filter_or_exclude(self, negate, *args, **kwargs):
         clone = self._clone()
@@ -67,10 +143,11 @@ class IndexedQuerySet(QuerySet):
             clone.index_query.add_filter(SQ(*args, **kwargs))
         return clone
         
-    def _clone(self, **kwargs):
-        clone = super(IndexedQuerySet, self)._clone()
-        clone.index = self.index
-        clone.index_query = self.index_query.clone()
+    def _clone(self, klass=None, **kwargs):
+        clone = super(IndexedQuerySet, self)._clone(klass=klass, **kwargs)
+        if isinstance(clone, IndexedQuerySet):
+            clone.index = self.index
+            clone.index_query = self.index_query.clone()
         return clone
     
     def indexed_filter(self, *args, **kwargs):
@@ -81,5 +158,6 @@ class IndexedQuerySet(QuerySet):
         
     def indexed_order_by(self, *args):
         clone = self._clone()
+        clone.index_query.clear_order_by()
         clone.index_query.add_order_by(*args)
-        return clone
\ No newline at end of file
+        return clone
@@ -28,6 +28,8 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+from collections import OrderedDict
+
 from django.utils import six
 from django.utils import tree
 
@@ -78,24 +80,112 @@ class SQ(tree.Node):
 
     
 class SearchQuery(object):
+    """
+    Describes a search against an index; filters, ordering and limits.
+    Adapters compile it into their own query language.
+    """
 
     def __init__(self):
         self.query_filter = SQ()
-    
+        self.order_by = []
+        self.low_mark = 0
+        self.high_mark = None
+        # Documents to search in, a queryset, or None for all documents
+        self.documents = None
+        # Fields to count values for, mapped to their ranges (if any)
+        self.facets = OrderedDict()
+
     def add_filter(self, sq):
-        pass
-        
-    def add_order_by(self):
-        pass
-        
+        if self.query_filter:
+            self.query_filter = self.query_filter & sq
+        else:
+            self.query_filter = sq
+
+    def add_order_by(self, *fields):
+        self.order_by.extend(fields)
+
+    def clear_order_by(self):
+        self.order_by = []
+
     def set_limits(self, low=None, high=None):
-        pass
-        
-    def add_facet(self):
-        pass
+        # Limits are relative to the current limits, as with Django's
+        # querysets.
+        if high is not None:
+            if self.high_mark is not None:
+                self.high_mark = min(self.high_mark, self.low_mark + high)
+            else:
+                self.high_mark = self.low_mark + high
+        if low is not None:
+            if self.high_mark is not None:
+                self.low_mark = min(self.high_mark, self.low_mark + low)
+            else:
+                self.low_mark = self.low_mark + low
+
+    def clear_limits(self):
+        self.low_mark, self.high_mark = 0, None
+
+    def has_limits(self):
+        return self.low_mark != 0 or self.high_mark is not None
+
+    def is_empty(self):
+        """
+        Returns True if this query neither filters, orders nor limits.
+        """
+        return not (self.query_filter or self.order_by or self.has_limits())
+
+    def get_filter_fields(self):
+        """
+        Returns the names of all fields being filtered on.
+        """
+        fields = set()
+        nodes = [self.query_filter]
+        while nodes:
+            for child in nodes.pop().children:
+                if isinstance(child, SQ):
+                    nodes.append(child)
+                else:
+                    fields.add(child[0].split('__', 1)[0])
+        return fields
         
+    def add_facet(self, field_name, ranges=None):
+        """
+        Counts documents for each value of the given field, or for each
+        of the given (low, high) ranges. Lows are inclusive, highs are
+        exclusive, either can be None.
+        """
+        if ranges is not None:
+            ranges = tuple(tuple(value) for value in ranges)
+        self.facets[field_name] = ranges
+
+    def clear_facets(self):
+        self.facets = OrderedDict()
+
+    def get_filter_key(self):
+        """
+        Returns a canonical representation of the documents matched by
+        this query, ordering and limits do not matter.
+        """
+        def canonical(sq):
+            children = sorted(
+                canonical(child) if isinstance(child, SQ) else repr(child)
+                for child in sq.children)
+            return '%s%s(%s)' % ('NOT ' if sq.negated else '',
+                                 sq.connector, ', '.join(children))
+
+        documents = None
+        if self.documents is not None:
+            documents = self.documents.query.sql_with_params()
+        return (canonical(self.query_filter), repr(documents))
+
     def clone(self):
-        return self
+        clone = self.__class__()
+        clone.query_filter = self.query_filter.clone()
+        clone.order_by = list(self.order_by)
+        clone.low_mark = self.low_mark
+        clone.high_mark = self.high_mark
+        clone.documents = self.documents
+        clone.facets = OrderedDict(self.facets)
+        return clone
         
         
 class SearchResultSet(object):
@@ -0,0 +1,262 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import TestCase
+
+from sellmo import modules, params
+from sellmo.api import indexing
+from sellmo.api.indexing.search import SQ, SearchQuery
+from sellmo.api.indexing.adapters.database import DatabaseIndexAdapter
+from sellmo.api.indexing.adapters.fulltext import FullTextIndexAdapter
+
+
+# Texts and featured state of the products indexed by these tests,
+# keyed by slug.
+TEXTS = {
+    'long-red-shoe': (u"Red shoe with a very long description of many "
+                      u"other words", False),
+    'red-red-shoe': (u"Red red shoe", True),
+    'shoe': (u"Shoe", True),
+    'short-horse': (u"Short horse", False),
+}
+
+
+class TextIndex(indexing.Index):
+    model = modules.product.Product
+    text = indexing.TextField(
+        populate_value_cb=lambda document, **variety: (
+            TEXTS[document.slug][0]))
+    featured = indexing.BooleanField(
+        populate_value_cb=lambda document, **variety: (
+            TEXTS[document.slug][1]))
+
+
+class VarietyIndex(indexing.Index):
+    model = modules.product.Product
+    price = indexing.DecimalField(
+        max_digits=9, decimal_places=2,
+        populate_value_cb=lambda document, qty, **variety: (
+            PRICES[document.slug] * qty),
+        depends_on=['qty'])
+    qty = indexing.IntegerField(varieties=[1, 10])
+
+
+# Prices of the products indexed by the variety tests, keyed by slug.
+PRICES = {
+    'cheap': 1,
+    'medium': 5,
+    'expensive': 20,
+}
+
+
+def create_index(index_cls, name, adapter):
+    params.building_indexes = True
+    try:
+        return modules.indexing.create_index(
+            index_cls=index_cls, name=name, adapter=adapter)
+    finally:
+        params.building_indexes = False
+
+
+class FullTextIndexAdapterTestCase(TestCase):
+
+    """
+    Runs against the test database, the index tables are created (and
+    rolled back) within each test.
+    """
+
+    def setUp(self):
+        self.adapter = FullTextIndexAdapter()
+        self.index = create_index(TextIndex, 'fulltexttest', self.adapter)
+        self.products = {
+            slug: modules.product.Product.objects.create(slug=slug)
+            for slug in TEXTS
+        }
+        self.index.update()
+
+    def get_pks(self, *slugs):
+        return [self.products[slug].pk for slug in slugs]
+
+    def search(self, *args, **kwargs):
+        products = self.index.get_indexed_queryset()
+        return [product.pk
+                for product in products.indexed_filter(*args, **kwargs)]
+
+    def test_tokenize(self):
+        self.assertEqual(self.adapter.tokenize(u"Red, SHOE-laces 42!"),
+                         [u'red', u'shoe', u'laces', u'42'])
+        self.assertEqual(self.adapter.tokenize(u"Caf\xe9"), [u'caf\xe9'])
+        self.assertEqual(
+            self.adapter.tokenize(u'a' * 100),
+            [u'a' * self.adapter.term_max_length])
+
+    def test_parse_query(self):
+        self.assertEqual(self.adapter.parse_query(u"sho* RED"),
+                         [(u'sho', True), (u'red', False)])
+        self.assertEqual(self.adapter.parse_query(u"* !"), [])
+
+    def test_search_matches_all_terms(self):
+        self.assertEqual(
+            sorted(self.search(text__search=u"red shoe")),
+            sorted(self.get_pks('long-red-shoe', 'red-red-shoe')))
+        self.assertEqual(self.search(text__search=u"horse"),
+                         self.get_pks('short-horse'))
+        self.assertEqual(self.search(text__search=u"red horse"), [])
+        self.assertEqual(self.search(text__search=u"!"), [])
+
+    def test_search_by_prefix(self):
+        self.assertEqual(
+            sorted(self.search(text__search=u"sho*")),
+            sorted(self.get_pks(
+                'long-red-shoe', 'red-red-shoe', 'shoe', 'short-horse')))
+        self.assertEqual(
+            sorted(self.search(text__search=u"sho* r*")),
+            sorted(self.get_pks('long-red-shoe', 'red-red-shoe')))
+        # Without a trailing * terms match as a whole
+        self.assertEqual(self.search(text__search=u"sho"), [])
+
+    def test_search_ranks_by_bm25(self):
+        # Shorter texts rank higher
+        self.assertEqual(
+            self.search(text__search=u"shoe"),
+            self.get_pks('shoe', 'red-red-shoe', 'long-red-shoe'))
+        # So do more frequent terms
+        self.assertEqual(
+            self.search(text__search=u"red shoe"),
+            self.get_pks('red-red-shoe', 'long-red-shoe'))
+
+    def test_search_ordered_and_sliced(self):
+        products = (self.index.get_indexed_queryset()
+                    .indexed_filter(text__search=u"shoe"))
+        pks = sorted(self.get_pks('shoe', 'red-red-shoe', 'long-red-shoe'))
+        # Ordering replaces ranking
+        self.assertEqual(
+            [product.pk for product
+             in products.indexed_order_by('-document')],
+            pks[::-1])
+        self.assertEqual(
+            [product.pk for product in products[1:3]],
+            self.get_pks('red-red-shoe', 'long-red-shoe'))
+        self.assertEqual(products.count(), 3)
+
+    def test_search_with_filters(self):
+        self.assertEqual(
+            self.search(text__search=u"shoe", featured=True),
+            self.get_pks('shoe', 'red-red-shoe'))
+        self.assertEqual(
+            sorted(self.search(SQ(text__search=u"red") |
+                               SQ(text__search=u"horse"))),
+            sorted(self.get_pks(
+                'long-red-shoe', 'red-red-shoe', 'short-horse')))
+        self.assertEqual(
+            self.search(SQ(text__search=u"shoe") & ~SQ(featured=True)),
+            self.get_pks('long-red-shoe'))
+        products = (self.index.get_indexed_queryset()
+                    .indexed_exclude(text__search=u"red"))
+        self.assertEqual(
+            sorted(product.pk for product in products),
+            sorted(self.get_pks('shoe', 'short-horse')))
+
+    def test_search_within_queryset(self):
+        products = self.index.get_indexed_queryset(
+            modules.product.Product.objects.exclude(slug='shoe'))
+        self.assertEqual(
+            [product.pk for product
+             in products.indexed_filter(text__search=u"shoe")],
+            self.get_pks('red-red-shoe', 'long-red-shoe'))
+
+    def test_search_with_facets(self):
+        query = SearchQuery()
+        query.add_filter(SQ(text__search=u"sho*"))
+        query.add_facet('featured')
+        facets = self.index.facet(query)
+        self.assertEqual(dict(facets['featured']), {False: 2, True: 2})
+
+        query = SearchQuery()
+        query.add_filter(SQ(text__search=u"red"))
+        query.add_facet('featured')
+        facets = self.index.facet(query)
+        self.assertEqual(dict(facets['featured']), {False: 1, True: 1})
+
+    def test_update_changed_texts(self):
+        product = self.products['shoe']
+        TEXTS['shoe'] = (u"Boot", True)
+        try:
+            self.index.update(
+                modules.product.Product.objects.filter(pk=product.pk))
+            self.assertEqual(self.search(text__search=u"boot"),
+                             [product.pk])
+            self.assertNotIn(product.pk, self.search(text__search=u"shoe"))
+        finally:
+            TEXTS['shoe'] = (u"Shoe", True)
+
+    def test_search_requires_text_field(self):
+        with self.assertRaises(ValueError):
+            self.search(featured__search=u"shoe")
+
+
+class DatabaseIndexAdapterTestCase(TestCase):
+
+    def setUp(self):
+        self.index = create_index(VarietyIndex, 'varietytest',
+                                  DatabaseIndexAdapter())
+        self.products = {
+            slug: modules.product.Product.objects.create(slug=slug)
+            for slug in PRICES
+        }
+        self.index.update()
+
+    def get_pks(self, *slugs):
+        return [self.products[slug].pk for slug in slugs]
+
+    def test_search_across_varieties(self):
+        # Documents matching records of both varieties are found once
+        products = (self.index.get_indexed_queryset()
+                    .indexed_filter(qty__gte=1, price__lte=50))
+        self.assertEqual(sorted(product.pk for product in products),
+                         sorted(self.get_pks('cheap', 'medium', 'expensive')))
+        self.assertEqual(products.count(), 3)
+        # Ordered on the lowest, or highest, matching value. At 10
+        # each, only a single expensive product is within the filter.
+        self.assertEqual(
+            [product.pk for product in products.indexed_order_by('price')],
+            self.get_pks('cheap', 'medium', 'expensive'))
+        self.assertEqual(
+            [product.pk for product in products.indexed_order_by('-price')],
+            self.get_pks('medium', 'expensive', 'cheap'))
+        self.assertEqual(
+            [product.pk for product
+             in products.indexed_order_by('-price')[1:3]],
+            self.get_pks('expensive', 'cheap'))
+
+    def test_search_skips_deleted_documents(self):
+        products = self.index.get_indexed_queryset().indexed_filter(qty=1)
+        self.products['cheap'].delete()
+        self.assertEqual(products.count(), 2)
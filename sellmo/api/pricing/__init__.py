@@ -33,6 +33,7 @@ from sellmo.utils.formatting import call_or_format
 
 from django.db import models
 from decimal import Decimal
+from collections import MutableMapping
 
 
 __all__ = [
@@ -80,18 +81,161 @@ class PriceType(object):
 
 class StampableProperty(object):
 
-    def __init__(self, prop):
+    """
+    Retrieves the stamped price once and remembers it on the instance
+    for as long as the underlying fields keep their values.
+    """
+
+    def __init__(self, prop, fields=None):
         self.prop = prop
+        self.fields = fields
+        self.attr = '_stamped_{0}'.format(prop)
+        self._attnames = {}
+
+    def get_attnames(self, model):
+        attnames = self._attnames.get(model, None)
+        if attnames is None:
+            if self.fields is None:
+                prefix = '{0}_'.format(self.prop)
+                attnames = [field.attname for field in model._meta.fields
+                            if field.name.startswith(prefix)]
+            else:
+                attnames = [model._meta.get_field(name).attname
+                            for name in self.fields]
+            self._attnames[model] = attnames
+        return attnames
+
+    def get_fingerprint(self, obj):
+        return tuple(getattr(obj, attname)
+                     for attname in self.get_attnames(obj.__class__))
+
+    def remember(self, obj, price):
+        obj.__dict__[self.attr] = (self.get_fingerprint(obj), price)
+
+    def forget(self, obj):
+        obj.__dict__.pop(self.attr, None)
+
+    def is_remembered(self, obj):
+        entry = obj.__dict__.get(self.attr, None)
+        return entry is not None and entry[0] == self.get_fingerprint(obj)
 
     def __get__(self, obj, objtype):
-        return modules.pricing.retrieve(stampable=obj, prop=self.prop)
+        if obj is None:
+            return self
+        entry = obj.__dict__.get(self.attr, None)
+        if entry is not None and entry[0] == self.get_fingerprint(obj):
+            price = entry[1]
+        else:
+            price = modules.pricing.retrieve(stampable=obj, prop=self.prop)
+            self.remember(obj, price)
+        # The remembered price stays untouched
+        return price.clone()
 
     def __set__(self, obj, val):
+        self.forget(obj)
         modules.pricing.stamp(stampable=obj, prop=self.prop, price=val)
 
 
+# Amounts are kept as scaled integers, an amount of 12.34 is stored as
+# 1234 with a scale of 2. Results match Decimal arithmetic (including
+# exponents) but additions and multiplications only involve integers.
+
+# Results reaching this amount of digits are rounded through Decimal,
+# as Decimal would do with its default context precision.
+_LIMIT = 10 ** 28
+
+
+def _split(amount):
+    if isinstance(amount, (int, long)):
+        return amount, 0
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    sign, digits, exponent = amount.as_tuple()
+    if not isinstance(exponent, (int, long)):
+        raise ValueError("Invalid amount %s" % amount)
+    value = int(''.join(map(str, digits)))
+    if sign:
+        value = -value
+    return value, -exponent
+
+
+def _join(value, scale):
+    if scale == 0:
+        return Decimal(value)
+    return Decimal('%de%d' % (value, -scale))
+
+
+def _fit(value, scale):
+    if -_LIMIT < value < _LIMIT:
+        return value, scale
+    return _split(+_join(value, scale))
+
+
+def _add(a, b):
+    if a[1] == b[1]:
+        return _fit(a[0] + b[0], a[1])
+    elif a[1] > b[1]:
+        return _fit(a[0] + b[0] * 10 ** (a[1] - b[1]), a[1])
+    return _fit(a[0] * 10 ** (b[1] - a[1]) + b[0], b[1])
+
+
+def _normalize(value, scale):
+    if value == 0:
+        return 0, 0
+    while value % 10 == 0:
+        value //= 10
+        scale -= 1
+    return value, scale
+
+
+class Mutations(MutableMapping):
+
+    """
+    Exposes the scaled mutations of a price as Decimal amounts. Writes
+    go through to the price, claiming its mutations first.
+    """
+
+    def __init__(self, price):
+        self._price = price
+
+    def __getitem__(self, key):
+        return _join(*self._price._mutations[key])
+
+    def __setitem__(self, key, amount):
+        self._price._own_mutations()
+        self._price._mutations[key] = _split(amount)
+
+    def __delitem__(self, key):
+        self._price._own_mutations()
+        del self._price._mutations[key]
+
+    def __iter__(self):
+        return iter(self._price._mutations)
+
+    def __len__(self):
+        return len(self._price._mutations)
+
+    def has_key(self, key):
+        return key in self
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    def __repr__(self):
+        return repr(self.copy())
+
+
 class Price(object):
 
+    """
+    Immutable in practice; arithmetic results in new prices. Mutations
+    and context are shared between clones until one of them writes to
+    them.
+    """
+
+    __slots__ = ('_value', '_decimal', 'currency', 'type', '_mutations',
+                 '_context', '_owns_mutations', '_owns_context')
+
     @staticmethod
     def sanity_check(price, other):
         if not isinstance(price, Price) or not isinstance(other, Price):
@@ -99,10 +243,32 @@ class Price(object):
         if price.currency != other.currency:
             raise Exception("""Currency mismatch""")
 
-    def __init__(self, amount=0, currency=None, type=None, context=None):
-        if not isinstance(amount, Decimal):
-            amount = Decimal(str(amount))
+    @classmethod
+    def sum(cls, prices, start=None):
+        """
+        Sums the given prices, accumulating in place instead of creating
+        a new price for each addition.
+        """
+        if start is None:
+            start = cls()
+        total = start.clone()
+        total._own_mutations()
+        mutations = total._mutations
+        for price in prices:
+            Price.sanity_check(total, price)
+            total._value = _add(total._value, price._value)
+            for key, value in price._mutations.iteritems():
+                if key in mutations:
+                    mutations[key] = _add(mutations[key], value)
+                else:
+                    mutations[key] = _add((0, 0), value)
+            if price._context:
+                total._own_context()
+                total._context.update(price._context)
+        total._decimal = None
+        return total
 
+    def __init__(self, amount=0, currency=None, type=None, context=None):
         if currency is None:
             currency = modules.pricing.get_currency()
 
@@ -114,22 +280,93 @@ class Price(object):
         elif not isinstance(context, dict):
             raise Exception("Context should be a dict")
 
-        self.amount = amount
+        self._value = _split(amount)
+        self._decimal = None
         self.currency = currency
         self.type = str(type) if type else type
-        self.context = context.copy()
+        self._context = context.copy()
+        self._owns_context = True
 
-        mutations = {}
         if self.type:
-            mutations[self.type] = amount
-        self.mutations = mutations
-
-    def clone(self, cls=None, clone=None):
+            self._mutations = {self.type: self._value}
+        else:
+            self._mutations = {}
+        self._owns_mutations = True
+
+    def __getstate__(self):
+        return (self._value, self.currency, self.type, self._mutations,
+                self._context)
+
+    def __setstate__(self, state):
+        (self._value, self.currency, self.type, self._mutations,
+         self._context) = state
+        self._decimal = None
+        self._owns_mutations = True
+        self._owns_context = True
+
+    def _derive(self, value, mutations, cls=None):
         if cls is None:
             cls = self.__class__
-        price = cls(amount=self.amount, currency=self.currency,
-                    type=self.type, context=self.context)
-        price.mutations = self.mutations.copy()
+        price = cls.__new__(cls)
+        price._value = value
+        price._decimal = None
+        price.currency = self.currency
+        price.type = self.type
+        price._mutations = mutations
+        price._owns_mutations = True
+        # Share context until written to
+        price._context = self._context
+        price._owns_context = False
+        self._owns_context = False
+        return price
+
+    def _own_mutations(self):
+        if not self._owns_mutations:
+            self._mutations = self._mutations.copy()
+            self._owns_mutations = True
+
+    def _own_context(self):
+        if not self._owns_context:
+            self._context = self._context.copy()
+            self._owns_context = True
+
+    @property
+    def amount(self):
+        if self._decimal is None:
+            self._decimal = _join(*self._value)
+        return self._decimal
+
+    @amount.setter
+    def amount(self, amount):
+        self._value = _split(amount)
+        self._decimal = None
+
+    @property
+    def mutations(self):
+        return Mutations(self)
+
+    @mutations.setter
+    def mutations(self, mutations):
+        self._mutations = {key: _split(amount)
+                           for key, amount in mutations.iteritems()}
+        self._owns_mutations = True
+
+    @property
+    def context(self):
+        # Context might get written to, claim it.
+        self._own_context()
+        return self._context
+
+    @context.setter
+    def context(self, context):
+        self._context = context
+        self._owns_context = True
+
+    def clone(self, cls=None, clone=None):
+        price = self._derive(self._value, self._mutations, cls=cls)
+        # Share mutations until written to
+        price._owns_mutations = False
+        self._owns_mutations = False
         return price
 
     def round(self, digits=2):
@@ -139,83 +376,101 @@ class Price(object):
                            for key, amount in price.mutations.iteritems()}
         return price
 
-    def _update_context(self, context):
-        self.context.update(context)
-
-    def _addition_mutations(self, mutations):
-        for key, amount in mutations.iteritems():
-            current = self.mutations.get(key, 0)
-            self.mutations[key] = current + amount
-
-    def __add__(self, other):
+    def _combine(self, other, negate=False):
         Price.sanity_check(self, other)
-        price = self.clone()
-        price.amount += other.amount
-        price._addition_mutations(
-            {key: amount for key, amount in other.mutations.iteritems()})
-        price._update_context(other.context)
+        mutations = self._mutations.copy()
+        for key, value in other._mutations.iteritems():
+            if negate:
+                value = (-value[0], value[1])
+            if key in mutations:
+                mutations[key] = _add(mutations[key], value)
+            else:
+                mutations[key] = _add((0, 0), value)
+        value = other._value
+        if negate:
+            value = (-value[0], value[1])
+        price = self._derive(_add(self._value, value), mutations)
+        if other._context:
+            price._own_context()
+            price._context.update(other._context)
         return price
 
+    def __add__(self, other):
+        return self._combine(other)
+
     def __sub__(self, other):
-        Price.sanity_check(self, other)
-        price = self.clone()
-        price.amount -= other.amount
-        price._addition_mutations(
-            {key: -amount for key, amount in other.mutations.iteritems()})
-        price._update_context(other.context)
-        return price
+        return self._combine(other, negate=True)
 
     def __mul__(self, multiplier):
-        price = self.clone()
-        price.amount *= multiplier
-        price.mutations = {
-            key: amount * multiplier for
-            key, amount in price.mutations.iteritems()}
-        return price
+        if isinstance(multiplier, (int, long, Decimal)):
+            factor, scale = _split(multiplier)
+            multiply = lambda value: _fit(value[0] * factor, value[1] + scale)
+        else:
+            # Leave anything else up to Decimal
+            multiply = lambda value: _split(_join(*value) * multiplier)
+        return self._derive(
+            multiply(self._value),
+            {key: multiply(value)
+             for key, value in self._mutations.iteritems()})
 
     def __rmul__(self, multiplier):
         return self.__mul__(multiplier)
 
     def __div__(self, divider):
-        price = self.clone()
-        price.amount /= divider
-        price.mutations = {
-            key: amount / divider for
-            key, amount in price.mutations.iteritems()}
-        return price
+        divide = lambda value: _split(_join(*value) / divider)
+        return self._derive(
+            divide(self._value),
+            {key: divide(value)
+             for key, value in self._mutations.iteritems()})
 
     def __rdiv__(self, divider):
         return self.__div__(divider)
 
     def __neg__(self):
-        price = self.clone()
-        price.amount = -price.amount
-        price.mutations = {
-            key: -amount for key, amount in price.mutations.iteritems()}
-        return price
+        return self._derive(
+            (-self._value[0], self._value[1]),
+            {key: (-value[0], value[1])
+             for key, value in self._mutations.iteritems()})
+
+    def _mutations_key(self):
+        return frozenset((key, _normalize(*value))
+                         for key, value in self._mutations.iteritems())
 
     def __eq__(self, other):
         return (self.currency == other.currency and
-                self.amount == other.amount and
+                _normalize(*self._value) == _normalize(*other._value) and
                 self.type == other.type and
-                self.mutations == other.mutations)
+                self._mutations_key() == other._mutations_key())
+
+    def __ne__(self, other):
+        return not self == other
 
     def __hash__(self):
         return hash((
-            self.currency, self.amount, self.type, 
-            frozenset(self.mutations.items())))
+            self.currency, _normalize(*self._value), self.type,
+            self._mutations_key()))
 
     def __contains__(self, key):
         if not isinstance(key, (basestring, PriceType)):
             raise TypeError()
-        return self.mutations.has_key(str(key))
+        return str(key) in self._mutations
 
     def __getitem__(self, key):
         if not isinstance(key, (basestring, PriceType)):
             raise TypeError()
         key = str(key)
-        if self.mutations.has_key(key):
-            return Price(self.mutations[key], self.currency, key)
+        if key in self._mutations:
+            value = self._mutations[key]
+            price = self.__class__.__new__(self.__class__)
+            price._value = value
+            price._decimal = None
+            price.currency = self.currency
+            price.type = key
+            price._mutations = {key: value}
+            price._owns_mutations = True
+            price._context = {}
+            price._owns_context = True
+            return price
         raise KeyError(key)
 
     def __setitem__(self, key, value):
@@ -223,10 +478,11 @@ class Price(object):
             raise TypeError()
         if not isinstance(value, Price):
             raise TypeError()
-        self.mutations[str(key)] = value.amount
+        self._own_mutations()
+        self._mutations[str(key)] = value._value
 
     def __nonzero__(self):
-        return self.amount != 0
+        return self._value[0] != 0
 
     def __unicode__(self):
         return self.currency.format(self.amount)
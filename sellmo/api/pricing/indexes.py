@@ -47,10 +47,16 @@ class PriceIndex(indexing.Index):
         
         for prefix in self.price_prefixes:
             for currency_code, currency in six.iteritems(currencies):
-                price = self.get_price(document, prefix, currency_code, currency, **kwargs)
+                key = (prefix, currency_code, self._make_kwargs_key(kwargs))
+                prices = self.prefetched.get(key, {})
+                if document.pk in prices:
+                    price = prices[document.pk]
+                else:
+                    price = self.get_price(document, prefix, currency_code, currency, **kwargs)
                 if price:
                     for key in types + ['amount']:
-                        field_name = '%s_%s_%s' % (prefix, currency_code, key)
+                        field_name = self.get_price_field_name(
+                            prefix, currency_code, key)
                         amount = None
                         if key == 'amount':
                             amount = price.amount
@@ -59,11 +65,51 @@ class PriceIndex(indexing.Index):
                         values[field_name] = amount
         return values
         
+    def prefetch(self, documents):
+        prefetched = super(PriceIndex, self).prefetch(documents)
+        if not self.price_prefixes:
+            return prefetched
+        
+        currencies = modules.pricing.currencies
+        
+        # Group documents by their price kwargs, prices for each group
+        # can then be resolved at once.
+        groups = {}
+        for variety in self.iter_varieties():
+            for document in documents:
+                kwargs = self.get_price_kwargs(document, **variety)
+                key = self._make_kwargs_key(kwargs)
+                if key not in groups:
+                    groups[key] = (kwargs, {})
+                groups[key][1][document.pk] = document
+                
+        for kwargs_key, (kwargs, group) in six.iteritems(groups):
+            for prefix in self.price_prefixes:
+                for currency_code, currency in six.iteritems(currencies):
+                    key = (prefix, currency_code, kwargs_key)
+                    prefetched[key] = self.get_prices(
+                        group.values(), prefix, currency_code, currency, 
+                        **kwargs)
+        return prefetched
+        
+    def _make_kwargs_key(self, kwargs):
+        return tuple(sorted(six.iteritems(kwargs)))
+        
+    def get_price_field_name(self, prefix, currency_code, key='amount'):
+        return '%s_%s_%s' % (prefix, currency_code, key)
+        
     def get_price_kwargs(self, document, **variety):
         return {}
         
     def get_price(self, document, prefix, currency_code, currency, **kwargs):
         raise NotImplementedError()
+        
+    def get_prices(self, documents, prefix, currency_code, currency, **kwargs):
+        return {
+            document.pk: self.get_price(
+                document, prefix, currency_code, currency, **kwargs)
+            for document in documents
+        }
     
     def get_fields(self):
         fields = super(PriceIndex, self).get_fields()
@@ -74,7 +120,8 @@ class PriceIndex(indexing.Index):
         for prefix in self.price_prefixes:
             for currency_code, currency in six.iteritems(currencies):
                 for key in types + ['amount']:
-                    field_name = '%s_%s_%s' % (prefix, currency_code, key)
+                    field_name = self.get_price_field_name(
+                        prefix, currency_code, key)
                     fields[field_name] = indexing.DecimalField(
                         max_digits=modules.pricing.decimal_max_digits,
                         decimal_places=modules.pricing.decimal_places)
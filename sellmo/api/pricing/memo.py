@@ -0,0 +1,117 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from collections import OrderedDict
+
+from django.db import models
+
+from sellmo.core.local import get_context, has_context
+from sellmo.api.configuration import define_setting
+from sellmo.caching.chains import ChainCache, REQUEST, _missing
+
+
+class PriceMemo(ChainCache):
+
+    """
+    Remembers get_price results for the duration of a request. Only
+    calls for a product without a given price are remembered, keyed by
+    (product pk, qty, currency, raw) and any registered components.
+    Calls with other arguments are not remembered at all, so a link
+    relying on a new argument should register it as a component.
+    """
+
+    enabled = define_setting(
+        'PRICE_MEMO_ENABLED',
+        default=True)
+
+    # Arguments which don't affect the price.
+    ignored = ['index']
+
+    def __init__(self):
+        super(PriceMemo, self).__init__(key=self.make_price_key,
+                                        tier=REQUEST)
+        self.components = OrderedDict()
+
+    def add_component(self, name, func=None):
+        """
+        Adds a component to the key. By default the value of the
+        argument with the given name is used (the pk for model
+        instances), func can be given to resolve the value from all
+        arguments instead.
+        """
+        self.components[name] = func
+
+    def make_price_key(self, product=None, qty=1, currency=None, price=None,
+                       raw=False, **kwargs):
+        if product is None or price is not None:
+            return None
+        for name in kwargs:
+            if name not in self.components and name not in self.ignored:
+                return None
+
+        key = [product.pk, qty, getattr(currency, 'code', currency),
+               bool(raw)]
+        for name, func in self.components.iteritems():
+            if func is not None:
+                value = func(product=product, qty=qty, currency=currency,
+                             raw=raw, **kwargs)
+            else:
+                value = kwargs.get(name, None)
+                if isinstance(value, models.Model):
+                    value = value.pk
+            key.append(value)
+        return tuple(key)
+
+    def _get_stats(self):
+        if not has_context():
+            return None
+        return get_context().setdefault('price_memo_stats', {
+            'hits': 0,
+            'misses': 0,
+        })
+
+    def stats(self):
+        """
+        Returns hit and miss counts for the current request.
+        """
+        return dict(self._get_stats() or {'hits': 0, 'misses': 0})
+
+    def get(self, key):
+        value = super(PriceMemo, self).get(key)
+        stats = self._get_stats()
+        if stats is not None:
+            stats['misses' if value is _missing else 'hits'] += 1
+        if value is not _missing:
+            # Hand out clones, the memo keeps the original.
+            value = value.clone()
+        return value
+
+    def set(self, key, value):
+        super(PriceMemo, self).set(key, value.clone())
@@ -41,6 +41,10 @@ class ProductIndex(PriceIndex):
         assert prefix == 'price'
         return modules.pricing.get_price(product=document, currency=currency, **kwargs)
         
+    def get_prices(self, documents, prefix, currency_code, currency, **kwargs):
+        assert prefix == 'price'
+        return modules.pricing.get_prices(products=documents, currency=currency, **kwargs)
+        
     def get_queryset(self, queryset=None):
         queryset = super(ProductIndex, self).get_queryset(queryset)
         queryset = queryset.polymorphic()
@@ -114,6 +114,32 @@ class ProductRelatableQuerySet(QuerySet):
             "{0} matching query does not exist.".format(
             self.model._meta.object_name))
 
+    def for_products(self, products):
+        """
+        Returns a mapping of product pk to a list of matching objects,
+        resolved with a fixed amount of queries.
+        """
+        products = list(products)
+        matches = list(
+            self.filter(self.model.get_for_products_query(products))
+                .distinct())
+        return self.model.map_products(products=products, matches=matches)
+
+    def get_best_for_products(self, products):
+        """
+        Returns a mapping of product pk to the best match, products
+        without any match are omitted.
+        """
+        products = list(products)
+        mapping = self.for_products(products)
+        best = {}
+        for product in products:
+            matches = mapping.get(product.pk, None)
+            if matches:
+                best[product.pk] = self.model.get_best_from_matches(
+                    product=product, matches=matches)
+        return best
+
 
 class ProductRelatableManager(models.Manager):
 
@@ -123,6 +149,12 @@ class ProductRelatableManager(models.Manager):
     def get_best_for_product(self, *args, **kwargs):
         return self.get_queryset().get_best_for_product(*args, **kwargs)
 
+    def for_products(self, *args, **kwargs):
+        return self.get_queryset().for_products(*args, **kwargs)
+
+    def get_best_for_products(self, *args, **kwargs):
+        return self.get_queryset().get_best_for_products(*args, **kwargs)
+
     def get_queryset(self):
         return ProductRelatableQuerySet(self.model, using=self._db)
 
@@ -158,5 +190,49 @@ class ProductRelatable(models.Model):
     def get_best_for_product(cls, product, matches):
         return cls.sort_best_for_product(product, matches)[0]
 
+    @classmethod
+    def get_for_products_query(cls, products):
+        return Q(all_products=True) | Q(products__in=products)
+
+    @classmethod
+    def map_products(cls, products, matches):
+        """
+        Maps each product pk to the list of matches which relate to it.
+        This is the batched equivalent of get_for_product_query.
+        """
+        mapping = {product.pk: [] for product in products}
+        generic = [match for match in matches if match.all_products]
+        for product_matches in mapping.itervalues():
+            product_matches.extend(generic)
+
+        # Resolve explicit relations through the m2m table
+        field = cls._meta.get_field('products')
+        source = '{0}_id'.format(field.m2m_field_name())
+        target = '{0}_id'.format(field.m2m_reverse_field_name())
+        explicit = {match.pk: match for match in matches
+                    if not match.all_products}
+        if explicit:
+            rows = field.rel.through.objects.filter(**{
+                '{0}__in'.format(source): explicit.keys(),
+                '{0}__in'.format(target): mapping.keys(),
+            }).values_list(source, target)
+            for match_pk, product_pk in rows:
+                mapping[product_pk].append(explicit[match_pk])
+        return mapping
+
+    @classmethod
+    def sort_key_for_product(cls, product, match):
+        """
+        Sort key used to select the best match in batches, equivalent
+        to sort_best_for_product.
+        """
+        return match.all_products
+
+    @classmethod
+    def get_best_from_matches(cls, product, matches):
+        return sorted(
+            matches,
+            key=lambda match: cls.sort_key_for_product(product, match))[0]
+
     class Meta:
         abstract = True
@@ -30,6 +30,8 @@
 
 from sellmo.api.configuration import get_setting
 from sellmo.caching.base import Cache, cached
+from sellmo.caching.chains import (ChainCache, Pickler, QuerySetPickler,
+                                   REQUEST, PROCESS, SHARED)
 
 
 enabled = get_setting('CACHING_ENABLED', default=False)
@@ -0,0 +1,264 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import time
+import hashlib
+
+from django import dispatch
+from django.apps import apps
+from django.core.cache import cache
+from django.db import models
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_save, post_delete
+
+from sellmo.core.local import get_context, has_context
+from sellmo.api.configuration import define_setting
+
+
+REQUEST = 'request'
+PROCESS = 'process'
+SHARED = 'shared'
+
+_missing = object()
+
+
+class Pickler(object):
+
+    """
+    Stores values as is.
+    """
+
+    def dumps(self, value):
+        return value
+
+    def loads(self, value):
+        return value
+
+
+class QuerySetPickler(Pickler):
+
+    """
+    Stores querysets and lists of model instances as pk lists,
+    instead of pickling their Query objects.
+    """
+
+    def dumps(self, value):
+        if isinstance(value, QuerySet):
+            return ('queryset', value.model,
+                    list(value.values_list('pk', flat=True)))
+        elif (isinstance(value, list) and value
+                and all(isinstance(obj, models.Model) for obj in value)):
+            return ('list', value[0].__class__, [obj.pk for obj in value])
+        return ('value', None, value)
+
+    def loads(self, value):
+        kind, model, value = value
+        if kind == 'queryset':
+            return model._default_manager.filter(pk__in=value)
+        elif kind == 'list':
+            from sellmo.core.query import PKIterator
+            return list(PKIterator(model, value))
+        return value
+
+
+class ChainCache(object):
+
+    """
+    Declarative memoization for a chain. Results are stored under the
+    key returned by the key function, which receives the same keyword
+    arguments as the chain. If the key function returns None the result
+    is not cached.
+
+    Results can be cached per request, per process or in Django's cache
+    (shared). Invalidation happens through the given signals or models,
+    a model can be given as a class or as an 'app_label.Model' string.
+    Each item can also be given as an (item, func) tuple, func then
+    returns the chain kwargs for which the result should be invalidated.
+    """
+
+    prefix = define_setting(
+        'CACHING_PREFIX',
+        default='_sellmo')
+
+    max_entries = 1000
+
+    def __init__(self, key, timeout=None, tier=SHARED, invalidate=None,
+                 pickler=None):
+        if tier not in (REQUEST, PROCESS, SHARED):
+            raise ValueError(tier)
+        self.key = key
+        self.timeout = timeout
+        self.tier = tier
+        self.invalidate = list(invalidate or [])
+        self.pickler = pickler if pickler is not None else Pickler()
+        self.path = None
+        self._entries = {}
+        self._generation = 0
+
+    @property
+    def enabled(self):
+        from sellmo import caching
+        return caching.enabled
+
+    def setup(self, path):
+        self.path = path
+        for item in self.invalidate:
+            func = None
+            if isinstance(item, tuple):
+                item, func = item
+            receiver = self._make_receiver(func)
+            if isinstance(item, dispatch.Signal):
+                item.connect(receiver, weak=False)
+            else:
+                if isinstance(item, basestring):
+                    item = apps.get_model(item)
+                post_save.connect(receiver, sender=item, weak=False)
+                post_delete.connect(receiver, sender=item, weak=False)
+
+    def _make_receiver(self, func):
+        def receiver(sender, **kwargs):
+            if func is None:
+                self.clear()
+            else:
+                targets = func(sender=sender, **kwargs)
+                if isinstance(targets, dict):
+                    targets = [targets]
+                for target in targets or []:
+                    self.delete(**target)
+        return receiver
+
+    # Keys
+
+    def make_key(self, kwargs):
+        key = self.key(**kwargs)
+        if key is None:
+            return None
+        return hashlib.md5(repr(key)).hexdigest()
+
+    def _get_shared_generation(self):
+        key = '{0}_{1}_generation'.format(self.prefix, self.path)
+        generation = cache.get(key)
+        if generation is None:
+            # Start from the current time, so that a lost generation
+            # never resurrects older entries.
+            generation = int(time.time())
+            cache.add(key, generation, None)
+        return key, generation
+
+    def _resolve_shared_key(self, key):
+        return '{0}_{1}_{2}_{3}'.format(
+            self.prefix, self.path, self._get_shared_generation()[1], key)
+
+    def _get_request_entries(self):
+        if not has_context():
+            return None
+        entries = get_context().setdefault('chain_cache', {})
+        return entries.setdefault(self.path, {})
+
+    # Storage
+
+    def get(self, key):
+        if self.tier == REQUEST:
+            entries = self._get_request_entries()
+            if entries is None:
+                return _missing
+            return entries.get(key, _missing)
+        elif self.tier == PROCESS:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return _missing
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                self._entries.pop(key, None)
+                return _missing
+            return self.pickler.loads(value)
+        else:
+            value = cache.get(self._resolve_shared_key(key))
+            if value is None:
+                return _missing
+            return self.pickler.loads(value[0])
+
+    def set(self, key, value):
+        if self.tier == REQUEST:
+            entries = self._get_request_entries()
+            if entries is not None:
+                entries[key] = value
+        elif self.tier == PROCESS:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {}
+            expires = None
+            if self.timeout is not None:
+                expires = time.time() + self.timeout
+            self._entries[key] = (expires, self.pickler.dumps(value))
+        else:
+            cache.set(self._resolve_shared_key(key),
+                      (self.pickler.dumps(value),), self.timeout)
+
+    def delete(self, **kwargs):
+        key = self.make_key(kwargs)
+        if key is None:
+            return
+        if self.tier == REQUEST:
+            entries = self._get_request_entries()
+            if entries is not None:
+                entries.pop(key, None)
+        elif self.tier == PROCESS:
+            self._entries.pop(key, None)
+        else:
+            cache.delete(self._resolve_shared_key(key))
+
+    def clear(self):
+        if self.tier == REQUEST:
+            entries = self._get_request_entries()
+            if entries is not None:
+                entries.clear()
+        elif self.tier == PROCESS:
+            self._entries = {}
+        else:
+            # Bump generation, older keys will expire eventually
+            key, generation = self._get_shared_generation()
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, generation + 1, None)
+
+    # Chain integration
+
+    def memoize(self, handle):
+        def memoized(module, **kwargs):
+            key = self.make_key(kwargs)
+            if key is None:
+                return handle(module, **kwargs)
+            value = self.get(key)
+            if value is _missing:
+                value = handle(module, **kwargs)
+                self.set(key, value)
+            return value
+        return memoized
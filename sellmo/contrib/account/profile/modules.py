@@ -52,7 +52,8 @@ class AccountModule(modules.account):
             raise Http404("Not a customer.")
             
         if orders is None:
-            orders = customer.orders.exclude(state=ORDER_NEW)
+            orders = customer.orders.exclude(state=ORDER_NEW) \
+                             .prefetch_polymorphic('payment', 'shipment')
             
         context['customer'] = customer
         context['orders'] = orders
@@ -45,9 +45,18 @@ def load_index():
                 fields['%s_attr' % attribute.key] = attribute.get_type().get_index_field(attribute)
             return fields
             
-        def populate(self, document, values, **variety):
-            values = super(ProductIndex, self).populate(document, values, **variety)
-            for attribute in modules.attribute.Attribute.objects.all():
+        def prefetch(self, documents):
+            prefetched = super(ProductIndex, self).prefetch(documents)
+            prefetched['attributes'] = list(
+                modules.attribute.Attribute.objects.all())
+            return prefetched
+            
+        def populate_document(self, document):
+            values = super(ProductIndex, self).populate_document(document)
+            attributes = self.prefetched.get('attributes', None)
+            if attributes is None:
+                attributes = modules.attribute.Attribute.objects.all()
+            for attribute in attributes:
                value = document.attributes[attribute.key]
                value = attribute.get_type().prep_index_value(value)
                values['%s_attr' % attribute.key] = value
@@ -60,32 +69,34 @@ def load_index():
 def on_value_post_save(sender, instance, raw=False, update_fields=None,
                        **kwargs):
     if not raw:
-        index = modules.indexing.get_index(name='product')
-        index.update(product=instance.product)
+        modules.indexing.queue_update(
+            name='product', documents=[instance.product_id])
 
 
-def on_value_post_delete(sender, instance, raw=False, update_fields=None,
-                       **kwargs):
-    if not raw:
-        index = modules.indexing.get_index(name='product')
-        index.update(product=instance.product)
+def on_value_post_delete(sender, instance, **kwargs):
+    modules.indexing.queue_update(
+        name='product', documents=[instance.product_id])
 
 
 def on_attribute_post_save(sender, instance, raw=False, update_fields=None,
                        **kwargs):
     if not raw:
-        index = modules.indexing.get_index(name='product')
-        index.invalidate()
+        # Invalidated once when saving many attributes while deferring
+        modules.indexing.queue_invalidation(name='product')
 
 
-def on_attribute_post_delete(sender, instance, raw=False, update_fields=None,
-                       **kwargs):
-    if not raw:
-        index = modules.indexing.get_index(name='product')
-        index.invalidate()
+def on_attribute_post_delete(sender, instance, **kwargs):
+    modules.indexing.queue_invalidation(name='product')
 
 
-post_save.connect(on_value_post_save, sender=modules.attribute.Value)    
-post_save.connect(on_value_post_delete, sender=modules.attribute.Value)
-post_save.connect(on_attribute_post_save, sender=modules.attribute.Attribute)    
-post_save.connect(on_attribute_post_delete, sender=modules.attribute.Attribute)
\ No newline at end of file
+@load(after='finalize_attribute_Value')
+@load(after='finalize_attribute_Attribute')
+def connect_signals():
+    # Connect to the final models, these are not yet created when this
+    # module is imported
+    post_save.connect(on_value_post_save, sender=modules.attribute.Value)
+    post_delete.connect(on_value_post_delete, sender=modules.attribute.Value)
+    post_save.connect(on_attribute_post_save,
+                      sender=modules.attribute.Attribute)
+    post_delete.connect(on_attribute_post_delete,
+                        sender=modules.attribute.Attribute)
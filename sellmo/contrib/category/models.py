@@ -83,6 +83,47 @@ def load_model():
             return super(ProductRelatable, cls).sort_best_for_product(
                 product=product, matches=matches)
 
+        @classmethod
+        def get_for_products_query(cls, products):
+            # Categories are matched in map_products
+            return (
+                super(ProductRelatable, cls).get_for_products_query(products)
+                | Q(categories__isnull=False))
+
+        @classmethod
+        def map_products(cls, products, matches):
+            mapping = super(ProductRelatable, cls).map_products(
+                products=products, matches=matches)
+
+            def tree_rows(model, pks):
+                field = model._meta.get_field('categories')
+                source = '{0}_id'.format(field.m2m_field_name())
+                target = field.m2m_reverse_field_name()
+                return list(field.rel.through.objects.filter(**{
+                    '{0}__in'.format(source): pks
+                }).values_list(
+                    source,
+                    '{0}__tree_id'.format(target),
+                    '{0}__lft'.format(target),
+                    '{0}__rght'.format(target)))
+
+            # A match relates to a product if one of it's categories
+            # is an ancestor of (or equal to) a product's category.
+            matches = {match.pk: match for match in matches}
+            match_rows = tree_rows(cls, matches.keys()) if matches else []
+            if match_rows:
+                product_rows = tree_rows(
+                    modules.product.Product, mapping.keys())
+                for product_pk, tree_id, lft, rght in product_rows:
+                    product_matches = mapping[product_pk]
+                    for match_pk, m_tree_id, m_lft, m_rght in match_rows:
+                        if (m_tree_id == tree_id and m_lft <= lft
+                                and m_rght >= rght):
+                            match = matches[match_pk]
+                            if match not in product_matches:
+                                product_matches.append(match)
+            return mapping
+
         class Meta(modules.product.ProductRelatable.Meta):
             abstract = True
 
@@ -32,13 +32,17 @@ from django.db.models import Q
 
 from sellmo import modules
 from sellmo.core.local import get_context
-from sellmo.api.decorators import link
+from sellmo.api.decorators import link, batch
 from sellmo.api.pricing import Price
 
 
 namespace = modules.pricing.namespace
 
 
+# Discounts depend on the customer's discount group
+modules.pricing.price_memo.add_component('discount_group')
+
+
 @link()
 def retrieve(stampable, prop, price=None, **kwargs):
     field = '{0}_discount_discount'.format(prop)
@@ -56,6 +60,36 @@ def retrieve(stampable, prop, price=None, **kwargs):
     }
 
 
+@batch(retrieve)
+def retrieve_many(items):
+    # Query all stamped discounts at once and assign them to their
+    # stampables, leaving nothing to query for retrieve.
+    stampables = {}
+    for item in items:
+        field = '{0}_discount_discount'.format(item['prop'])
+        discount_id = getattr(item['stampable'], '{0}_id'.format(field), None)
+        if discount_id is not None:
+            stampables.setdefault(discount_id, []).append(
+                (item['stampable'], field))
+
+    if stampables:
+        context = get_context()
+        discounts = context.get('discounts', {})
+        missing = [discount_id for discount_id in stampables
+                   if discount_id not in discounts]
+        if missing:
+            discounts_qs = modules.discount.Discount.objects.filter(pk__in=missing)
+            for discount in discounts_qs:
+                discounts[discount.pk] = discount
+            context['discounts'] = discounts
+        for discount_id, targets in stampables.iteritems():
+            if discount_id in discounts:
+                for stampable, field in targets:
+                    setattr(stampable, field, discounts[discount_id])
+
+    return [None] * len(items)
+
+
 @link()
 def stamp(stampable, prop, price, **kwargs):
     if 'discount' in price.context:
@@ -86,6 +120,16 @@ def make_purchase(request, purchase, **kwargs):
     }
 
 
+def get_discounts(discount_group=None):
+    discounts = modules.discount.Discount.objects.polymorphic()
+    if modules.discount.user_discount_enabled:
+        q = Q(groups=None)
+        if discount_group:
+            q |= Q(groups=discount_group)
+        discounts = discounts.filter(q)
+    return discounts
+
+
 @link()
 def get_price(price, product=None, discount_group=None, raw=False, **kwargs):
     if raw:
@@ -93,16 +137,15 @@ def get_price(price, product=None, discount_group=None, raw=False, **kwargs):
     
     discount = None
     if product:
-        try:
-            discount = modules.discount.Discount.objects.polymorphic()
-            if modules.discount.user_discount_enabled:
-                q = Q(groups=None)
-                if discount_group:
-                    q |= Q(groups=discount_group)
-                discount = discount.filter(q)
-            discount = discount.get_best_for_product(product)
-        except modules.discount.Discount.DoesNotExist:
-            discount = None
+        if 'product_discount' in kwargs:
+            # Prefetched by get_price_many
+            discount = kwargs['product_discount']
+        else:
+            try:
+                discount = get_discounts(discount_group) \
+                               .get_best_for_product(product)
+            except modules.discount.Discount.DoesNotExist:
+                discount = None
 
     if discount:
         price = discount.apply(price)
@@ -110,3 +153,23 @@ def get_price(price, product=None, discount_group=None, raw=False, **kwargs):
     return {
         'price': price
     }
+
+
+@batch(get_price)
+def get_price_many(items):
+    # Group items by discount group, each group needs it's own query
+    groups = {}
+    for i, item in enumerate(items):
+        if item.get('product') and not item.get('raw', False):
+            group = item.get('discount_group', None)
+            groups.setdefault(group, []).append(i)
+
+    responses = [None] * len(items)
+    for group, indices in groups.iteritems():
+        discounts = get_discounts(group).get_best_for_products(
+            [items[i]['product'] for i in indices])
+        for i in indices:
+            responses[i] = {
+                'product_discount': discounts.get(items[i]['product'].pk, None)
+            }
+    return responses
@@ -41,6 +41,7 @@ from django.db import models
 from django.db.models.signals import (pre_save,
                                       post_save,
                                       pre_delete,
+                                      post_delete,
                                       m2m_changed)
 from django.db.models import Q
 from django.contrib.sites.models import Site
@@ -49,44 +50,69 @@ from django.utils.translation import ugettext_lazy as _
 
 def on_discount_pre_save(sender, instance, **kwargs):
     if instance.pk is not None:
+        # Products related before saving need to be updated as well
         old = instance.__class__.objects.get(pk=instance.pk)
-        invalidate_indexes(discount=old)
+        instance._related_products = list(
+            old.get_related_products().values_list('pk', flat=True))
 
 
 def on_discount_post_save(sender, instance, **kwargs):
-    update_indexes(discount=instance)
+    products = set(getattr(instance, '_related_products', []))
+    products.update(
+        instance.get_related_products().values_list('pk', flat=True))
+    queue_products(products)
+
+
+def on_discount_m2m_changed(sender, instance, action, reverse, model,
+                            pk_set=None, **kwargs):
+    # Queue related products before they are removed and after they are
+    # added.
+    if action not in ('pre_remove', 'pre_clear', 'post_add'):
+        return
+    if not reverse:
+        update_indexes(discount=instance)
+    elif isinstance(instance, modules.product.Product):
+        queue_products([instance])
+    elif pk_set is None:
+        # Cleared, can't tell which products were related
+        queue_products(modules.product.Product.objects.all())
+    else:
+        for discount in model.objects.filter(pk__in=pk_set):
+            update_indexes(discount=discount)
 
 
-def on_discount_m2m_changed(sender, instance, action, reverse, **kwargs):
-    if action.startswith('post_'):
-        if not reverse:
-            invalidate_indexes(discount=instance)
-        else:
-            modules.pricing.get_index(
-                'product_price').update(product=[instance])
+def on_discount_pre_delete(sender, instance, **kwargs):
+    # Relations are gone after deletion, remember related products now
+    instance._related_products = list(
+        instance.get_related_products().values_list('pk', flat=True))
 
 
-def on_discount_pre_delete(sender, instance, **kwargs):
-    update_indexes(discount=instance)
+def on_discount_post_delete(sender, instance, **kwargs):
+    queue_products(getattr(instance, '_related_products', []))
         
         
 def on_group_post_save(sender, instance, **kwargs):
     update_indexes(group=instance)
     
 
-def on_discount_groups_changed(sender, instance, **kwargs):
-    update_indexes(discount=instance)
+def on_discount_groups_changed(sender, instance, action, reverse, **kwargs):
+    if action.startswith('post_'):
+        if not reverse:
+            update_indexes(discount=instance)
+        else:
+            update_indexes(group=instance)
+
+
+def queue_products(products):
+    modules.indexing.queue_update(name='product', documents=products)
     
 
 def update_indexes(discount=None, group=None):
-    """
     if discount:
-        products = modules.product.Product.objects.for_relatable(discount)
+        queue_products(discount.get_related_products())
     elif group:
-        modules.pricing.get_index('product_price').update(discount_group=[group])
-    """
-    print 'update discount'
-    pass
+        for discount in group.discounts.all():
+            queue_products(discount.get_related_products())
     
 
 @load(after='finalize_product_ProductRelatable')
@@ -237,6 +263,7 @@ def setup_discounts():
         pre_save.connect(on_discount_pre_save, sender=subtype)
         post_save.connect(on_discount_post_save, sender=subtype)
         pre_delete.connect(on_discount_pre_delete, sender=subtype)
+        post_delete.connect(on_discount_post_delete, sender=subtype)
 
     if modules.discount.user_discount_enabled:
         m2m_changed.connect(
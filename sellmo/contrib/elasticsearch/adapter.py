@@ -28,8 +28,521 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+import os
+import json
+import uuid
+import socket
+import threading
+from decimal import Decimal
+from collections import OrderedDict
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import six
+from django.utils.six.moves import http_client
+from django.utils.six.moves.urllib.parse import urlparse, urlencode
+
+from sellmo import modules
 from sellmo.api import indexing
+from sellmo.api.indexing.search import SQ, SearchQuery
+from sellmo.api.indexing.exceptions import IndexBackendException
+
+
+class ElasticSearchConnection(object):
+    
+    """
+    Talks JSON to an ElasticSearch cluster, keeping a persistent HTTP
+    connection for each thread.
+    """
+    
+    def __init__(self, url, timeout):
+        url = urlparse(url)
+        self.secure = url.scheme == 'https'
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+        
+    def get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        # Forked processes can't share the connection
+        if connection is None or self._local.pid != os.getpid():
+            if self.secure:
+                connection_cls = http_client.HTTPSConnection
+            else:
+                connection_cls = http_client.HTTPConnection
+            connection = connection_cls(self.host, self.port,
+                                        timeout=self.timeout)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+        
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+        
+    def request(self, method, path, body=None, params=None, ignore=()):
+        url = self.path + path
+        if params:
+            url += '?' + urlencode(params)
+        
+        headers = {'Content-Type': 'application/json'}
+        if isinstance(body, list):
+            # Newline delimited, as used by bulk requests
+            body = ''.join(json.dumps(line, cls=DjangoJSONEncoder) + '\n'
+                           for line in body)
+            headers['Content-Type'] = 'application/x-ndjson'
+        elif body is not None:
+            body = json.dumps(body, cls=DjangoJSONEncoder)
+        
+        # Retry once, the cluster could have closed an idle connection
+        for attempt in six.moves.range(2):
+            connection = self.get_connection()
+            try:
+                connection.request(method, url, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (http_client.HTTPException, socket.error) as ex:
+                self.close()
+                if attempt:
+                    raise IndexBackendException(
+                        "%s %s failed: %s" % (method, url, ex))
+        
+        if response.status in ignore:
+            return None
+        if response.status >= 400:
+            raise IndexBackendException(
+                "%s %s failed: %s %s" % (method, url, response.status, data))
+        return json.loads(data) if data else None
 
 
 class ElasticSearchIndexAdapter(indexing.IndexAdapter):
-    pass
\ No newline at end of file
+    
+    """
+    Stores each record as an ElasticSearch document. Indexes are
+    searched through an alias pointing to a concrete ElasticSearch
+    index. Rebuilding creates a new concrete index, which is swapped
+    in by moving the alias.
+    """
+    
+    # Shared among adapters
+    _connections = {}
+    
+    INDEX_TO_MAPPINGS = {
+        indexing.BooleanField: lambda field: {'type': 'boolean'},
+        indexing.CharField: lambda field: {'type': 'keyword'},
+        indexing.TextField: lambda field: {'type': 'text'},
+        indexing.FloatField: lambda field: {'type': 'double'},
+        indexing.IntegerField: lambda field: {'type': 'long'},
+        indexing.DecimalField: lambda field: (
+            {'type': 'scaled_float',
+             'scaling_factor': 10 ** field.decimal_places}
+            if field.decimal_places is not None else {'type': 'double'}),
+        indexing.ModelField: lambda field: {'type': 'long'},
+    }
+    
+    INDEX_FIELD_PARAMS = ['max_length', 'max_digits', 'decimal_places']
+    
+    #: ElasticSearch doesn't page beyond this by default, results
+    #: beyond it are paged through with search_after
+    max_result_window = 10000
+    
+    #: Maximum amount of values counted for a facet
+    max_facet_size = 1000
+    
+    def get_connection(self):
+        url = modules.indexing.elasticsearch_url
+        if url not in self._connections:
+            self._connections[url] = ElasticSearchConnection(
+                url, modules.indexing.elasticsearch_timeout)
+        return self._connections[url]
+        
+    def request(self, method, path, body=None, params=None, ignore=()):
+        return self.get_connection().request(
+            method, path, body=body, params=params, ignore=ignore)
+        
+    def get_alias(self, index):
+        return ('%s_%s' % (modules.indexing.elasticsearch_prefix,
+                           index.name)).lower()
+        
+    def get_concrete_index(self, index):
+        """
+        Returns the concrete index the alias of the given index points
+        to, None if the index does not exist.
+        """
+        result = self.request(
+            'GET', '/_alias/%s' % self.get_alias(index), ignore=(404,))
+        if not result:
+            return None
+        return sorted(result)[0]
+        
+    def get_mappings(self, fields):
+        properties = {}
+        meta = {}
+        for field_name, field in six.iteritems(fields):
+            if type(field) not in self.INDEX_TO_MAPPINGS:
+                raise TypeError(field)
+            properties[field_name] = self.INDEX_TO_MAPPINGS[type(field)](field)
+            
+            # Remember what's needed to introspect the index field
+            params = {'class': type(field).__name__}
+            for param in self.INDEX_FIELD_PARAMS:
+                if hasattr(field, param):
+                    params[param] = getattr(field, param)
+            if isinstance(field, indexing.ModelField):
+                params['model'] = '%s.%s' % (field.model._meta.app_label,
+                                             field.model._meta.object_name)
+            meta[field_name] = params
+        
+        return {
+            '_meta': {'fields': meta},
+            'dynamic': 'strict',
+            'properties': properties
+        }
+        
+    def index_fields_for_mappings(self, mappings):
+        meta = mappings.get('_meta', {}).get('fields', {})
+        fields = {}
+        for field_name in mappings.get('properties', {}):
+            # Document field is fixed
+            if field_name == 'document':
+                continue
+            params = {
+                str(param): value
+                for param, value in six.iteritems(meta.get(field_name, {}))
+            }
+            field_cls = getattr(indexing, params.pop('class', ''), None)
+            if field_cls is None:
+                raise IndexBackendException(
+                    "Can't introspect field '%s'" % field_name)
+            args = []
+            if field_cls is indexing.ModelField:
+                args.append(apps.get_model(params.pop('model')))
+            fields[field_name] = field_cls(*args, required=None, **params)
+        return fields
+        
+    def introspect_index(self, index):
+        concrete = self.get_concrete_index(index)
+        if concrete is None:
+            return False
+        result = self.request('GET', '/%s/_mapping' % concrete)
+        index._concrete = concrete
+        return self.index_fields_for_mappings(result[concrete]['mappings'])
+        
+    def create_concrete_index(self, index, alias=False):
+        concrete = '%s_%s' % (self.get_alias(index), uuid.uuid4().hex[:8])
+        body = {'mappings': self.get_mappings(index.fields)}
+        if alias:
+            body['aliases'] = {self.get_alias(index): {}}
+        self.request('PUT', '/%s' % concrete, body)
+        return concrete
+        
+    def build_index(self, index):
+        index._concrete = self.create_concrete_index(index, alias=True)
+        
+    def rebuild_index(self, index, added_fields, deleted_fields, changed_fields):
+        # Resume a concrete index left behind by an interrupted rebuild
+        # if it's mappings are still up to date.
+        alias = self.get_alias(index)
+        result = self.request('GET', '/%s_*/_mapping' % alias) or {}
+        
+        index.shadow_index = None
+        for concrete, mapping in sorted(six.iteritems(result)):
+            if concrete == index._concrete:
+                continue
+            fields = self.index_fields_for_mappings(mapping['mappings'])
+            fields['document'] = index.fields['document']
+            if (index.shadow_index is None
+                    and set(fields) == set(index.fields)
+                    and all(fields[field_name] == field
+                            for field_name, field
+                            in six.iteritems(index.fields))):
+                index.shadow_index = concrete
+            else:
+                self.request('DELETE', '/%s' % concrete)
+        
+        if index.shadow_index is None:
+            index.shadow_index = self.create_concrete_index(index)
+        index.rebuilding = True
+        
+    def backfill_index(self, index, documents):
+        self.update_index(index, documents, shadow=True)
+        
+    def swap_index(self, index):
+        # Moving the alias is atomic
+        alias = self.get_alias(index)
+        self.request('POST', '/_aliases', {'actions': [
+            {'remove': {'index': index._concrete, 'alias': alias}},
+            {'add': {'index': index.shadow_index, 'alias': alias}},
+        ]})
+        self.request('DELETE', '/%s' % index._concrete, ignore=(404,))
+        index._concrete = index.shadow_index
+        index.shadow_index = None
+        
+    def get_structure_name(self, index):
+        if index.rebuilding:
+            return index.shadow_index
+        return index._concrete
+        
+    def is_stale(self, index):
+        return self.get_concrete_index(index) != index._concrete
+        
+    def prep_value(self, value):
+        if isinstance(value, models.Model):
+            return value.pk
+        return value
+        
+    def get_record_id(self, record, fields):
+        # A document has a record for each variety
+        values = [record['document']] + [
+            record.get(field_name)
+            for field_name, field in sorted(six.iteritems(fields))
+            if field.varieties]
+        return '-'.join(six.text_type(self.prep_value(value))
+                        for value in values)
+        
+    def update_index(self, index, documents, shadow=False):
+        if shadow:
+            target = index.shadow_index
+            fields = index.original_fields
+        else:
+            target = self.get_alias(index)
+            fields = index.fields
+        
+        chunk_size = modules.indexing.update_chunk_size
+        pks = list(documents.values_list('pk', flat=True))
+        for i in six.moves.range(0, len(pks), chunk_size):
+            chunk = documents.filter(pk__in=pks[i:i + chunk_size])
+            self.update_index_chunk(index, target, fields, list(chunk))
+        
+        # Make the changes visible to searches
+        self.request('POST', '/%s/_refresh' % target)
+        
+    def update_index_chunk(self, index, target, fields, documents):
+        actions = []
+        ids = []
+        with index.prefetching(documents):
+            for document in documents:
+                for record in index.build_records(document, fields=fields):
+                    record_id = self.get_record_id(record, fields)
+                    ids.append(record_id)
+                    actions.append({
+                        'index': {'_index': target, '_id': record_id}})
+                    actions.append({
+                        field_name: self.prep_value(value)
+                        for field_name, value in six.iteritems(record)})
+        
+        # Remove records of vanished varieties
+        self.request('POST', '/%s/_delete_by_query' % target, {
+            'query': {'bool': {
+                'filter': [{'terms': {
+                    'document': [document.pk for document in documents]}}],
+                'must_not': [{'ids': {'values': ids}}],
+            }}
+        }, params={'conflicts': 'proceed'})
+        
+        # Each record takes an action and a source line
+        bulk_size = modules.indexing.elasticsearch_bulk_size * 2
+        for i in six.moves.range(0, len(actions), bulk_size):
+            self.bulk(actions[i:i + bulk_size])
+            
+    def bulk(self, actions):
+        result = self.request('POST', '/_bulk', actions)
+        if result.get('errors'):
+            for item in result['items']:
+                for action, outcome in six.iteritems(item):
+                    if 'error' in outcome:
+                        raise IndexBackendException(
+                            "Bulk %s of record %s failed: %s" % (
+                                action, outcome.get('_id'),
+                                outcome['error']))
+        
+    def clear_index(self, index, documents):
+        alias = self.get_alias(index)
+        self.request('POST', '/%s/_delete_by_query' % alias, {
+            'query': {'terms': {
+                'document': list(documents.values_list('pk', flat=True))}}
+        }, params={'conflicts': 'proceed'})
+        self.request('POST', '/%s/_refresh' % alias)
+        
+    def compile_filter(self, index, sq):
+        """
+        Compiles a search filter into an ElasticSearch query. Only
+        search lookups contribute to the score.
+        """
+        must = []
+        clauses = []
+        for child in sq.children:
+            if isinstance(child, SQ):
+                must.append(self.compile_filter(index, child))
+            elif child[0].endswith('__search'):
+                must.append(self.compile_lookup(index, *child))
+            else:
+                clauses.append(self.compile_lookup(index, *child))
+        
+        if not must and not clauses:
+            query = {'match_all': {}}
+        elif sq.connector == SQ.OR:
+            query = {'bool': {'should': must + clauses,
+                              'minimum_should_match': 1}}
+        else:
+            query = {'bool': {'must': must, 'filter': clauses}}
+        if sq.negated:
+            query = {'bool': {'must_not': [query]}}
+        return query
+        
+    def compile_lookup(self, index, lookup, value):
+        field_name, _, lookup_type = lookup.partition('__')
+        lookup_type = lookup_type or 'exact'
+        if field_name not in index.fields:
+            raise ValueError("Unknown field '%s'" % field_name)
+        
+        if lookup_type == 'in':
+            return {'terms': {
+                field_name: [self.prep_value(item) for item in value]}}
+        
+        value = self.prep_value(value)
+        if lookup_type == 'exact' and value is None:
+            lookup_type, value = 'isnull', True
+        
+        if lookup_type == 'exact':
+            return {'term': {field_name: value}}
+        elif lookup_type in ('gt', 'gte', 'lt', 'lte'):
+            return {'range': {field_name: {lookup_type: value}}}
+        elif lookup_type == 'isnull':
+            exists = {'exists': {'field': field_name}}
+            return {'bool': {'must_not': [exists]}} if value else exists
+        elif lookup_type == 'startswith':
+            return {'prefix': {field_name: value}}
+        elif lookup_type == 'search':
+            # All terms need to match, a trailing * matches by prefix
+            return {'simple_query_string': {
+                'query': value,
+                'fields': [field_name],
+                'default_operator': 'and'}}
+        raise ValueError("Unsupported lookup '%s'" % lookup)
+        
+    def get_search_body(self, index, query):
+        filters = []
+        
+        # Search within a single variety, varieties which aren't
+        # filtered on default to their first variety.
+        filtered = query.get_filter_fields()
+        for field_name, value in six.iteritems(index.get_default_variety()):
+            if field_name not in filtered:
+                filters.append({'term': {field_name: self.prep_value(value)}})
+        
+        if query.documents is not None:
+            filters.append({'terms': {'document': list(
+                query.documents.values_list('pk', flat=True))}})
+        
+        return {'query': {'bool': {
+            'must': [self.compile_filter(index, query.query_filter)],
+            'filter': filters
+        }}}
+        
+    def search_index(self, index, query):
+        body = self.get_search_body(index, query)
+        
+        # Unless ordered, rank by score. Make sure ordering is
+        # consistent.
+        sort = []
+        for field_name in query.order_by:
+            order = 'desc' if field_name.startswith('-') else 'asc'
+            sort.append({field_name.lstrip('-'): {'order': order}})
+        if not sort:
+            sort.append({'_score': {'order': 'desc'}})
+        if not any(field_name.lstrip('-') == 'document'
+                   for field_name in query.order_by):
+            sort.append({'document': {'order': 'asc'}})
+        
+        low = query.low_mark
+        high = query.high_mark
+        if high is not None and high <= low:
+            return []
+        
+        path = '/%s/_search' % self.get_alias(index)
+        body.update({'sort': sort, '_source': ['document']})
+        if high is not None and high <= self.max_result_window:
+            body.update({'from': low, 'size': high - low})
+            result = self.request('POST', path, body)
+            return [hit['_source']['document']
+                    for hit in result['hits']['hits']]
+        
+        # Page through the results, continuing after the sort values
+        # of the last hit as from and size can't go beyond the window
+        body['size'] = self.max_result_window
+        pks = []
+        while high is None or len(pks) < high:
+            hits = self.request('POST', path, body)['hits']['hits']
+            pks.extend(hit['_source']['document'] for hit in hits)
+            if len(hits) < body['size']:
+                break
+            body['search_after'] = hits[-1]['sort']
+        return pks[low:high]
+        
+    def parse_value(self, field, value):
+        if isinstance(field, indexing.DecimalField):
+            return Decimal(six.text_type(value))
+        elif isinstance(field, indexing.BooleanField):
+            return bool(value)
+        return value
+        
+    def facet_index(self, index, query):
+        body = self.get_search_body(index, query)
+        
+        aggregations = {}
+        for i, (field_name, ranges) in enumerate(six.iteritems(query.facets)):
+            if ranges is None:
+                aggregations[str(i)] = {'terms': {
+                    'field': field_name, 'size': self.max_facet_size}}
+            else:
+                buckets = []
+                for j, (low, high) in enumerate(ranges):
+                    bucket = {'key': str(j)}
+                    if low is not None:
+                        bucket['from'] = low
+                    if high is not None:
+                        bucket['to'] = high
+                    buckets.append(bucket)
+                aggregations[str(i)] = {'range': {
+                    'field': field_name, 'keyed': True, 'ranges': buckets}}
+        
+        body.update({'size': 0, 'aggs': aggregations})
+        result = self.request('POST', '/%s/_search' % self.get_alias(index),
+                              body)
+        
+        facets = OrderedDict()
+        for i, (field_name, ranges) in enumerate(six.iteritems(query.facets)):
+            buckets = result['aggregations'][str(i)]['buckets']
+            if ranges is None:
+                field = index.fields[field_name]
+                facets[field_name] = OrderedDict(sorted(
+                    (self.parse_value(field, bucket['key']),
+                     bucket['doc_count'])
+                    for bucket in buckets))
+            else:
+                facets[field_name] = OrderedDict(
+                    (value, buckets[str(j)]['doc_count'])
+                    for j, value in enumerate(ranges))
+        return facets
+        
+    def join_index(self, index, queryset, filters=None, order_by=None,
+                   **variety):
+        # The index lives elsewhere, search it once the queryset is
+        # sliced or iterated. Only the documents within the slice are
+        # fetched, in the order of the index.
+        indexed = getattr(queryset, 'index', None)
+        if indexed is None or indexed.name != index.name:
+            queryset = index.get_indexed_queryset(queryset)
+        # Only indexed documents remain
+        lookups = dict(filters or {}, **variety) or {'document__isnull': False}
+        queryset = queryset.indexed_filter(**lookups)
+        if order_by:
+            queryset = queryset.indexed_order_by(*order_by)
+        return queryset
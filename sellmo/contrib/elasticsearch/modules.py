@@ -29,11 +29,31 @@
 
 
 from sellmo import modules
-from sellmo.api.configuration import define_import
+from sellmo.api.configuration import define_setting, define_import
 
 
 class IndexingModule(modules.indexing):
     
-    DefaultIndexAadapter = define_import(
+    DefaultIndexAdapter = define_import(
         'DEFAULT_INDEX_ADAPTER',
-        default='sellmo.contrib.elasticsearch.adapter.ElasticSearchIndexAdapter')
\ No newline at end of file
+        default='sellmo.contrib.elasticsearch.adapter.ElasticSearchIndexAdapter')
+    
+    #: Url of the ElasticSearch cluster
+    elasticsearch_url = define_setting(
+        'ELASTICSEARCH_URL',
+        default='http://localhost:9200')
+    
+    #: Prefixes the names of ElasticSearch indexes
+    elasticsearch_prefix = define_setting(
+        'ELASTICSEARCH_INDEX_PREFIX',
+        default='sellmo')
+    
+    #: Amount of records to send in a single bulk request
+    elasticsearch_bulk_size = define_setting(
+        'ELASTICSEARCH_BULK_SIZE',
+        default=500)
+    
+    #: Seconds to wait for ElasticSearch to respond
+    elasticsearch_timeout = define_setting(
+        'ELASTICSEARCH_TIMEOUT',
+        default=10)
@@ -0,0 +1,569 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import threading
+from decimal import Decimal
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qsl
+
+from django.test import TestCase
+
+from sellmo import modules, params
+from sellmo.api import indexing
+from sellmo.api.indexing.search import SQ, SearchQuery
+from sellmo.api.indexing.exceptions import IndexBackendException
+from sellmo.contrib.elasticsearch.adapter import ElasticSearchIndexAdapter
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+
+    # Keep connections alive, as ElasticSearch does
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def handle_request(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        if self.server.drop:
+            # Close without responding, as an idle connection would be
+            self.server.drop -= 1
+            self.close_connection = 1
+            return
+
+        path, _, query = self.path.partition('?')
+        self.server.requests.append(
+            (self.command, path, dict(parse_qsl(query)), body))
+        status, result = self.server.get_response(self.command, path)
+        data = json.dumps(result) if result is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = handle_request
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+
+    """
+    Records requests and replies with the responses primed for them,
+    requests which aren't primed are acknowledged.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubRequestHandler)
+        self.reset()
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server_address
+
+    def reset(self):
+        self.requests = []
+        self.responses = {}
+        self.connections = 0
+        self.drop = 0
+
+    def respond(self, method, path, result, status=200):
+        self.responses.setdefault((method, path), []).append(
+            (status, result))
+
+    def get_response(self, method, path):
+        responses = self.responses.get((method, path))
+        if responses:
+            return responses.pop(0)
+        return 200, {'acknowledged': True}
+
+    def get_requests(self, method=None, path=None):
+        return [(method_, path_, query, body)
+                for method_, path_, query, body in self.requests
+                if (method is None or method_ == method) and
+                (path is None or path_ == path)]
+
+    def get_bodies(self, method=None, path=None):
+        return [json.loads(body) for _, _, _, body
+                in self.get_requests(method, path)]
+
+
+# Text, featured state, sku and price of the products indexed by these
+# tests, keyed by slug.
+PRODUCTS = {
+    'red-shoe': (u"Red shoe", True, 'RS', Decimal('12.50')),
+    'blue-shoe': (u"Blue shoe", False, 'BS', Decimal('25.00')),
+    'horse': (u"Horse", True, 'HO', Decimal('100.00')),
+}
+
+
+class TestIndex(indexing.Index):
+    model = modules.product.Product
+    text = indexing.TextField(
+        populate_value_cb=lambda document, **variety: (
+            PRODUCTS[document.slug][0]))
+    featured = indexing.BooleanField(
+        populate_value_cb=lambda document, **variety: (
+            PRODUCTS[document.slug][1]))
+    sku = indexing.CharField(
+        max_length=16,
+        populate_value_cb=lambda document, **variety: (
+            PRODUCTS[document.slug][2]))
+    price = indexing.DecimalField(
+        max_digits=9, decimal_places=2,
+        populate_value_cb=lambda document, qty, **variety: (
+            PRODUCTS[document.slug][3] * qty),
+        depends_on=['qty'])
+    qty = indexing.IntegerField(varieties=[1, 10])
+
+
+class ElasticSearchIndexAdapterTestCase(TestCase):
+
+    """
+    Runs against a local stub server, which checks the requests made
+    by the adapter and replies as ElasticSearch would. No cluster is
+    needed, nor does sellmo.contrib.elasticsearch need to be installed.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(ElasticSearchIndexAdapterTestCase, cls).setUpClass()
+        cls.server = StubServer()
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        # Point the adapter at the stub, these shadow the settings
+        # when sellmo.contrib.elasticsearch is installed
+        cls.settings = {
+            'elasticsearch_url': cls.server.url,
+            'elasticsearch_prefix': 'sellmo',
+            'elasticsearch_bulk_size': 500,
+            'elasticsearch_timeout': 5,
+        }
+        modules.indexing.__dict__.update(cls.settings)
+
+    @classmethod
+    def tearDownClass(cls):
+        for name in cls.settings:
+            modules.indexing.__dict__.pop(name, None)
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(ElasticSearchIndexAdapterTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        self.server.reset()
+        self.adapter = ElasticSearchIndexAdapter()
+        self.connection = self.adapter.get_connection()
+        self.alias = 'sellmo_estest'
+
+        # Build the index, it doesn't exist yet
+        self.server.respond('GET', '/_alias/%s' % self.alias, {}, 404)
+        params.building_indexes = True
+        try:
+            self.index = modules.indexing.create_index(
+                index_cls=TestIndex, name='estest', adapter=self.adapter)
+        finally:
+            params.building_indexes = False
+        self.concrete = self.index._concrete
+
+        with modules.indexing.defer_updates() as work:
+            self.products = {
+                slug: modules.product.Product.objects.create(slug=slug)
+                for slug in sorted(PRODUCTS)
+            }
+            # Keep the product index out of these tests
+            work.updates.clear()
+        # Start each test without requests or connections
+        self.connection.close()
+        self.server.reset()
+
+    def tearDown(self):
+        self.connection.close()
+        modules.indexing.__dict__.update(self.settings)
+
+    def respond_hits(self, *pks):
+        self.server.respond('POST', '/%s/_search' % self.alias, {
+            'hits': {'total': len(pks), 'hits': [
+                {'_id': '%s-1' % pk, '_source': {'document': pk},
+                 'sort': [1.0, pk]}
+                for pk in pks]}})
+
+    def get_pks(self, *slugs):
+        return [self.products[slug].pk for slug in slugs]
+
+    def compile(self, *args, **kwargs):
+        return self.adapter.compile_filter(self.index, SQ(*args, **kwargs))
+
+    def test_mappings(self):
+        mappings = self.adapter.get_mappings(self.index.fields)
+        self.assertEqual(mappings['dynamic'], 'strict')
+        self.assertEqual(mappings['properties'], {
+            'document': {'type': 'long'},
+            'text': {'type': 'text'},
+            'featured': {'type': 'boolean'},
+            'sku': {'type': 'keyword'},
+            'price': {'type': 'scaled_float', 'scaling_factor': 100},
+            'qty': {'type': 'long'},
+        })
+        self.assertEqual(mappings['_meta']['fields']['price'], {
+            'class': 'DecimalField', 'max_digits': 9, 'decimal_places': 2})
+        self.assertEqual(mappings['_meta']['fields']['document']['model'],
+                         'product.Product')
+
+    def test_build_index(self):
+        self.server.respond('GET', '/_alias/%s' % self.alias, {}, 404)
+        params.building_indexes = True
+        try:
+            index = modules.indexing.create_index(
+                index_cls=TestIndex, name='estest', adapter=self.adapter)
+        finally:
+            params.building_indexes = False
+        self.assertTrue(index._concrete.startswith(self.alias + '_'))
+        body, = self.server.get_bodies('PUT', '/%s' % index._concrete)
+        self.assertEqual(body['aliases'], {self.alias: {}})
+        self.assertEqual(body['mappings'],
+                         json.loads(json.dumps(
+                             self.adapter.get_mappings(index.fields))))
+
+    def test_introspect_index(self):
+        mappings = json.loads(json.dumps(
+            self.adapter.get_mappings(self.index.fields)))
+        self.server.respond('GET', '/_alias/%s' % self.alias, {
+            'sellmo_estest_1234': {'aliases': {self.alias: {}}}})
+        self.server.respond('GET', '/sellmo_estest_1234/_mapping', {
+            'sellmo_estest_1234': {'mappings': mappings}})
+        fields = self.adapter.introspect_index(self.index)
+        self.assertEqual(self.index._concrete, 'sellmo_estest_1234')
+        self.assertEqual(sorted(fields),
+                         ['featured', 'price', 'qty', 'sku', 'text'])
+        for field_name, field in fields.items():
+            self.assertEqual(field, self.index.fields[field_name])
+
+        self.server.respond('GET', '/_alias/%s' % self.alias, {}, 404)
+        self.assertIs(self.adapter.introspect_index(self.index), False)
+
+    def test_update_in_bulk(self):
+        modules.indexing.elasticsearch_bulk_size = 2
+        self.index.update()
+
+        # A record for each variety of each document, in batches of two
+        bulks = self.server.get_requests('POST', '/_bulk')
+        self.assertEqual(len(bulks), 3)
+        records = {}
+        for _, _, _, body in bulks:
+            lines = [json.loads(line) for line in body.splitlines()]
+            self.assertEqual(len(lines), 4)
+            for action, source in zip(lines[::2], lines[1::2]):
+                self.assertEqual(action['index']['_index'], self.alias)
+                records[action['index']['_id']] = source
+
+        pk = self.products['red-shoe'].pk
+        self.assertEqual(len(records), 6)
+        self.assertEqual(records['%s-10' % pk], {
+            'document': pk, 'text': u"Red shoe", 'featured': True,
+            'sku': 'RS', 'price': '125.00', 'qty': 10})
+
+        # Changes are made visible
+        method, path, _, _ = self.server.requests[-1]
+        self.assertEqual((method, path), ('POST', '/%s/_refresh' % self.alias))
+
+    def test_update_removes_vanished_varieties(self):
+        self.index.update()
+        (_, _, query, body), = self.server.get_requests(
+            'POST', '/%s/_delete_by_query' % self.alias)
+        self.assertEqual(query, {'conflicts': 'proceed'})
+        clauses = json.loads(body)['query']['bool']
+        self.assertEqual(
+            sorted(clauses['filter'][0]['terms']['document']),
+            sorted(self.get_pks(*PRODUCTS)))
+        # Only records of the current varieties are kept
+        self.assertEqual(
+            sorted(clauses['must_not'][0]['ids']['values']),
+            sorted('%s-%s' % (pk, qty) for pk in self.get_pks(*PRODUCTS)
+                   for qty in [1, 10]))
+        # Before writing the current records
+        methods = [(method, path) for method, path, _, _
+                   in self.server.requests]
+        self.assertLess(
+            methods.index(('POST', '/%s/_delete_by_query' % self.alias)),
+            methods.index(('POST', '/_bulk')))
+
+    def test_update_fails_on_bulk_errors(self):
+        self.server.respond('POST', '/_bulk', {'errors': True, 'items': [
+            {'index': {'_id': '1-1', 'status': 400, 'error': 'strict'}}]})
+        # Not because of a swapped index
+        self.server.respond('GET', '/_alias/%s' % self.alias, {
+            self.concrete: {'aliases': {self.alias: {}}}})
+        with self.assertRaises(IndexBackendException):
+            self.index.update()
+
+    def test_compile_filter(self):
+        product = self.products['horse']
+        self.assertEqual(self.adapter.compile_filter(self.index, SQ()),
+                         {'match_all': {}})
+        self.assertEqual(self.compile(sku='RS'), {'bool': {
+            'must': [], 'filter': [{'term': {'sku': 'RS'}}]}})
+        self.assertEqual(self.compile(document=product), {'bool': {
+            'must': [], 'filter': [{'term': {'document': product.pk}}]}})
+        self.assertEqual(self.compile(sku__in=['RS', 'BS']), {'bool': {
+            'must': [], 'filter': [{'terms': {'sku': ['RS', 'BS']}}]}})
+        self.assertEqual(self.compile(price__gte=10), {'bool': {
+            'must': [], 'filter': [{'range': {'price': {'gte': 10}}}]}})
+        self.assertEqual(self.compile(sku__startswith='R'), {'bool': {
+            'must': [], 'filter': [{'prefix': {'sku': 'R'}}]}})
+        self.assertEqual(self.compile(sku=None), {'bool': {
+            'must': [], 'filter': [
+                {'bool': {'must_not': [{'exists': {'field': 'sku'}}]}}]}})
+        self.assertEqual(self.compile(sku__isnull=False), {'bool': {
+            'must': [], 'filter': [{'exists': {'field': 'sku'}}]}})
+
+        # Only searches contribute to the score
+        self.assertEqual(self.compile(text__search=u"red sho*"), {'bool': {
+            'must': [{'simple_query_string': {
+                'query': u"red sho*", 'fields': ['text'],
+                'default_operator': 'and'}}],
+            'filter': []}})
+
+    def test_compile_nested_filter(self):
+        self.assertEqual(
+            self.compile(SQ(sku='RS') | SQ(featured=False)),
+            {'bool': {'must': [{'bool': {
+                'should': [{'term': {'sku': 'RS'}},
+                           {'term': {'featured': False}}],
+                'minimum_should_match': 1}}], 'filter': []}})
+        self.assertEqual(
+            self.compile(~SQ(sku='RS')),
+            {'bool': {'must': [{'bool': {'must_not': [{'bool': {
+                'must': [], 'filter': [{'term': {'sku': 'RS'}}]}}]}}],
+             'filter': []}})
+
+        with self.assertRaises(ValueError):
+            self.compile(color='red')
+        with self.assertRaises(ValueError):
+            self.compile(sku__contains='R')
+
+    def test_search_ranks_by_score(self):
+        pks = self.get_pks('red-shoe', 'blue-shoe')
+        self.respond_hits(*pks)
+        products = (self.index.get_indexed_queryset()
+                    .indexed_filter(text__search=u"shoe"))
+        self.assertEqual([product.pk for product in products], pks)
+
+        body, = self.server.get_bodies('POST', '/%s/_search' % self.alias)
+        self.assertEqual(body['sort'], [{'_score': {'order': 'desc'}},
+                                        {'document': {'order': 'asc'}}])
+        self.assertEqual(body['_source'], ['document'])
+        self.assertNotIn('from', body)
+        self.assertEqual(body['size'], self.adapter.max_result_window)
+        # Within the default variety
+        self.assertEqual(body['query']['bool']['filter'],
+                         [{'term': {'qty': 1}}])
+
+    def test_search_sorted_and_limited(self):
+        pks = self.get_pks('horse', 'blue-shoe')
+        self.respond_hits(*pks)
+        products = (self.index.get_indexed_queryset()
+                    .indexed_filter(qty=10)
+                    .indexed_order_by('-price'))
+        self.assertEqual([product.pk for product in products[1:3]], pks)
+
+        body, = self.server.get_bodies('POST', '/%s/_search' % self.alias)
+        self.assertEqual(body['sort'], [{'price': {'order': 'desc'}},
+                                        {'document': {'order': 'asc'}}])
+        self.assertEqual((body['from'], body['size']), (1, 2))
+        # Filtered on another variety
+        self.assertEqual(body['query']['bool']['filter'], [])
+
+        # Nothing to search for
+        self.server.reset()
+        self.assertEqual(list(products[2:2]), [])
+        self.assertEqual(self.server.requests, [])
+
+    def test_search_beyond_result_window(self):
+        self.adapter.max_result_window = 2
+        pks = self.get_pks('blue-shoe', 'horse', 'red-shoe')
+        self.respond_hits(*pks[:2])
+        self.respond_hits(*pks[2:])
+        products = (self.index.get_indexed_queryset()
+                    .indexed_filter(featured__isnull=False))
+        self.assertEqual([product.pk for product in products], pks)
+
+        first, second = self.server.get_bodies(
+            'POST', '/%s/_search' % self.alias)
+        self.assertEqual(first['size'], 2)
+        self.assertNotIn('search_after', first)
+        self.assertEqual(second['search_after'], [1.0, pks[1]])
+
+        # Slices beyond the window are paged through as well
+        self.server.reset()
+        self.respond_hits(*pks[:2])
+        self.respond_hits(*pks[2:])
+        self.assertEqual([product.pk for product in products.all()[1:3]],
+                         pks[1:3])
+        self.assertEqual(
+            len(self.server.get_requests('POST', '/%s/_search' % self.alias)),
+            2)
+
+    def test_search_within_queryset(self):
+        self.respond_hits()
+        products = self.index.get_indexed_queryset(
+            modules.product.Product.objects.filter(slug='horse'))
+        list(products.indexed_filter(featured=True))
+        body, = self.server.get_bodies('POST', '/%s/_search' % self.alias)
+        self.assertIn({'terms': {'document': self.get_pks('horse')}},
+                      body['query']['bool']['filter'])
+
+    def test_facets(self):
+        self.server.respond('POST', '/%s/_search' % self.alias, {
+            'hits': {'total': 3, 'hits': []},
+            'aggregations': {
+                '0': {'buckets': [{'key': 1, 'doc_count': 2},
+                                  {'key': 0, 'doc_count': 1}]},
+                '1': {'buckets': {'0': {'doc_count': 1},
+                                  '1': {'doc_count': 2}}},
+            }})
+        query = SearchQuery()
+        query.add_filter(SQ(text__search=u"shoe"))
+        query.add_facet('featured')
+        query.add_facet('price', [(0, 20), (20, None)])
+        facets = self.index.facet(query)
+
+        self.assertEqual(facets.items(), [
+            ('featured', facets['featured']),
+            ('price', facets['price'])])
+        self.assertEqual(facets['featured'].items(), [(False, 1), (True, 2)])
+        self.assertEqual(facets['price'].items(),
+                         [((0, 20), 1), ((20, None), 2)])
+
+        body, = self.server.get_bodies('POST', '/%s/_search' % self.alias)
+        self.assertEqual(body['size'], 0)
+        self.assertEqual(body['aggs'], {
+            '0': {'terms': {'field': 'featured',
+                            'size': self.adapter.max_facet_size}},
+            '1': {'range': {'field': 'price', 'keyed': True, 'ranges': [
+                {'key': '0', 'from': 0, 'to': 20},
+                {'key': '1', 'from': 20}]}},
+        })
+
+    def test_join_index_keeps_order(self):
+        pks = self.get_pks('horse', 'red-shoe', 'blue-shoe')
+        products = self.index.join(
+            modules.product.Product.objects.all(),
+            filters={'price__lte': 200}, order_by=['-price'], qty=10)
+        # Searched once sliced, within the slice
+        self.assertEqual(self.server.requests, [])
+        self.respond_hits(*pks[1:])
+        self.assertEqual([product.pk for product in products[1:3]],
+                         pks[1:])
+
+        body, = self.server.get_bodies('POST', '/%s/_search' % self.alias)
+        self.assertEqual(body['sort'][0], {'price': {'order': 'desc'}})
+        self.assertEqual((body['from'], body['size']), (1, 2))
+        self.assertEqual(body['query']['bool']['must'], [{'bool': {
+            'must': [], 'filter': [{'range': {'price': {'lte': 200}}},
+                                   {'term': {'qty': 10}}]}}])
+
+    def test_rebuild_swaps_alias(self):
+        self.server.respond('GET', '/%s_*/_mapping' % self.alias, {
+            self.concrete: {'mappings': {}},
+            'sellmo_estest_stale': {'mappings': {'properties': {}}}})
+        self.adapter.rebuild_index(self.index, {}, {}, {})
+        self.assertTrue(self.index.rebuilding)
+        shadow = self.index.shadow_index
+
+        # An outdated rebuild is removed, a new index is created
+        # without the alias.
+        self.assertEqual(
+            len(self.server.get_requests('DELETE', '/sellmo_estest_stale')),
+            1)
+        body, = self.server.get_bodies('PUT', '/%s' % shadow)
+        self.assertNotIn('aliases', body)
+
+        self.server.reset()
+        self.index.original_fields = self.index.fields
+        self.index.swap()
+        body, = self.server.get_bodies('POST', '/_aliases')
+        self.assertEqual(body['actions'], [
+            {'remove': {'index': self.concrete, 'alias': self.alias}},
+            {'add': {'index': shadow, 'alias': self.alias}}])
+        self.assertEqual(
+            len(self.server.get_requests('DELETE', '/%s' % self.concrete)),
+            1)
+        self.assertEqual(self.index._concrete, shadow)
+        self.assertFalse(self.index.rebuilding)
+
+    def test_rebuild_resumes_up_to_date_index(self):
+        mappings = json.loads(json.dumps(
+            self.adapter.get_mappings(self.index.fields)))
+        self.server.respond('GET', '/%s_*/_mapping' % self.alias, {
+            self.concrete: {'mappings': mappings},
+            'sellmo_estest_resume': {'mappings': mappings}})
+        self.adapter.rebuild_index(self.index, {}, {}, {})
+        self.assertEqual(self.index.shadow_index, 'sellmo_estest_resume')
+        self.assertEqual(self.server.get_requests('PUT'), [])
+        self.assertEqual(self.server.get_requests('DELETE'), [])
+
+    def test_is_stale(self):
+        self.server.respond('GET', '/_alias/%s' % self.alias, {
+            self.concrete: {'aliases': {self.alias: {}}}})
+        self.assertFalse(self.adapter.is_stale(self.index))
+        self.server.respond('GET', '/_alias/%s' % self.alias, {
+            'sellmo_estest_other': {'aliases': {self.alias: {}}}})
+        self.assertTrue(self.adapter.is_stale(self.index))
+
+    def test_connection_is_reused(self):
+        self.index.update()
+        self.respond_hits()
+        list(self.index.get_indexed_queryset().indexed_filter(featured=True))
+        self.assertGreater(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 1)
+
+        # Adapters share a connection for each url
+        self.assertIs(ElasticSearchIndexAdapter().get_connection(),
+                      ElasticSearchIndexAdapter().get_connection())
+
+    def test_closed_connection_is_retried(self):
+        self.adapter.request('POST', '/_refresh')
+        self.server.drop = 1
+        self.assertEqual(self.adapter.request('POST', '/_refresh'),
+                         {'acknowledged': True})
+        self.assertEqual(self.server.connections, 2)
+
+        self.server.drop = 2
+        with self.assertRaises(IndexBackendException):
+            self.adapter.request('POST', '/_refresh')
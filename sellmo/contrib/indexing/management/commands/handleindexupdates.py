@@ -0,0 +1,74 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sellmo import modules
+
+
+class Command(BaseCommand):
+
+    help = "Updates all documents queued for updating."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--index',
+            dest='indexes', action='append', default=None,
+            help='Only handle updates for the given index. '
+                 'Use multiple times for multiple indexes.'),
+        make_option('--chunk-size',
+            dest='chunk_size', type='int', default=None,
+            help='Amount of documents to update at once.'),
+        make_option('--stats',
+            dest='stats', action='store_true', default=False,
+            help='Only show queue and lag statistics.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError("Chunk size should be at least 1")
+
+        if not options['stats']:
+            handled = modules.indexing.handle_updates(
+                names=options['indexes'],
+                chunk_size=options['chunk_size'])
+            for name, processed in sorted(handled.iteritems()):
+                self.stdout.write(
+                    "Updated {1} documents for index '{0}'."
+                    .format(name, processed))
+
+        stats = modules.indexing.get_update_stats(names=options['indexes'])
+        for name, values in sorted(stats.iteritems()):
+            self.stdout.write(
+                "Index '{0}': {queued} queued, lag {lag:.1f}s, "
+                "last run {processed} documents in {duration:.1f}s "
+                "(average lag {average_lag:.1f}s, max lag {max_lag:.1f}s)"
+                .format(name, **values))
@@ -0,0 +1,123 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from sellmo import modules
+from sellmo.api.decorators import load
+
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+@load(action='finalize_indexing_IndexUpdate')
+def finalize_model():
+    class IndexUpdate(modules.indexing.IndexUpdate):
+
+        class Meta(modules.indexing.IndexUpdate.Meta):
+            app_label = 'indexing'
+
+    modules.indexing.IndexUpdate = IndexUpdate
+
+
+@load(action='finalize_indexing_IndexHandle')
+def finalize_model():
+    class IndexHandle(modules.indexing.IndexHandle):
+
+        class Meta(modules.indexing.IndexHandle.Meta):
+            app_label = 'indexing'
+
+    modules.indexing.IndexHandle = IndexHandle
+
+
+class IndexUpdate(models.Model):
+
+    """
+    A document queued for updating, each document is queued only once.
+    """
+
+    index = models.CharField(
+        max_length=80,
+    )
+
+    document = models.PositiveIntegerField()
+
+    queued = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+    )
+
+    class Meta:
+        abstract = True
+        unique_together = ('index', 'document')
+
+
+class IndexHandle(models.Model):
+
+    """
+    Keeps track of updates for an index.
+    """
+
+    index = models.CharField(
+        max_length=80,
+        unique=True,
+    )
+
+    updated = models.DateTimeField(
+        null=True,
+        verbose_name=_("updated"),
+    )
+
+    processed = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("processed"),
+    )
+
+    # Lag (in seconds) between queueing and updating, for the last run.
+    average_lag = models.FloatField(
+        default=0,
+        verbose_name=_("average lag"),
+    )
+
+    max_lag = models.FloatField(
+        default=0,
+        verbose_name=_("max lag"),
+    )
+
+    duration = models.FloatField(
+        default=0,
+        verbose_name=_("duration"),
+    )
+
+    def __unicode__(self):
+        return self.index
+
+    class Meta:
+        abstract = True
+        verbose_name = _("index handle")
+        verbose_name_plural = _("index handles")
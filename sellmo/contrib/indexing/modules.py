@@ -29,130 +29,168 @@
 
 
 import logging
+import time
 
 from sellmo import modules
-from sellmo.api.decorators import chainable
 from sellmo.api.configuration import define_setting
-from sellmo.core.query import PKIterator
+from sellmo.api.indexing.exceptions import (IndexMissingException,
+                                            IndexBackendException)
+from sellmo.contrib.indexing.models import IndexUpdate, IndexHandle
 
-from django.db import transaction
-from django.db.models.query import QuerySet
-from django.utils import timezone
+from django.db import transaction, IntegrityError
+from django.utils import timezone, six
 
 
 logger = logging.getLogger('sellmo')
 
 
 class IndexingModule(modules.indexing):
-    namespace = 'price_indexing'
-
-    def _get_handle(self, index):
-        if self.PriceIndexHandle.objects.filter(index=index).count() == 0:
-            self.PriceIndexHandle.objects.create(index=index)
-        return self.PriceIndexHandle.objects.select_for_update() \
-                                            .get(index=index)
-
-    def _read_updates(self, handle):
-        if handle.updates:
-            return handle.updates
-        else:
-            return {
-                'kwargs': {},
-            }
 
-    def _write_updates(self, handle, updates):
-        handle.updates = updates
-        handle.save()
-
-    def _merge_kwarg(self, index, key, existing, new):
-        merged = list(existing)
-        merged.extend([value for value in new if value not in existing])
-        return merged
-
-    def _convert_kwarg(self, index, key, value):
-        if index.kwargs[key].get('model', None) is not None:
-            if isinstance(value, QuerySet):
-                return list(value.values_list('pk', flat=True))
-            else:
-                return [obj.pk for obj in value]
-        else:
-            return list(value)
-
-    @chainable()
-    def queue_update(self, chain, identifier, **kwargs):
-        index = modules.pricing.get_index(identifier)
-        with transaction.atomic():
-            handle = self._get_handle(index)
-            updates = self._read_updates(handle)
-
-            # Merge kwargs
-            existing = dict(updates['kwargs'])
-            for key, value in kwargs.iteritems():
-                if not value:
-                    # Skip empty lists (or querysets)
-                    continue
-
-                value = self._convert_kwarg(index, key, value)
-                if key in existing:
-                    value = self._merge_kwarg(key, index, existing[key], value)
-                existing[key] = value
-
-            updates['kwargs'] = existing
-            self._write_updates(handle, updates)
-
-    @chainable()
-    def handle_updates(self, chain, **kwargs):
-        for identifier, index in modules.pricing.indexes.iteritems():
-            self._handle_updates(identifier, index)
-
-    def _handle_updates(self, identifier, index):
-        with transaction.atomic():
-            handle = self._get_handle(identifier)
-            if handle.updates is None:
-                # Nothing to update
-                return
-            # Read and clear updates
-            updates = self._read_updates(handle)
-            self._write_updates(handle, None)
-
-        logger.info("Index '{0}' is updating.".format(identifier))
-
-        # Resolve actual kwargs
-        kwargs = {}
-        for key, value in updates['kwargs'].iteritems():
-            if index.kwargs[key].get('model', None) is not None:
-                model = index.kwargs[key]['model']
-                kwargs[key] = PKIterator(model, value)
-            else:
-                kwargs[key] = value
-
-        combinations = modules.pricing.update_index(
-            identifier=identifier,
-            delay=True,
-            **kwargs
-        )
-
-        logger.info("Updating {1} indexes for index '{0}'"
-                    .format(identifier, len(combinations)))
-
-        with transaction.atomic():
-            for combination in combinations:
-                price = modules.pricing.get_price(**combination)
-                signature = ", ".join(str(value) for value in 
-                                      combination.values())
-
-                if index.index(price, **combination):
-                    logger.info("Index {1}={2} created for index '{0}'"
-                        .format(identifier, signature, price.amount))
-                else:
-                    logger.info("Index {1}={2} omitted for index '{0}'"
-                        .format(identifier, signature, price.amount))
-
-            handle = self._get_handle(identifier)
+    IndexUpdate = IndexUpdate
+    IndexHandle = IndexHandle
+
+    #: Amount of queued documents to handle at once
+    handle_chunk_size = define_setting(
+        'INDEX_HANDLE_CHUNK_SIZE',
+        default=1000)
+
+    def write_updates(self, name, documents):
+        """
+        Queues the given document pks for updating. A document is queued
+        only once, no matter how often it gets queued before the queue
+        is handled.
+        """
+        self._queue_documents(name, documents)
+
+    def _queue_documents(self, name, documents):
+        documents = sorted(documents)
+        for i in six.moves.range(0, len(documents), self.handle_chunk_size):
+            chunk = documents[i:i + self.handle_chunk_size]
+            queued = set(self.IndexUpdate.objects
+                         .filter(index=name, document__in=chunk)
+                         .values_list('document', flat=True))
+            missing = [document for document in chunk
+                       if document not in queued]
+            if not missing:
+                continue
+            try:
+                with transaction.atomic():
+                    self.IndexUpdate.objects.bulk_create([
+                        self.IndexUpdate(index=name, document=document)
+                        for document in missing])
+            except IntegrityError:
+                # Queued concurrently, fall back to queueing one by one
+                for document in missing:
+                    self.IndexUpdate.objects.get_or_create(
+                        index=name, document=document)
+
+    def handle_updates(self, names=None, chunk_size=None):
+        """
+        Updates all queued documents, oldest first. Returns a mapping of
+        index name to the amount of documents updated.
+        """
+        if names is None:
+            names = (self.IndexUpdate.objects
+                     .values_list('index', flat=True).distinct())
+        return {
+            name: self._handle_updates(name, chunk_size)
+            for name in list(names)
+        }
+
+    def _handle_updates(self, name, chunk_size=None):
+        if chunk_size is None:
+            chunk_size = self.handle_chunk_size
+
+        logger.info("Index '{0}' is updating.".format(name))
+        start = time.time()
+        processed = 0
+        total_lag = max_lag = 0.0
+
+        while True:
+            with transaction.atomic():
+                updates = list(self.IndexUpdate.objects
+                               .filter(index=name)
+                               .order_by('queued', 'pk')[:chunk_size])
+                if not updates:
+                    break
+                self.IndexUpdate.objects.filter(
+                    pk__in=[update.pk for update in updates]).delete()
+                try:
+                    # Documents are updated through the index, which
+                    # prefetches prices for the entire chunk
+                    self.update_documents(
+                        name=name,
+                        documents=[update.document for update in updates],
+                        chunk_size=chunk_size)
+                except IndexMissingException:
+                    # Keep the documents queued
+                    transaction.set_rollback(True)
+                    logger.warning("Index '{0}' is missing, updates are "
+                                   "kept queued.".format(name))
+                    break
+                except IndexBackendException as ex:
+                    transaction.set_rollback(True)
+                    logger.error("Index '{0}' could not be updated, updates "
+                                 "are kept queued: {1}".format(name, ex))
+                    break
+
+            now = timezone.now()
+            for update in updates:
+                lag = (now - update.queued).total_seconds()
+                total_lag += lag
+                max_lag = max(max_lag, lag)
+            processed += len(updates)
+
+        if processed:
+            handle, created = self.IndexHandle.objects.get_or_create(
+                index=name)
             handle.updated = timezone.now()
+            handle.processed = processed
+            handle.average_lag = total_lag / processed
+            handle.max_lag = max_lag
+            handle.duration = time.time() - start
             handle.save()
 
-        logger.info("Index '{0}' updated.".format(index))
-
-
-
+        logger.info("Index '{0}' updated, {1} documents updated."
+                    .format(name, processed))
+        return processed
+
+    def get_lag(self, name):
+        """
+        Returns the age (in seconds) of the oldest queued document for
+        the given index, or 0 if nothing is queued.
+        """
+        oldest = (self.IndexUpdate.objects
+                  .filter(index=name)
+                  .order_by('queued')
+                  .values_list('queued', flat=True)[:1])
+        if not oldest:
+            return 0.0
+        return (timezone.now() - oldest[0]).total_seconds()
+
+    def get_update_stats(self, names=None):
+        """
+        Returns queue and lag statistics for each (or the given) index.
+        """
+        if names is None:
+            names = set(self.IndexUpdate.objects
+                        .values_list('index', flat=True).distinct())
+            names |= set(self.IndexHandle.objects
+                         .values_list('index', flat=True))
+        handles = {
+            handle.index: handle for handle in
+            self.IndexHandle.objects.filter(index__in=list(names))
+        }
+        stats = {}
+        for name in names:
+            handle = handles.get(name)
+            stats[name] = {
+                'queued': self.IndexUpdate.objects.filter(index=name).count(),
+                'lag': self.get_lag(name),
+                'updated': handle.updated if handle else None,
+                'processed': handle.processed if handle else 0,
+                'average_lag': handle.average_lag if handle else 0.0,
+                'max_lag': handle.max_lag if handle else 0.0,
+                'duration': handle.duration if handle else 0.0,
+            }
+        return stats
@@ -34,10 +34,10 @@ from sellmo import modules
 
 
 @shared_task
-def queue_update(identifier, **kwargs):
-    modules.indexing.queue_update(identifier=identifier, **kwargs)
-    
+def queue_update(name, documents):
+    modules.indexing.queue_update(name=name, documents=documents)
+
 
 @shared_task
 def handle_updates():
-    modules.indexing.handle_updates()
\ No newline at end of file
+    modules.indexing.handle_updates()
@@ -29,7 +29,7 @@
 
 
 from sellmo import modules, celery, params
-from sellmo.api.decorators import link
+from sellmo.api.decorators import link, batch
 from sellmo.api.pricing import Price
 
 
@@ -39,14 +39,46 @@ namespace = modules.pricing.namespace
 @link()
 def get_price(price, product=None, currency=None, qty=1, **kwargs):
     if product and not qty is None and not price:
-        try:
-            qty_price = modules.qty_pricing.ProductQtyPrice.objects.filter(
-                product=product).for_qty(qty)
-        except modules.qty_pricing.ProductQtyPrice.DoesNotExist:
-            pass
+        if 'qty_price' in kwargs:
+            # Prefetched by get_price_many
+            qty_price = kwargs['qty_price']
         else:
+            try:
+                qty_price = (modules.qty_pricing.ProductQtyPrice.objects
+                             .filter(product=product).for_qty(qty))
+            except modules.qty_pricing.ProductQtyPrice.DoesNotExist:
+                qty_price = None
+        if qty_price is not None:
             price = qty_price.apply(price)
     return {
         'qty': qty,
         'price': price
-    }
\ No newline at end of file
+    }
+
+
+@batch(get_price)
+def get_price_many(items):
+    # Query all tiers for all products at once
+    products = set(item['product'].pk for item in items
+                   if item.get('product') and not item.get('price'))
+    tiers = {}
+    if products:
+        for tier in (modules.qty_pricing.ProductQtyPrice.objects
+                     .filter(product__in=products).order_by('qty')):
+            tiers.setdefault(tier.product_id, []).append(tier)
+
+    responses = []
+    for item in items:
+        product = item.get('product', None)
+        qty = item.get('qty', 1)
+        if not product or qty is None or item.get('price'):
+            responses.append(None)
+            continue
+        qty_price = None
+        for tier in tiers.get(product.pk, []):
+            if tier.qty <= qty:
+                qty_price = tier
+        responses.append({
+            'qty_price': qty_price
+        })
+    return responses
\ No newline at end of file
@@ -35,7 +35,7 @@ from sellmo.api.decorators import load
 from sellmo.api.pricing import Price
 
 from django.db import models
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_save, post_delete
 from django.db.models.query import QuerySet
 from django.utils.translation import ugettext_lazy as _
 
@@ -137,8 +137,8 @@ class QtyPriceRatio(models.Model):
 
 
 def on_invalidate_qty_price(sender, instance, **kwargs):
-    #modules.pricing.get_index('product_price').update(product=[instance.product])
-    print 'update qty price'
+    modules.indexing.queue_update(
+        name='product', documents=[instance.product_id])
 
 
 @load(action='finalize_qty_pricing_ProductQtyPrice')
@@ -153,7 +153,7 @@ def load_model():
 
     modules.qty_pricing.ProductQtyPrice = ProductQtyPrice
     post_save.connect(on_invalidate_qty_price, sender=ProductQtyPrice)
-    pre_delete.connect(on_invalidate_qty_price, sender=ProductQtyPrice)
+    post_delete.connect(on_invalidate_qty_price, sender=ProductQtyPrice)
 
 
 class ProductQtyPrice(models.Model):
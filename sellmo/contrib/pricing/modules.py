@@ -29,7 +29,8 @@
 
 
 from sellmo import modules, Module
-from sellmo.api.decorators import chainable
+from sellmo.api.decorators import chainable, cached_chain
+from sellmo.caching import QuerySetPickler
 from sellmo.api.configuration import define_setting
 from sellmo.contrib.pricing.models import (QtyPriceBase,
                                                    QtyPrice,
@@ -49,7 +50,12 @@ class QtyPricingModule(Module):
         'INDEXABLE_QTYS',
         default=[1])
     
-    @chainable()
+    @cached_chain(
+        key=lambda product, tiers=None, **kwargs: (
+            product.pk if not tiers and not kwargs else None),
+        invalidate=[('pricing.ProductQtyPrice',
+                     lambda instance, **kwargs: {'product': instance.product})],
+        pickler=QuerySetPickler())
     def get_tiers(self, chain, product, tiers=None, **kwargs):
         if not tiers:
             tiers = product.qty_prices.all()
@@ -31,6 +31,7 @@
 from sellmo import modules
 from sellmo.api.decorators import load
 from sellmo.api.pricing import Price
+from sellmo.core.polymorphism import downcast_many
 from sellmo.contrib.shipping \
      .methods.tiered_shipping import (TieredShippingMethod as 
                                       _TieredShippingMethod)
@@ -117,6 +118,9 @@ class TieredShippingTierQuerySet(QuerySet):
         if modules.shipping.max_tier_attributes > 0:
             # Match against attribute totals
             _settings = modules.settings.get_settings()
+            purchases = list(order)
+            products = downcast_many(
+                purchase.product for purchase in purchases)
             for i in range(modules.shipping.max_tier_attributes):
                 attribute = getattr(
                     _settings, 'shipping_tier_attribute{0}'.format(i + 1))
@@ -124,8 +128,7 @@ class TieredShippingTierQuerySet(QuerySet):
                 if attribute:
                     # Collect order total value for this attribute
                     total = 0
-                    for purchase in order:
-                        product = purchase.product.downcast()
+                    for purchase, product in zip(purchases, products):
                         value = product.attributes[attribute.key]
                         if value is not None:
                             total += value * purchase.qty
@@ -77,8 +77,10 @@ modules.settings.add_setting('tax_inclusive', models.BooleanField(
 
 
 def on_setting_changed(sender, setting, old, new, site, **kwargs):
-    #modules.pricing.get_index('product_price').update()
-    print 'tax settings changed'
+    if setting == 'tax_inclusive':
+        # Affects all product prices
+        modules.indexing.queue_update(
+            name='product', documents=modules.product.Product.objects.all())
         
 
 setting_changed.connect(on_setting_changed)
@@ -30,7 +30,7 @@
 
 from sellmo import modules
 from sellmo.core.local import get_context
-from sellmo.api.decorators import link
+from sellmo.api.decorators import link, batch
 from sellmo.api.pricing import Price
 
 
@@ -54,6 +54,36 @@ def retrieve(stampable, prop, price=None, **kwargs):
     }
 
 
+@batch(retrieve)
+def retrieve_many(items):
+    # Query all stamped taxes at once and assign them to their
+    # stampables, leaving nothing to query for retrieve.
+    stampables = {}
+    for item in items:
+        field = '{0}_tax_tax'.format(item['prop'])
+        tax_id = getattr(item['stampable'], '{0}_id'.format(field), None)
+        if tax_id is not None:
+            stampables.setdefault(tax_id, []).append(
+                (item['stampable'], field))
+
+    if stampables:
+        context = get_context()
+        taxes = context.get('taxes', {})
+        missing = [tax_id for tax_id in stampables
+                   if tax_id not in taxes]
+        if missing:
+            taxes_qs = modules.tax.Tax.objects.filter(pk__in=missing)
+            for tax in taxes_qs:
+                taxes[tax.pk] = tax
+            context['taxes'] = taxes
+        for tax_id, targets in stampables.iteritems():
+            if tax_id in taxes:
+                for stampable, field in targets:
+                    setattr(stampable, field, taxes[tax_id])
+
+    return [None] * len(items)
+
+
 @link()
 def stamp(stampable, prop, price, **kwargs):
     if 'tax' in price.context:
@@ -69,11 +99,15 @@ def get_price(price, product=None, shipping_method=None, payment_method=None,
               
     tax = None
     if product:
-        try:
-            tax = modules.tax.Tax.objects.polymorphic() \
-                         .get_best_for_product(product)
-        except modules.tax.Tax.DoesNotExist:
-            tax = None
+        if 'product_tax' in kwargs:
+            # Prefetched by get_price_many
+            tax = kwargs['product_tax']
+        else:
+            try:
+                tax = modules.tax.Tax.objects.polymorphic() \
+                             .get_best_for_product(product)
+            except modules.tax.Tax.DoesNotExist:
+                tax = None
     elif shipping_method or payment_method:
         settings = modules.settings.get_settings()
         if shipping_method and settings.shipping_costs_tax:
@@ -87,3 +121,19 @@ def get_price(price, product=None, shipping_method=None, payment_method=None,
     return {
         'price': price
     }
+
+
+@batch(get_price)
+def get_price_many(items):
+    products = [item['product'] for item in items
+                if item.get('product') and not item.get('raw', False)]
+    if not products:
+        return [None] * len(items)
+
+    taxes = modules.tax.Tax.objects.polymorphic() \
+                   .get_best_for_products(products)
+    return [
+        {'product_tax': taxes.get(item['product'].pk, None)}
+        if item.get('product') and not item.get('raw', False) else None
+        for item in items
+    ]
@@ -41,44 +41,63 @@ from django.db import models
 from django.db.models.signals import (pre_save,
                                       post_save,
                                       pre_delete,
+                                      post_delete,
                                       m2m_changed)
 from django.db.models import Q
 from django.contrib.sites.models import Site
 from django.utils.translation import ugettext_lazy as _
 
-#
 
 def on_tax_pre_save(sender, instance, **kwargs):
     if instance.pk is not None:
+        # Products related before saving need to be updated as well
         old = instance.__class__.objects.get(pk=instance.pk)
-        update_indexes(old)
+        instance._related_products = list(
+            old.get_related_products().values_list('pk', flat=True))
 
 
 def on_tax_post_save(sender, instance, **kwargs):
-    update_indexes(instance)
+    products = set(getattr(instance, '_related_products', []))
+    products.update(
+        instance.get_related_products().values_list('pk', flat=True))
+    queue_products(products)
+
+
+def on_tax_m2m_changed(sender, instance, action, reverse, model, pk_set=None,
+                       **kwargs):
+    # Queue related products before they are removed and after they are
+    # added.
+    if action not in ('pre_remove', 'pre_clear', 'post_add'):
+        return
+    if not reverse:
+        update_indexes(instance)
+    elif isinstance(instance, modules.product.Product):
+        queue_products([instance])
+    elif pk_set is None:
+        # Cleared, can't tell which products were related
+        queue_products(modules.product.Product.objects.all())
+    else:
+        for tax in model.objects.filter(pk__in=pk_set):
+            update_indexes(tax)
 
 
-def on_tax_m2m_changed(sender, instance, action, reverse, **kwargs):
-    if action.startswith('post_'):
-        if not reverse:
-            update_indexes(instance)
-        else:
-            """
-            modules.pricing.get_index(
-                'product_price').update(product=[instance])
-            """
-            print 'tax m2m changed'
-            index = modules.indexing.get_index(name='product')
-            index.update()
+def on_tax_pre_delete(sender, instance, **kwargs):
+    # Relations are gone after deletion, remember related products now
+    instance._related_products = list(
+        instance.get_related_products().values_list('pk', flat=True))
 
 
-def on_tax_pre_delete(sender, instance, **kwargs):
-    update_indexes(instance)
+def on_tax_post_delete(sender, instance, **kwargs):
+    queue_products(getattr(instance, '_related_products', []))
+
+
+def queue_products(products):
+    modules.indexing.queue_update(name='product', documents=products)
 
 
 def update_indexes(tax):
-    # products = modules.product.Product.objects.for_relatable(tax)
-    print 'update taxes'
+    queue_products(tax.get_related_products())
+
 
 # Make sure to load directly after finalize_product_ProductRelatable and thus
 # directly after finalize_product_Product
@@ -153,4 +172,5 @@ def finalize():
         pre_save.connect(on_tax_pre_save, sender=subtype)
         post_save.connect(on_tax_post_save, sender=subtype)
         pre_delete.connect(on_tax_pre_delete, sender=subtype)
+        post_delete.connect(on_tax_post_delete, sender=subtype)
 
@@ -31,8 +31,9 @@
 from django.http import Http404
 
 from sellmo import modules
-from sellmo.api.decorators import link
+from sellmo.api.decorators import link, batch
 from sellmo.api.pricing import Price
+from sellmo.core.polymorphism import downcast_many
 from sellmo.contrib.attribute.query import product_q
 
 from django import forms
@@ -105,6 +106,13 @@ def capture_get_price(product=None, **kwargs):
         return out
 
 
+@batch(capture_get_price)
+def capture_get_price_many(items):
+    # Downcast all products at once
+    downcast_many(item['product'] for item in items if item.get('product'))
+    return [capture_get_price(**item) for item in items]
+
+
 @link(namespace=modules.pricing.namespace)
 def get_price(price, product=None, variant=None, **kwargs):
     if variant and variant.price_adjustment != 0:
@@ -114,6 +122,22 @@ def get_price(price, product=None, variant=None, **kwargs):
     }
 
 
+@link(namespace=modules.indexing.namespace)
+def queue_update(name, documents, **kwargs):
+    if name == 'product' and documents:
+        # Variant prices derive from their product's price
+        products = sorted(documents)
+        documents = set(documents)
+        for subtype in modules.variation.subtypes:
+            for i in range(0, len(products), 500):
+                documents.update(subtype.objects
+                                 .filter(product__in=products[i:i + 500])
+                                 .values_list('pk', flat=True))
+        return {
+            'documents': documents
+        }
+
+
 @link(namespace=modules.store.namespace)
 def make_purchase(purchase, variation=None, **kwargs):
     if variation:
@@ -163,10 +187,14 @@ def get_add_to_cart_formset(formset, cls, product, variations=None,
 
     # Add variation field as either a choice or as a hidden integer
     if not modules.variation.batch_buy_enabled:
+        # Resolve raw prices for all variants and the product at once
+        prices = modules.pricing.get_prices(
+            products=[el.variant.downcast() for el in variations] + [product],
+            raw=True)
         dict['variation'] = forms.ChoiceField(
             label=modules.variation.generate_variation_label(attributes=attributes),
             choices=[(el.id, modules.variation.generate_variation_choice(
-                        variation=el, attributes=attributes))
+                        variation=el, attributes=attributes, prices=prices))
                       for el in variations]
         )
     else:
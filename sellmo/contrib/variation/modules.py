@@ -29,20 +29,23 @@
 
 
 from sellmo import modules, Module
-from sellmo.api.decorators import view, chainable
+from sellmo.api.decorators import view, chainable, cached_chain
 from sellmo.api.pricing import Price
 from sellmo.api.configuration import define_setting
+from sellmo.caching import QuerySetPickler
 from sellmo.utils.formatting import call_or_format
 from sellmo.contrib.variation.models import (Variant,
                                                      Variation,
                                                      VariationsState,
                                                      VariationPurchase)
+from sellmo.contrib.variation.signals import variations_invalidated
 from sellmo.contrib.attribute.query import product_q
 
 from django.http import Http404
 from django.utils.translation import ugettext_lazy as _
 
 from django.db.models import Q, Count
+from django.db.models.query import QuerySet
 from django.db.models.signals import post_save, m2m_changed
 
 
@@ -59,6 +62,30 @@ def choice_format(values, price_adjustment, **kwargs):
     return u"{values}".format(values=values)
 
 
+def query_key(queryset):
+    if isinstance(queryset, QuerySet):
+        return str(queryset.query)
+    return None
+
+
+def variating_attributes_key(variations, attributes=None, **kwargs):
+    if attributes is None and not kwargs:
+        return query_key(variations)
+    return None
+
+
+def variation_label_key(variations=None, attributes=None, label=None,
+                        **kwargs):
+    if label is None and not kwargs:
+        if attributes is not None:
+            key = query_key(attributes)
+            return ('attributes', key) if key is not None else None
+        elif variations is not None:
+            key = query_key(variations)
+            return ('variations', key) if key is not None else None
+    return None
+
+
 class VariationModule(Module):
 
     namespace = 'variation'
@@ -210,7 +237,10 @@ class VariationModule(Module):
         return variations
         
         
-    @chainable()
+    @cached_chain(
+        key=variating_attributes_key,
+        invalidate=[variations_invalidated, 'attribute.Attribute'],
+        pickler=QuerySetPickler())
     def get_variating_attributes(self, chain, variations, 
                                  attributes=None, **kwargs):
         if attributes is None:
@@ -232,7 +262,7 @@ class VariationModule(Module):
                         
         if chain:
             out = chain.execute(variations=variations, 
-                                attributes=attributes
+                                attributes=attributes,
                                 **kwargs)
             if out.has_key('attributes'):
                 attributes = out['attributes']
@@ -240,7 +270,9 @@ class VariationModule(Module):
         return attributes
     
         
-    @chainable()
+    @cached_chain(
+        key=variation_label_key,
+        invalidate=[variations_invalidated, 'attribute.Attribute'])
     def generate_variation_label(self, chain, variations=None, 
                                 attributes=None, label=None, **kwargs):
                                  
@@ -268,7 +300,8 @@ class VariationModule(Module):
 
     @chainable()
     def generate_variation_choice(self, chain, variation, variations=None,
-                                  attributes=None, choice=None, **kwargs):
+                                  attributes=None, choice=None, prices=None,
+                                  **kwargs):
                                   
         if attributes is None and variations is not None:
             attributes = self.get_variating_attributes(variations=variations)
@@ -278,11 +311,14 @@ class VariationModule(Module):
             price_adjustment = None
             
             if hasattr(variant, '_is_variant'):
-                price_adjustment = (
-                    modules.pricing.get_price(product=variant,
-                                              raw=True)
-                    - modules.pricing.get_price(product=variant.product, 
-                                                raw=True))
+                # Raw prices can be passed in for all variations at once,
+                # see get_add_to_cart_formset.
+                if (prices is None or variant.pk not in prices
+                        or variant.product_id not in prices):
+                    prices = modules.pricing.get_prices(
+                        products=[variant, variant.product], raw=True)
+                price_adjustment = (prices[variant.pk]
+                                    - prices[variant.product_id])
 
             values = variation.values.all().order_by('attribute')
             if attributes is not None:
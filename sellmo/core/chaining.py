@@ -33,6 +33,7 @@ import functools
 import logging
 
 from sellmo.signals.core import module_created, module_init
+from sellmo.core.instrumentation import profiler, describe
 
 from django.http import HttpResponse
 
@@ -40,6 +41,9 @@ from django.http import HttpResponse
 logger = logging.getLogger('sellmo')
 
 
+_missing = object()
+
+
 def validate_func(func):
     if not callable(func):
         logger.warning(
@@ -69,15 +73,22 @@ class Chainer(object):
         module_init.connect(self.on_module_init)
 
     def hookup(self):
-        # Fix bound links
+        # Fix bound links, only the class dictionaries are inspected. This
+        # avoids evaluating every (lazy) attribute on a module instance.
         for module in self._modules:
-            for name, attr in inspect.getmembers(module):
-                if hasattr(attr, '_linked'):
-                    path = attr._link_path
-                    links = self._links[path]
-                    link = filter(
-                        lambda el: el['func'] == attr.__func__, links)[0]
-                    link['func'] = attr
+            seen = set()
+            for cls in type(module).__mro__:
+                for name, attr in cls.__dict__.items():
+                    # Attribute is shadowed by a subclass
+                    if name in seen:
+                        continue
+                    seen.add(name)
+                    if not getattr(attr, '_linked', False):
+                        continue
+                    links = self._links.get(attr._link_path, [])
+                    for link in links:
+                        if link['func'] is attr:
+                            link['func'] = getattr(module, name)
 
         # Hookup links
         for path, links in self._links.iteritems():
@@ -96,6 +107,14 @@ class Chainer(object):
                 validate_func(link['func'])
                 chain.hookup(link['func'], capture=link['capture'])
 
+        # Compile all chains, including those without any links
+        for path, chain in self._chains.iteritems():
+            chain.compile()
+            if chain.cache is not None and chain.cache.enabled:
+                chain.memoize(path)
+            if profiler.enabled:
+                chain.instrument(path, profiler)
+
     def link(self, func, name=None, namespace=None, capture=False):
         if namespace is None:
             # Resolve namespace from func
@@ -131,9 +150,12 @@ class Chainer(object):
     def chain(self, chain):
         def wrapper(*args, **kwargs):
             return chain.handle(*args, **kwargs)
+        def many(items, **kwargs):
+            return chain.handle_many(chain.module, items, **kwargs)
         wrapper = functools.update_wrapper(wrapper, chain._func)
         # Assign chain to wrapper, this allows us to map later on
         wrapper._chain = chain
+        wrapper.many = many
         return wrapper
 
     def on_module_init(self, sender, module, **kwargs):
@@ -145,14 +167,47 @@ class Chainer(object):
                 # Map chain
                 path = '{0}.{1}'.format(module.namespace, chain._func.__name__)
                 self._chains[path] = chain
+                chain.module = module
+
+
+class ChainPlan(object):
+
+    """
+    Frozen execution plan of a chain. Capture and execute links are
+    stored as tuples of (func, generator, batch) triples, in the order in
+    which they are called. The generator flag is resolved once, during
+    compilation, instead of on every call. Batch is the link's batch
+    variant, if any.
+    """
+
+    __slots__ = ('capture', 'execute')
+
+    def __init__(self, capture, execute):
+        self.capture = capture
+        self.execute = execute
+
+    @staticmethod
+    def compile_link(func):
+        return (func, inspect.isgeneratorfunction(func),
+                getattr(func, '_batch', None))
+
+    @classmethod
+    def compile(cls, capture_queue, queue):
+        return cls(
+            capture=tuple(cls.compile_link(func) for func in capture_queue),
+            execute=tuple(cls.compile_link(func) for func in queue))
 
 
 class Chain(object):
 
-    def __init__(self, func):
+    _plan = None
+    module = None
+
+    def __init__(self, func, cache=None):
         self._queue = []
         self._capture_queue = []
         self._func = func
+        self.cache = cache
 
     def hookup(self, link, capture=False):
         if capture:
@@ -161,12 +216,65 @@ class Chain(object):
         else:
             # Last link is executed last
             self._queue.append(link)
+        # Plan is outdated
+        self._plan = None
+
+    def compile(self):
+        self._plan = ChainPlan.compile(
+            reversed(self._capture_queue), self._queue)
+        return self._plan
+
+    def memoize(self, path):
+        """
+        Replaces handle with a version which caches results through
+        this chain's ChainCache.
+        """
+        self.cache.setup(path)
+        self.handle = self.cache.memoize(self.handle)
+
+    def instrument(self, path, profiler):
+        """
+        Replaces the compiled plan and handle with instrumented
+        versions. Only called when chain profiling is enabled.
+        """
+        def instrument_links(links):
+            out = []
+            for func, generator, batch in links:
+                key = '{0}:{1}'.format(path, describe(func))
+                func = profiler.instrument('links', key, func, generator)
+                if batch is not None:
+                    batch = profiler.instrument(
+                        'links', '{0}.many'.format(key), batch)
+                out.append((func, generator, batch))
+            return tuple(out)
+
+        plan = self.plan
+        self._plan = ChainPlan(
+            capture=instrument_links(plan.capture),
+            execute=instrument_links(plan.execute))
+        self.handle = profiler.instrument('chains', path, self.handle)
+        self.handle_many = profiler.instrument(
+            'chains', '{0}.many'.format(path), self.handle_many)
+
+    @property
+    def plan(self):
+        plan = self._plan
+        if plan is None:
+            plan = self.compile()
+        return plan
 
     def handle(self, module, **kwargs):
-        func = self._func
+        plan = self._plan
+        if plan is None:
+            plan = self.compile()
+
+        # Fast path, nothing to capture
+        if not plan.capture:
+            return self._func(module, self, **kwargs)
 
         # Capture
-        out = self._loop(reversed(self._capture_queue), **kwargs)
+        func = self._func
+        out = self._loop(plan.capture, **kwargs)
         if not out[1] is None:
             if inspect.isfunction(out[1]):
                 func = out[1]
@@ -176,16 +284,20 @@ class Chain(object):
         kwargs = out[0]
         return func(module, self, **kwargs)
 
-    def _loop(self, queue, **kwargs):
-        for func in queue:
+    def _loop(self, plan, **kwargs):
+        should_return = self.should_return
+        for func, generator, batch in plan:
             # We allow for yieldable output
-            if inspect.isgeneratorfunction(func):
+            if generator:
                 responses = list(func(**kwargs))
             else:
-                responses = [func(**kwargs)]
+                responses = (func(**kwargs),)
             # Iterate through output
             for response in responses:
-                if self.should_return(response):
+                if response is None:
+                    # Nothing to do, just keep on looping
+                    continue
+                elif should_return(response):
                     # Return immediately
                     return (kwargs, response)
                 elif isinstance(response, dict):
@@ -194,9 +306,6 @@ class Chain(object):
                 elif response is False:
                     # SKIP (1)
                     break
-                elif response is None:
-                    # Nothing to do, just keep on looping
-                    continue
                 else:
                     raise Exception(
                         "Func '{0}' gave an unexpected "
@@ -209,19 +318,101 @@ class Chain(object):
             break
         return (kwargs, None)
 
+    def handle_many(self, module, items, **kwargs):
+        """
+        Handles a batch of calls to this chain. Each item is a dict of
+        keyword arguments, combined with the shared kwargs. Links which
+        declare a batch variant are called once for all items and return
+        a list of responses, one per item. Responses of batched execute
+        links are merged into each item before the item is handled, this
+        allows them to prefetch whatever the per item link needs. Links
+        without a batch variant are called for each item. Returns a list
+        of results in the order of items.
+        """
+        plan = self.plan
+        items = [dict(kwargs, **item) for item in items]
+        funcs = [self._func] * len(items)
+        results = [_missing] * len(items)
+
+        # Capture, link by link for all items which haven't
+        # returned or skipped yet.
+        capturing = range(len(items))
+        for func, generator, batch in plan.capture:
+            if not capturing:
+                break
+            remaining = []
+            responses = self._call_many(
+                func, generator, batch, [items[i] for i in capturing])
+            for i, responses in zip(capturing, responses):
+                out = self._merge(func, items[i], responses)
+                if out is None:
+                    remaining.append(i)
+                elif out is False:
+                    # SKIP
+                    continue
+                elif inspect.isfunction(out):
+                    funcs[i] = out
+                else:
+                    results[i] = out
+            capturing = remaining
+
+        # Allow batched execute links to prefetch
+        pending = [i for i, result in enumerate(results)
+                   if result is _missing]
+        for func, generator, batch in plan.execute:
+            if batch is not None and pending:
+                responses = batch([items[i] for i in pending])
+                for i, response in zip(pending, responses):
+                    if isinstance(response, dict):
+                        items[i].update(response)
+
+        for i in pending:
+            results[i] = funcs[i](module, self, **items[i])
+        return results
+
+    def _call_many(self, func, generator, batch, items):
+        if batch is not None:
+            return [response if isinstance(response, list) else [response]
+                    for response in batch(items)]
+        elif generator:
+            return [list(func(**item)) for item in items]
+        return [[func(**item)] for item in items]
+
+    def _merge(self, func, kwargs, responses):
+        for response in responses:
+            if response is None:
+                continue
+            elif self.should_return(response):
+                return response
+            elif isinstance(response, dict):
+                kwargs.update(response)
+            elif response is False:
+                return False
+            else:
+                raise Exception(
+                    "Func '{0}' gave an unexpected "
+                    "response '{1}'."
+                    .format(func, response))
+        return None
+
     def execute(self, **kwargs):
-        out = self._loop(self._queue, **kwargs)
+        plan = self._plan
+        if plan is None:
+            plan = self.compile()
+        if not plan.execute:
+            return kwargs
+        out = self._loop(plan.execute, **kwargs)
         if not out[1] is None:
             return out[1]
         return out[0]
 
     @property
     def can_execute(self):
-        return len(self._queue) > 0
+        return len(self.plan.execute) > 0
 
     @property
     def can_capture(self):
-        return len(self._capture_queue) > 0
+        return len(self.plan.capture) > 0
 
     def should_return(self, response):
         return inspect.isfunction(response)
@@ -0,0 +1,261 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import time
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from sellmo.core.local import get_context, has_context
+from sellmo.api.configuration import define_setting
+
+
+logger = logging.getLogger('sellmo')
+
+
+# Amount of timings kept per chain or link to calculate percentiles.
+SAMPLE_SIZE = 1000
+
+
+def describe(func):
+    """
+    Returns a readable path for a link function or bound method.
+    """
+    owner = getattr(func, '__self__', None)
+    name = getattr(func, '__name__', repr(func))
+    if owner is not None:
+        if not isinstance(owner, type):
+            owner = owner.__class__
+        name = '{0}.{1}'.format(owner.__name__, name)
+    return '{0}.{1}'.format(getattr(func, '__module__', None), name)
+
+
+def query_count():
+    """
+    Returns the amount of queries executed so far, or None if the
+    connection doesn't keep track of them.
+    """
+    if connection.use_debug_cursor or settings.DEBUG:
+        return len(connection.queries)
+    return None
+
+
+class Stat(object):
+
+    def __init__(self, calls=0, time=0.0, queries=0, samples=None):
+        self.calls = calls
+        self.time = time
+        self.queries = queries
+        self.samples = samples if samples is not None else []
+
+    def add(self, elapsed, queries=None):
+        self.calls += 1
+        self.time += elapsed
+        if queries is not None:
+            self.queries += queries
+        if len(self.samples) < SAMPLE_SIZE:
+            self.samples.append(elapsed)
+        else:
+            self.samples[self.calls % SAMPLE_SIZE] = elapsed
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.time += other.time
+        self.queries += other.queries
+        self.samples = (self.samples + other.samples)[-SAMPLE_SIZE:]
+
+    @property
+    def p95(self):
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def __getstate__(self):
+        return (self.calls, self.time, self.queries, self.samples)
+
+    def __setstate__(self, state):
+        self.calls, self.time, self.queries, self.samples = state
+
+
+class Stats(object):
+
+    """
+    Collects timings and query counts per chain path and per link.
+    """
+
+    def __init__(self):
+        self.chains = {}
+        self.links = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, key, elapsed, queries=None):
+        stats = getattr(self, kind)
+        with self._lock:
+            if key not in stats:
+                stats[key] = Stat()
+            stats[key].add(elapsed, queries)
+
+    def merge(self, other):
+        with self._lock:
+            for kind in ('chains', 'links'):
+                stats = getattr(self, kind)
+                for key, stat in getattr(other, kind).iteritems():
+                    if key not in stats:
+                        stats[key] = Stat()
+                    stats[key].merge(stat)
+
+    def clear(self):
+        with self._lock:
+            self.chains = {}
+            self.links = {}
+
+    def __nonzero__(self):
+        return bool(self.chains or self.links)
+
+    def __getstate__(self):
+        return (self.chains, self.links)
+
+    def __setstate__(self, state):
+        self.chains, self.links = state
+        self._lock = threading.Lock()
+
+    def summary(self, kind='chains', limit=None, sort='time'):
+        """
+        Returns a formatted table for the given kind ('chains' or
+        'links'), sorted on 'time', 'calls', 'queries' or 'p95'.
+        """
+        stats = sorted(
+            getattr(self, kind).iteritems(),
+            key=lambda item: getattr(item[1], sort), reverse=True)
+        if limit is not None:
+            stats = stats[:limit]
+        lines = [u"{0:>8} {1:>10} {2:>10} {3:>8}  {4}".format(
+            'calls', 'time (ms)', 'p95 (ms)', 'queries', kind)]
+        for key, stat in stats:
+            lines.append(u"{0:>8} {1:>10.2f} {2:>10.2f} {3:>8}  {4}".format(
+                stat.calls, stat.time * 1000, stat.p95 * 1000,
+                stat.queries, key))
+        return u"\n".join(lines)
+
+
+class ChainProfiler(object):
+
+    """
+    Records chain and link timings into process wide statistics and,
+    when started for the current request, into request statistics.
+    Process wide statistics are periodically published to the cache
+    so that they can be inspected by the chainstats command.
+    """
+
+    enabled = define_setting(
+        'CHAIN_PROFILING',
+        default=False)
+
+    flush_interval = define_setting(
+        'CHAIN_PROFILING_FLUSH_INTERVAL',
+        default=60)
+
+    cache_key = define_setting(
+        'CHAIN_PROFILING_CACHE_KEY',
+        default='_sellmo_chain_profiling')
+
+    def __init__(self):
+        self.stats = Stats()
+        self._pending = Stats()
+        self._flushed = time.time()
+
+    def start_request(self):
+        get_context()['chain_stats'] = Stats()
+
+    def end_request(self):
+        stats = None
+        if has_context():
+            stats = get_context().pop('chain_stats', None)
+        if time.time() - self._flushed > self.flush_interval:
+            self.flush()
+        return stats
+
+    def record(self, kind, key, elapsed, queries=None):
+        self.stats.record(kind, key, elapsed, queries)
+        self._pending.record(kind, key, elapsed, queries)
+        if has_context():
+            stats = get_context().get('chain_stats', None)
+            if stats is not None:
+                stats.record(kind, key, elapsed, queries)
+
+    def flush(self):
+        """
+        Merges statistics recorded since the last flush into the
+        shared statistics in the cache.
+        """
+        pending, self._pending = self._pending, Stats()
+        self._flushed = time.time()
+        if pending:
+            shared = cache.get(self.cache_key) or Stats()
+            shared.merge(pending)
+            cache.set(self.cache_key, shared, None)
+
+    def get_shared_stats(self):
+        return cache.get(self.cache_key) or Stats()
+
+    def reset(self):
+        self.stats.clear()
+        self._pending.clear()
+        cache.delete(self.cache_key)
+
+    def instrument(self, kind, key, func, generator=False):
+        """
+        Wraps func so that every call is recorded under key.
+        """
+        record = self.record
+
+        def wrapper(*args, **kwargs):
+            queries = query_count()
+            start = time.time()
+            try:
+                if generator:
+                    # Consume output as part of the measurement
+                    return list(func(*args, **kwargs))
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.time() - start
+                if queries is not None:
+                    queries = query_count() - queries
+                record(kind, key, elapsed, queries)
+
+        wrapper._instrumented = func
+        return wrapper
+
+
+profiler = ChainProfiler()
@@ -47,6 +47,10 @@ def new_context():
         raise Exception("Local context could not be created.")
 
 
+def has_context():
+    return hasattr(_local, 'context')
+
+
 def get_context():
     if not hasattr(_local, 'context'):
         logger.warning("Local context could not be retrieved.")
@@ -29,3 +29,5 @@
 
 
 from sellmo.core.middleware.local import LocalContextMiddleware
+from sellmo.core.middleware.indexing import IndexingMiddleware
+from sellmo.core.middleware.profiling import ChainProfilingMiddleware
@@ -0,0 +1,64 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import sys
+
+from sellmo import modules
+
+
+class IndexingMiddleware(object):
+
+    """
+    Defers index work until the response, so documents changed multiple
+    times during a request are updated once. Work requested by a view
+    raising an exception is discarded, index failures while writing the
+    work are logged rather than failing the response. Must be placed
+    after LocalContextMiddleware.
+    """
+
+    def process_request(self, request):
+        deferring = modules.indexing.defer_updates()
+        deferring.__enter__()
+        request._indexing_deferring = deferring
+
+    def process_exception(self, request, exception):
+        deferring = getattr(request, '_indexing_deferring', None)
+        if deferring is not None:
+            del request._indexing_deferring
+            # Fail the block, which discards its work
+            deferring.__exit__(
+                type(exception), exception, sys.exc_info()[2])
+
+    def process_response(self, request, response):
+        deferring = getattr(request, '_indexing_deferring', None)
+        if deferring is not None:
+            del request._indexing_deferring
+            deferring.__exit__(None, None, None)
+        return response
@@ -0,0 +1,69 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+
+from django.db import connection
+
+from sellmo.core.instrumentation import profiler
+
+
+logger = logging.getLogger('sellmo')
+
+
+class ChainProfilingMiddleware(object):
+
+    """
+    Logs chain and link timings for each request when SELLMO_CHAIN_PROFILING
+    is enabled. Must be placed after LocalContextMiddleware.
+    """
+
+    limit = 20
+
+    def process_request(self, request):
+        if profiler.enabled:
+            # Queries are only counted by a debug cursor
+            request._chain_profiling_debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+            profiler.start_request()
+
+    def process_response(self, request, response):
+        if profiler.enabled and hasattr(
+                request, '_chain_profiling_debug_cursor'):
+            connection.use_debug_cursor = \
+                request._chain_profiling_debug_cursor
+            stats = profiler.end_request()
+            if stats:
+                logger.info(
+                    u"Chain profile for {0}\n{1}\n{2}".format(
+                        request.path,
+                        stats.summary('chains', limit=self.limit),
+                        stats.summary('links', limit=self.limit)))
+        return response
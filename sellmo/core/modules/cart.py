@@ -261,8 +261,9 @@ class CartModule(sellmo.Module):
 
         if purchase is None:
             try:
-                purchase = modules.store.Purchase.objects.polymorphic().get(
-                    pk=purchase_id)
+                purchase = (modules.store.Purchase.objects
+                            .polymorphic(strategy='join')
+                            .get(pk=purchase_id))
             except modules.store.Purchase.DoesNotExist:
                 raise Http404
 
@@ -326,8 +327,9 @@ class CartModule(sellmo.Module):
 
         if product is None:
             try:
-                product = modules.product.Product.objects.polymorphic().get(
-                    slug=product_slug)
+                product = (modules.product.Product.objects
+                           .polymorphic(strategy='join')
+                           .get(slug=product_slug))
             except modules.product.Product.DoesNotExist:
                 raise Http404
 
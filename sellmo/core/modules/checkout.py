@@ -42,7 +42,7 @@ from sellmo import modules
 from sellmo.core.processing import ProcessError
 from sellmo.utils.tracking import UntrackableError
 from sellmo.utils.formatting import call_or_format
-from sellmo.api.decorators import view, chainable, link
+from sellmo.api.decorators import view, chainable, cached_chain, link
 from sellmo.api.exceptions import ViewNotImplemented
 from sellmo.api.configuration import define_setting, define_import
 from sellmo.api.checkout.models import Order, Shipment, Payment, ORDER_NEW
@@ -57,6 +57,23 @@ def method_choice_format(method, costs, **kwargs):
     return u"{method}".format(method=method)
 
 
+def shipping_methods_key(order, methods=None, **kwargs):
+    # Unsaved orders can't be told apart by pk, so these aren't cached
+    if methods is not None or kwargs or order.pk is None:
+        return None
+    # Shipping methods may depend on the addresses, which can change
+    # during a request without being saved.
+    addresses = []
+    for type in modules.customer.address_types:
+        address = order.get_address(type)
+        if address is not None:
+            address = tuple(
+                getattr(address, field.attname)
+                for field in address._meta.concrete_fields)
+        addresses.append((type, address))
+    return order.pk, order.calculated, tuple(addresses)
+
+
 class CheckoutModule(sellmo.Module):
 
     namespace = 'checkout'
@@ -358,7 +375,7 @@ class CheckoutModule(sellmo.Module):
 
     # SHIPPING LOGIC
 
-    @chainable()
+    @cached_chain(key=shipping_methods_key, tier='request')
     def get_shipping_methods(self, chain, order, methods=None, **kwargs):
         if methods is None:
             methods = {}
@@ -30,36 +30,109 @@
 
 import sellmo
 from sellmo import modules, params
-from sellmo.api.decorators import chainable
+from sellmo.api.decorators import chainable, cached_chain
 from sellmo.api.configuration import define_setting, define_import
-from sellmo.api.indexing.exceptions import IndexMissingException
+from sellmo.api.indexing.exceptions import (IndexExceptionBase,
+                                            IndexMissingException,
+                                            IndexBackendException)
+from sellmo.signals.indexing import index_updated
 
+from django.db import models, DatabaseError
+from django.db.models.query import QuerySet
 from django.utils import six
 
 import logging
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 
 logger = logging.getLogger('sellmo')
 
 
+class DeferredIndexWork(object):
+    """
+    Collects the index work requested while deferring.
+    """
+    
+    def __init__(self):
+        self.updates = {}
+        self.invalidations = set()
+        
+    def __nonzero__(self):
+        return bool(self.updates or self.invalidations)
+        
+    def copy(self):
+        work = DeferredIndexWork()
+        work.updates = {name: set(documents)
+                        for name, documents in six.iteritems(self.updates)}
+        work.invalidations = set(self.invalidations)
+        return work
+        
+    def restore(self, work):
+        self.updates = work.updates
+        self.invalidations = work.invalidations
+
+
 class IndexingModule(sellmo.Module):
 
-    _registry = {}
+    _index_registry = {}
     _indexes = {}
+    _deferred = threading.local()
+    _failing = set()
     namespace = 'indexing'
     
     DefaultIndexAdapter = define_import(
         'DEFAULT_INDEX_ADAPTER',
         default='sellmo.api.indexing.adapters.database.DatabaseIndexAdapter')
+    
+    #: Amount of documents to update at once
+    update_chunk_size = define_setting(
+        'INDEX_UPDATE_CHUNK_SIZE',
+        default=500)
+    
+    #: Where (re)indexing commands keep track of their progress
+    checkpoint_dir = define_setting(
+        'INDEX_CHECKPOINT_DIR',
+        default=tempfile.gettempdir())
+    
+    #: Rebuild indexes alongside the current structure, which keeps
+    #: being searched until the rebuilt structure is swapped in
+    online_rebuild = define_setting(
+        'INDEX_ONLINE_REBUILD',
+        default=True)
+    
+    #: Cache the introspected structure of indexes, it is reused by
+    #: other processes as long as the declared fields don't change
+    cache_introspection = define_setting(
+        'INDEX_CACHE_INTROSPECTION',
+        default=True)
+    
+    #: Seconds between checks whether an index was rebuilt elsewhere
+    stale_check_interval = define_setting(
+        'INDEX_STALE_CHECK_INTERVAL',
+        default=10)
         
     @classmethod
     def register_index(self, name, index_cls, adapter_cls=None):
-        if name in self._registry:
+        if name in self._index_registry:
             raise ValueError(name)
-        self._registry[name] = (index_cls, adapter_cls)
+        self._index_registry[name] = (index_cls, adapter_cls)
+        
+    def get_index_names(self):
+        return list(self._index_registry)
         
     def _invalidate_index(self, index):
-        index = self.create_index(index.__class__, index.name, index.adapter)
+        index = self.create_index(index_cls=index.__class__,
+                                  name=index.name, adapter=index.adapter)
         self._indexes[index.name] = index
+        
+    def _is_stale(self, index):
+        now = time.time()
+        if now - index.checked < self.stale_check_interval:
+            return False
+        index.checked = now
+        return index.adapter.is_stale(index)
             
     @chainable()
     def create_index(self, chain, index_cls, name, adapter, index=None, **kwargs):
@@ -70,6 +143,8 @@ class IndexingModule(sellmo.Module):
                                 index=index, adapter=adapter, **kwargs)
             index = out.get('index', index)
         
+        index.original_fields = index.fields
+        index.checked = time.time()
         introspected_fields = adapter.introspect_index(index)
         building = getattr(params, 'building_indexes', False)
         
@@ -77,6 +152,8 @@ class IndexingModule(sellmo.Module):
             # Index does not yet exist in backend
             if building or adapter.supports_runtime_build():
                 adapter.build_index(index)
+                index.introspected_fields = index.fields
+                index.built = True
             else:
                raise IndexMissingException()
         else:
@@ -106,10 +183,21 @@ class IndexingModule(sellmo.Module):
                     else:
                         changed[field_name] = (a, b)
             
+            index.introspected_fields = introspected_fields
+            index.difference = {
+                'added': added,
+                'deleted': deleted,
+                'changed': changed
+            }
+            
             if added or deleted or changed or building:
                 if (building or adapter.supports_runtime_build()):
                     # Rebuild index
                     adapter.rebuild_index(index, added, deleted, changed)
+                    if not index.rebuilding:
+                        # Rebuilt in place
+                        index.introspected_fields = index.fields
+                        index.built = True
                 else:
                     logger.warning('Index %s not in sync' % index)
                     for field_name, field in six.iteritems(added):
@@ -119,16 +207,17 @@ class IndexingModule(sellmo.Module):
                     for field_name, field in six.iteritems(changed):
                         logger.info('Field %s %s %s differs' % (field_name, field[0], field[1]))
             
-            index.original_fields = index.fields
-            index.introspected_fields = introspected_fields
-            index.difference = {
-                'added': added,
-                'deleted': deleted,
-                'changed': changed
-            }
-            index.fields = intersection
+            if index.introspected_fields is introspected_fields:
+                # Only use what the current structure provides
+                index.fields = intersection
         
         adapter.initialize_index(index)
+        
+        if index.rebuilding and not building:
+            # Fill and swap in the rebuilt structure right away,
+            # buildindexes does so in parallel.
+            index.backfill()
+            index.swap()
         return index
     
     @chainable()
@@ -143,16 +232,20 @@ class IndexingModule(sellmo.Module):
     @chainable()
     def get_index(self, chain, name, index=None, **kwargs):
         if index is None:
-            if name not in self._registry:
+            if name not in self._index_registry:
                 raise KeyError(name)
             if name not in self._indexes:
-                index_cls, adapter_cls = self._registry[name]
+                index_cls, adapter_cls = self._index_registry[name]
                 if adapter_cls is None:
                     adapter_cls = self.DefaultIndexAdapter
                 adapter = self.create_adapter(adapter_cls=adapter_cls)
                 index = self.create_index(index_cls=index_cls, name=name, adapter=adapter)
                 self._indexes[index.name] = index
             index = self._indexes[name]
+            if self._is_stale(index):
+                # Rebuilt by another process, pick up the new structure
+                index.invalidate()
+                index = self._indexes[name]
         if chain:
             out = chain.execute(name=name, index=index, **kwargs)
             index = out.get('index', index)    
@@ -163,9 +256,168 @@ class IndexingModule(sellmo.Module):
         if indexes is None:
             indexes = {
                 name: self.get_index(name=name)
-                for name in six.iterkeys(self._registry)
+                for name in six.iterkeys(self._index_registry)
             }
         if chain:
             out = chain.execute(indexes=indexes, **kwargs)
             indexes = out.get('indexes', indexes)
-        return indexes
\ No newline at end of file
+        return indexes
+        
+    @cached_chain(
+        key=lambda name, query, facets=None, **kwargs: (
+            (name, query.get_filter_key(), query.facets.items())
+            if facets is None and not kwargs else None),
+        invalidate=[index_updated])
+    def get_facets(self, chain, name, query, facets=None, **kwargs):
+        """
+        Counts documents for each facet of the given search query.
+        Results are cached by the canonical form of the query until
+        the index is updated.
+        """
+        if facets is None:
+            facets = self.get_index(name=name).facet(query)
+        if chain:
+            out = chain.execute(name=name, query=query, facets=facets,
+                                **kwargs)
+            facets = out.get('facets', facets)
+        return facets
+        
+    def get_document_pks(self, documents):
+        """
+        Converts a queryset, model instances or pks to a set of pks.
+        """
+        if isinstance(documents, QuerySet):
+            return set(documents.values_list('pk', flat=True))
+        return set(document.pk if isinstance(document, models.Model)
+                   else document for document in documents)
+        
+    def update_documents(self, name, documents, chunk_size=None):
+        """
+        Updates the given document pks in the given index, in chunks.
+        """
+        if chunk_size is None:
+            chunk_size = self.update_chunk_size
+        index = self.get_index(name=name)
+        documents = sorted(documents)
+        for i in six.moves.range(0, len(documents), chunk_size):
+            index.update(index.model.objects.filter(
+                pk__in=documents[i:i + chunk_size]))
+        
+    @chainable()
+    def queue_update(self, chain, name, documents, **kwargs):
+        """
+        Requests the given documents (a queryset, model instances or pks)
+        to be updated in the given index. While deferring, documents are
+        collected and written at once when deferring ends.
+        """
+        documents = self.get_document_pks(documents)
+        if chain:
+            out = chain.execute(name=name, documents=documents, **kwargs)
+            documents = out.get('documents', documents)
+        if documents:
+            work = self.get_deferred_work()
+            if work is not None:
+                work.updates.setdefault(name, set()).update(documents)
+            else:
+                self.write_updates(name=name, documents=documents)
+        return documents
+        
+    def write_updates(self, name, documents):
+        """
+        Writes the requested updates for the given document pks.
+        Documents are updated right away, sellmo.contrib.indexing
+        queues them instead. Index failures never propagate, documents
+        which could not be written are left for updateindexes.
+        """
+        try:
+            self.update_documents(name=name, documents=documents)
+        except IndexMissingException:
+            self._report_failure(
+                name, logging.WARNING, "Index '%s' is missing, documents "
+                "are not updated until it is built." % name)
+        except IndexBackendException as ex:
+            self._report_failure(
+                name, logging.ERROR, "Index '%s' could not be updated, "
+                "run updateindexes once the backend is available: %s"
+                % (name, ex))
+        else:
+            self._failing.discard(name)
+                           
+    def queue_invalidation(self, name):
+        """
+        Requests the given index to be invalidated, for instance because
+        the fields it declares changed. While deferring, the index is
+        invalidated only once when deferring ends.
+        """
+        work = self.get_deferred_work()
+        if work is not None:
+            work.invalidations.add(name)
+        else:
+            self.write_invalidation(name)
+            
+    def write_invalidation(self, name):
+        try:
+            self.get_index(name=name).invalidate()
+        except IndexMissingException:
+            # Nothing to invalidate, index will be built as declared
+            pass
+        except IndexBackendException as ex:
+            self._report_failure(
+                name, logging.ERROR, "Index '%s' could not be "
+                "invalidated: %s" % (name, ex))
+            
+    def _report_failure(self, name, level, message):
+        # Logged once, until writing to the index succeeds again
+        if name not in self._failing:
+            self._failing.add(name)
+            logger.log(level, message)
+        
+    def get_deferred_work(self):
+        """
+        Returns the index work collected so far, or None when not
+        deferring.
+        """
+        return getattr(self._deferred, 'work', None)
+        
+    @contextmanager
+    def defer_updates(self):
+        """
+        Defers all index work requested within the block, for instance
+        during a bulk edit. Documents updated multiple times are updated
+        once and indexes are invalidated once, when the outermost block
+        ends. Should a block fail, the work requested within it is
+        discarded, as its changes might have been rolled back.
+        """
+        work = self.get_deferred_work()
+        if work is not None:
+            # Nested, work is done by the outermost block
+            previous = work.copy()
+            try:
+                yield work
+            except:
+                work.restore(previous)
+                raise
+            return
+        work = self._deferred.work = DeferredIndexWork()
+        try:
+            yield work
+        finally:
+            self._deferred.work = None
+        self.flush_deferred_work(work)
+            
+    def flush_deferred_work(self, work):
+        # Invalidate first, updates are written to the new structure.
+        # Changes were committed by now, so failures are only logged.
+        for name in sorted(work.invalidations):
+            try:
+                self.write_invalidation(name)
+            except (IndexExceptionBase, DatabaseError):
+                logger.exception("Index '%s' could not be invalidated."
+                                 % name)
+        for name, documents in sorted(six.iteritems(work.updates)):
+            try:
+                self.write_updates(name=name, documents=documents)
+            except (IndexExceptionBase, DatabaseError):
+                logger.exception("Index '%s' could not be updated, %s "
+                                 "documents were not written."
+                                 % (name, len(documents)))
@@ -30,7 +30,7 @@
 
 import logging
 import types
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 
 from django.db import models
 from django.utils.translation import ugettext_lazy as _, string_concat
@@ -40,6 +40,7 @@ from sellmo import modules
 from sellmo.api.decorators import view, chainable, link
 from sellmo.api.configuration import define_setting, define_import
 from sellmo.api.pricing import Currency, Price, PriceType, StampableProperty
+from sellmo.api.pricing.memo import PriceMemo
 
 
 def get_default_currency():
@@ -81,6 +82,9 @@ class PricingModule(sellmo.Module):
         default=2
     )
 
+    #: Remembers product prices for the duration of a request
+    price_memo = PriceMemo()
+
     def __init__(self, *args, **kwargs):
         # Configure
         if not self.currencies:
@@ -143,8 +147,8 @@ class PricingModule(sellmo.Module):
                     verbose_name = prop[1]
                 prop = prop[0]
 
-            #
-            attr_dict[prop] = StampableProperty(prop)
+            # Fields making up the stamped price
+            fields = []
 
             # Construct price currency field
             fargs = {}
@@ -156,6 +160,7 @@ class PricingModule(sellmo.Module):
 
             field = '{0}_currency'.format(prop) 
             attr_dict[field] = self.construct_currency_field(**fargs)
+            fields.append(field)
 
             # Construct price type fields
             # (including the standard amount field)
@@ -173,12 +178,16 @@ class PricingModule(sellmo.Module):
                         fargs['verbose_name'] = key.name
                 
                 attr_dict[field] = self.construct_pricing_field(**fargs)
+                fields.append(field)
                 
                 extra_fields = getattr(key, 'extra_fields', {})
                 for extra_field_name, extra_field in extra_fields.iteritems():
                     name = '{0}_{1}'.format(field, extra_field_name)
                     attr_dict[name] = extra_field[0](
                         *extra_field[1], **extra_field[2])
+                    fields.append(name)
+
+            attr_dict[prop] = StampableProperty(prop, fields=fields)
 
         out = type(name, (model,), attr_dict)
         return out
@@ -198,8 +207,32 @@ class PricingModule(sellmo.Module):
             price = out.get('price', price)
         return price
 
+    def retrieve_many(self, stampables, prop):
+        """
+        Retrieves the given price property for all stampables at once
+        and remembers it on each of them. Links taking part in
+        `retrieve` which provide a batched variant get to prefetch
+        their relations for all stampables. Returns a list of prices.
+        """
+        stampables = list(stampables)
+        if not stampables:
+            return []
+
+        descriptor = getattr(stampables[0].__class__, prop)
+        missing = [stampable for stampable in stampables
+                   if not descriptor.is_remembered(stampable)]
+        if missing:
+            prices = self.retrieve.many([
+                {'stampable': stampable, 'prop': prop}
+                for stampable in missing])
+            for stampable, price in zip(missing, prices):
+                descriptor.remember(stampable, price)
+        return [getattr(stampable, prop) for stampable in stampables]
+
     @chainable()
     def stamp(self, chain, stampable, prop, price, **kwargs):
+        # Prices are about to be stored, don't rely on remembered ones
+        self.price_memo.clear()
         setattr(stampable, '{0}_amount'.format(prop), price.amount)
         setattr(stampable, '{0}_currency'.format(prop), price.currency.code)
         for key in self.types:
@@ -222,7 +255,7 @@ class PricingModule(sellmo.Module):
                 currency = out['currency']
         return currency
 
-    @chainable()
+    @chainable(cache=price_memo)
     def get_price(self, chain, currency=None, price=None, index=None,
                   **kwargs):
         if currency is None:
@@ -237,18 +270,80 @@ class PricingModule(sellmo.Module):
 
         return price
 
-    @link(namespace='product', name='list')
-    def list_products(self, products, query=None, currency=None, index=None,
-                      index_relation='product', **kwargs):
+    @chainable()
+    def get_prices(self, chain, products, qty=1, currency=None, prices=None,
+                   **kwargs):
+        """
+        Resolves the price for each of the given products at once and
+        returns a mapping of product pk to price. Links taking part in
+        `get_price` which provide a batched variant get to prefetch
+        for all products, so the amount of queries does not grow with
+        the amount of products. Pass already downcasted products (for
+        instance from a polymorphic queryset) to avoid a downcast per
+        product.
+        """
         if currency is None:
             currency = self.get_currency()
-        
-        if query is not None and index is not None:
-            # See if we need to sort on price
-            if ('sort', 'price') in query:
-                pass
-            elif ('sort', '-price') in query:
-                pass
+
+        if prices is None:
+            products = list(products)
+            items = [
+                dict(product=product, qty=qty, currency=currency, **kwargs)
+                for product in products
+            ]
+            prices = dict(zip([product.pk for product in products],
+                              self.get_price.many(items)))
+        if chain:
+            out = chain.execute(products=products, qty=qty, currency=currency,
+                                prices=prices, **kwargs)
+            if out.has_key('prices'):
+                prices = out['prices']
+
+        return prices
+
+    @link(namespace='product', name='list')
+    def list_products(self, request, products, query=None, currency=None,
+                      **kwargs):
+        # Prices are only available from a price index
+        index = getattr(products, 'index', None)
+        if (query is None or
+                'price' not in getattr(index, 'price_prefixes', [])):
+            return
+
+        if currency is None:
+            currency = self.get_currency(request=request)
+        field_name = index.get_price_field_name('price', currency.code)
+        if field_name not in index.fields:
+            return
+
+        # Filter on price range
+        filters = {}
+        for lookup, strictest in [('gte', max), ('lte', min)]:
+            param = 'price__{0}'.format(lookup)
+            # Empty values are dropped, leaving an empty set
+            values = query.get_param(param)
+            if not values:
+                continue
+            try:
+                amount = strictest(Decimal(value) for value in values)
+            except InvalidOperation:
+                continue
+            if amount.is_finite():
+                filters['{0}__{1}'.format(field_name, lookup)] = amount
+
+        # See if we need to sort on price
+        order_by = []
+        if ('sort', 'price') in query:
+            order_by = [field_name]
+        elif ('sort', '-price') in query:
+            order_by = ['-' + field_name]
+
+        if filters or order_by:
+            # Use the variety of the current pricing context, for
+            # instance the quantity or customer group given to the chain
+            variety = index.get_variety(**kwargs)
+            products = index.join(products, filters=filters,
+                                  order_by=order_by, **variety)
         return {
             'products': products
         }
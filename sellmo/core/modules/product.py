@@ -29,6 +29,7 @@
 
 
 from django.http import Http404
+from django.db.models.signals import post_save
 
 import sellmo
 from sellmo import modules
@@ -70,6 +71,14 @@ class ProductModule(sellmo.Module):
     
     ProductIndex = ProductIndex
 
+    def __init__(self):
+        post_save.connect(self.on_product_post_save)
+
+    def on_product_post_save(self, sender, instance, raw=False, **kwargs):
+        # Keep the product index up to date, senders can be any subtype
+        if not raw and isinstance(instance, self.Product):
+            modules.indexing.queue_update(name='product', documents=[instance])
+
     @classmethod
     def register_subtype(self, subtype):
         self.subtypes.append(subtype)
@@ -113,7 +122,8 @@ class ProductModule(sellmo.Module):
             
         if product is None:
             try:
-                product = self.single(request=request).polymorphic() \
+                product = self.single(request=request) \
+                              .polymorphic(strategy='join') \
                               .get(slug=product_slug)
             except self.Product.DoesNotExist:
                 raise Http404("Product '{0}' not found.".format(product_slug))
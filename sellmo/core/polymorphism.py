@@ -28,16 +28,265 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+import inspect
+import itertools
+
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
-from django.db.models.query import QuerySet
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.query import QuerySet, prefetch_related_objects
+from django.db.models.signals import post_save, post_delete
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.admin.util import quote
 from django.utils.functional import allow_lazy
 
 
+from sellmo.api.configuration import define_setting
+from sellmo.core.local import get_context, has_context
 from sellmo.core.query import PKIterator
 
 
+# Django 2.0 and up accept a chunk size, and stream
+# using a server-side cursor where supported
+_chunked_iterator = 'chunk_size' in inspect.getargspec(QuerySet.iterator).args
+
+# Caches the subtype paths for each polymorphic model
+_subtype_paths = {}
+
+
+def _chunks(iterable, size):
+    iterable = iter(iterable)
+    return iter(lambda: list(itertools.islice(iterable, size)), [])
+
+
+def get_subtype_paths(model):
+    """
+    Returns a mapping of each multi-table subtype of the given model to
+    the reverse one-to-one relations leading to it, as a list of
+    (accessor name, cache name) tuples.
+    """
+    if model not in _subtype_paths:
+        paths = {}
+        def collect(parent, path):
+            for related in parent._meta.get_all_related_objects():
+                field = related.field
+                if (isinstance(field, models.OneToOneField) and
+                        field.rel.parent_link and
+                        issubclass(related.model, parent)):
+                    subpath = path + [(related.get_accessor_name(),
+                                       related.get_cache_name())]
+                    paths[related.model] = subpath
+                    collect(related.model, subpath)
+        collect(model, [])
+        _subtype_paths[model] = paths
+    return _subtype_paths[model]
+
+
+class IdentityMap(object):
+
+    """
+    Remembers downcasted objects by content type and pk for the duration
+    of a request, so repeated downcasts of the same object reuse it.
+    Objects are forgotten once saved or deleted elsewhere. Enabled
+    through SELLMO_POLYMORPHIC_IDENTITY_MAP.
+    """
+
+    enabled = define_setting(
+        'POLYMORPHIC_IDENTITY_MAP',
+        default=False)
+
+    def _get_objects(self):
+        if self.enabled and has_context():
+            return get_context().setdefault('polymorphic_identity_map', {})
+        return None
+
+    def get(self, content_type_id, pk):
+        objects = self._get_objects()
+        if objects is not None:
+            return objects.get((content_type_id, pk), None)
+        return None
+
+    def add(self, content_type_id, obj):
+        objects = self._get_objects()
+        if objects is not None:
+            objects[(content_type_id, obj.pk)] = obj
+
+    def on_change(self, sender, instance, signal, **kwargs):
+        if isinstance(instance, PolymorphicModel):
+            objects = self._get_objects()
+            if not objects:
+                return
+            key = (instance.content_type_id, instance.pk)
+            if (signal is post_delete or
+                    objects.get(key, instance) is not instance):
+                # Deleted, or another copy of this object changed
+                objects.pop(key, None)
+
+
+identity_map = IdentityMap()
+
+
+def downcast_many(instances):
+    """
+    Downcasts the given instances at once, using a query per content
+    type instead of a query per instance. Returns the downcasted
+    instances in order.
+    """
+    instances = list(instances)
+    lookups = {}
+    for instance in instances:
+        if (instance is None or instance._downcasted is not None or
+                instance.content_type_id is None):
+            continue
+        downcasted = identity_map.get(instance.content_type_id, instance.pk)
+        if downcasted is not None:
+            instance._set_downcasted(downcasted)
+        else:
+            lookups.setdefault(instance.content_type_id, []).append(instance)
+
+    for content_type_id, group in lookups.iteritems():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        pending = []
+        for instance in group:
+            if instance.__class__ is model:
+                # Already of the actual type
+                instance._set_downcasted(instance)
+            else:
+                pending.append(instance)
+        group = pending
+        if not group:
+            continue
+        downcasts = {
+            obj.pk: obj
+            for obj in PKIterator(model, set(
+                instance.pk for instance in group))
+        }
+        for instance in group:
+            if instance.pk not in downcasts:
+                raise Exception(
+                    "Could not downcast to model class '{0}', "
+                    "lookup failed for pk '{1}'"
+                    .format(model, instance.pk))
+            downcasted = downcasts[instance.pk]
+            identity_map.add(content_type_id, downcasted)
+            instance._set_downcasted(downcasted)
+
+    return [instance.downcast() if instance is not None else None
+            for instance in instances]
+
+
+def prefetch_polymorphic(instances, *lookups):
+    """
+    Prefetches the given relations for all instances at once. Related
+    polymorphic objects are downcasted using a query per content type,
+    instead of a query for each access. Lookups can span relations, for
+    instance 'purchases__product__variants', each step is prefetched for
+    all (downcasted) objects of the previous step.
+    """
+    instances = [instance for instance in instances if instance is not None]
+    prefetched = {}
+    for lookup in lookups:
+        objs = instances
+        path = []
+        for name in lookup.split(LOOKUP_SEP):
+            path.append(name)
+            key = LOOKUP_SEP.join(path)
+            if key not in prefetched:
+                prefetched[key] = _prefetch_relation(objs, name)
+            objs = prefetched[key]
+
+
+def _prefetch_relation(objs, name):
+    # Objects may be of different (downcasted) types
+    groups = {}
+    for obj in objs:
+        groups.setdefault(obj.__class__, []).append(obj)
+
+    related = []
+    found = not groups
+    for cls, group in groups.iteritems():
+        try:
+            field = cls._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = None
+        if (isinstance(field, models.ForeignKey) and
+                field.rel.get_related_field().primary_key):
+            related.extend(_prefetch_forward(group, field))
+        elif hasattr(cls, name):
+            related.extend(_prefetch_other(group, name))
+        else:
+            # Relation only exists on some of the types
+            continue
+        found = True
+
+    if not found:
+        raise AttributeError(
+            "Cannot find '{0}' on any of the prefetched objects"
+            .format(name))
+    return related
+
+
+def _prefetch_forward(group, field):
+    model = field.rel.to
+    cache_name = field.get_cache_name()
+
+    related = {}
+    pending = set()
+    for obj in group:
+        pk = getattr(obj, field.attname)
+        if pk is None:
+            continue
+        cached = getattr(obj, cache_name, None)
+        if cached is not None:
+            related[pk] = cached
+        else:
+            pending.add(pk)
+    if pending:
+        for obj in PKIterator(model._default_manager.all(), pending):
+            related[obj.pk] = obj
+
+    if issubclass(model, PolymorphicModel):
+        downcast_many(related.itervalues())
+
+    for obj in group:
+        pk = getattr(obj, field.attname)
+        if pk in related:
+            setattr(obj, cache_name, related[pk])
+            base = getattr(obj, '_downcasted_from', None)
+            if isinstance(base, field.model):
+                # Also available when accessed through the base object
+                setattr(base, cache_name, related[pk])
+
+    return _downcasted(related.itervalues())
+
+
+def _prefetch_other(group, name):
+    # Reverse and many to many relations are prefetched by Django
+    prefetch_related_objects(group, [name])
+    related = []
+    for obj in group:
+        try:
+            value = getattr(obj, name)
+        except ObjectDoesNotExist:
+            continue
+        if isinstance(value, models.Manager):
+            related.extend(value.all())
+        elif value is not None:
+            related.append(value)
+
+    polymorphic = [obj for obj in related
+                   if isinstance(obj, PolymorphicModel)]
+    if polymorphic:
+        downcast_many(polymorphic)
+    return _downcasted(related)
+
+
+def _downcasted(objs):
+    return [obj.downcast() if isinstance(obj, PolymorphicModel) else obj
+            for obj in objs]
+
+
 def _polymorphic_descriptor(descriptor):
     class PolymorphicDescriptor(descriptor):
         def __get__(self, instance, instance_type=None):
@@ -69,9 +318,46 @@ class PolymorphicOneToOneField(PolymorphicRelation, models.OneToOneField):
     pass
 
 
-class PolymorphicQuerySet(QuerySet):
+class PolymorphicPrefetchMixin(object):
+
+    """
+    Adds prefetch_polymorphic to a QuerySet.
+    """
+
+    _polymorphic_lookups = ()
+    _polymorphic_prefetch_done = False
+
+    def prefetch_polymorphic(self, *lookups):
+        """
+        Prefetches and downcasts the given relations for all resulting
+        objects once evaluated, see prefetch_polymorphic. Pass None to
+        clear the lookups.
+        """
+        clone = self._clone()
+        if lookups == (None,):
+            clone._polymorphic_lookups = ()
+        else:
+            clone._polymorphic_lookups = self._polymorphic_lookups + lookups
+        return clone
+
+    def _fetch_all(self):
+        super(PolymorphicPrefetchMixin, self)._fetch_all()
+        if (self._polymorphic_lookups and
+                not self._polymorphic_prefetch_done):
+            prefetch_polymorphic(self._result_cache,
+                                 *self._polymorphic_lookups)
+            self._polymorphic_prefetch_done = True
+
+    def _clone(self, *args, **kwargs):
+        clone = super(PolymorphicPrefetchMixin, self)._clone(*args, **kwargs)
+        clone._polymorphic_lookups = self._polymorphic_lookups
+        return clone
+
+
+class PolymorphicQuerySet(PolymorphicPrefetchMixin, QuerySet):
 
     _downcast = False
+    _downcast_strategy = 'query'
     _can_downcast = True
 
     def __init__(self, *args, **kwargs):
@@ -98,79 +384,210 @@ class PolymorphicQuerySet(QuerySet):
                 clone._can_downcast = False
         return clone
     
-    def iterator(self):
+    def iterator(self, chunk_size=None):
+        """
+        When downcasting, base rows are downcasted using a query per
+        content type. Pass `chunk_size` to stream; rows are then
+        fetched and downcasted one chunk at a time, so memory use does
+        not grow with the amount of rows. Order is kept either way.
+        """
         if not self._downcast:
             return super(PolymorphicQuerySet, self).iterator()
+        elif chunk_size is None:
+            return self._downcast_bases(
+                super(PolymorphicQuerySet, self).iterator())
         else:
+            return self._iter_downcasted(chunk_size)
             
-            # Keep ordering and filter out all content types
-            # Afterwards perform seperate queries for each content_type
-            
-            # PK mapping for used content_types
-            content_types = {}
+    def _iter_downcasted(self, chunk_size):
+        if _chunked_iterator:
+            # Lets Django use a server-side cursor where supported
+            bases = super(PolymorphicQuerySet, self).iterator(
+                chunk_size=chunk_size)
+            chunks = _chunks(bases, chunk_size)
+        else:
+            # Older Django versions read the whole result set into
+            # memory, query one chunk at a time instead
+            chunks = self._iter_chunks(chunk_size)
+        for chunk in chunks:
+            for obj in self._downcast_bases(chunk):
+                yield obj
+
+    def _iter_chunks(self, chunk_size):
+        query = self.query
+        ordering = list(query.order_by or query.extra_order_by or (
+            self.model._meta.ordering if query.default_ordering else []))
+        if (query.low_mark or query.high_mark is not None or
+                any(not isinstance(field, basestring) or field == '?'
+                    for field in ordering)):
+            # Sliced or randomly ordered, the rows can't be walked in
+            # separate queries so these are fetched as is
+            bases = super(PolymorphicQuerySet, self).iterator()
+            for chunk in _chunks(bases, chunk_size):
+                yield chunk
+            return
+
+        pk = self.model._meta.pk
+        keys = ('pk', pk.name, pk.attname)
+        if not ordering or (len(ordering) == 1 and
+                            ordering[0].lstrip('-') in keys):
+            # Ordered by pk, continue after the last pk of each chunk
+            descending = bool(ordering) and ordering[0].startswith('-')
+            qs = self.order_by('-pk' if descending else 'pk')
+            lookup = 'pk__lt' if descending else 'pk__gt'
+            last = None
+            while True:
+                window = qs if last is None else qs.filter(**{lookup: last})
+                window = window[:chunk_size]
+                chunk = list(super(PolymorphicQuerySet, window).iterator())
+                if chunk:
+                    yield chunk
+                if len(chunk) < chunk_size:
+                    break
+                last = chunk[-1].pk
+        else:
+            # Ordered by other fields, step through with offsets. The pk
+            # breaks ties so rows don't move between chunks.
+            qs = self.order_by(*(ordering + ['pk']))
+            offset = 0
+            while True:
+                window = qs[offset:offset + chunk_size]
+                chunk = list(super(PolymorphicQuerySet, window).iterator())
+                if chunk:
+                    yield chunk
+                if len(chunk) < chunk_size:
+                    break
+                offset += chunk_size
+    
+    def _downcast_bases(self, objs):
+        # Keep ordering and filter out all content types
+        # Afterwards perform seperate queries for each content_type
+        
+        # PK mapping for used content_types
+        content_types = {}
+        
+        # Contains mapping of content type to list of matching pks
+        lookups = {}
+        
+        order = []
+        bases = {}
+        downcasts = {}
+        
+        # Iterate the original query against ourselves so that we 
+        # receive correct ordering and we can resolve only the 
+        # content types needed for downcasting
+        for obj in objs:
+            if not content_types.has_key(obj.content_type.pk):
+                # New content type found
+                content_types[obj.content_type.pk] = obj.content_type
+                lookups[obj.content_type] = []
             
-            # Contains mapping of content type to list of matching pks
-            lookups = {}
+            lookups[obj.content_type].append(obj.pk)
             
-            order = []
-            bases = {}
-            downcasts = {}
+            # Keep track of base objects so we can later
+            # assign them to the downcasted objects.
+            bases[obj.pk] = obj
+            # Retain order
+            order.append(obj.pk)
+
+        if self._downcast_strategy == 'join' and all(
+                name == 'using' for name, args, kwargs
+                in self._defered_calls):
+            # Subtypes were joined, only query for those which
+            # could not be resolved from the joined rows
+            self._downcast_joined(bases, lookups, downcasts)
+
+        # For each content type perform the actual query
+        for content_type, lookups in lookups.iteritems():
+            model = content_type.model_class()
+            qs = model.objects.all()
+            # At this point apply defered query calls
+            qs = self.__apply_defered_calls__(qs)
+            # Now query using a PKIterator to safely handle
+            # large IN clauses. Also transform lookups into
+            # a set, so we don't query redundant pk's. 
+            for obj in PKIterator(qs, set(lookups)):
+                base = bases[obj.pk]
+                base._downcasted = obj
+                obj.content_type = content_type
+                obj._downcasted_from = base
+                downcasts[obj.pk] = obj
+
+        out = []
+        for pk in order:
+            out.append(downcasts[pk])
+        
+        return out
+
+    def _downcast_joined(self, bases, lookups, downcasts):
+        paths = get_subtype_paths(self.model)
+        for content_type, pks in list(lookups.iteritems()):
+            model = content_type.model_class()
+            if model is self.model:
+                path = []
+            elif model in paths:
+                path = paths[model]
+            else:
+                continue
             
-            # Perform original query against ourselves so that we 
-            # receive correct ordering and we can resolve only the 
-            # content types needed for downcasting
-            for obj in super(PolymorphicQuerySet, self).iterator():
-                if not content_types.has_key(obj.content_type.pk):
-                    # New content type found
-                    content_types[obj.content_type.pk] = obj.content_type
-                    lookups[obj.content_type] = []
-                
-                lookups[obj.content_type].append(obj.pk)
-                
-                # Keep track of base objects so we can later
-                # assign them to the downcasted objects.
-                bases[obj.pk] = obj
-                # Retain order
-                order.append(obj.pk)
-
-            # For each content type perform the actual query
-            for content_type, lookups in lookups.iteritems():
-                model = content_type.model_class()
-                qs = model.objects.all()
-                # At this point apply defered query calls
-                qs = self.__apply_defered_calls__(qs)
-                # Now query using a PKIterator to safely handle
-                # large IN clauses. Also transform lookups into
-                # a set, so we don't query redundant pk's. 
-                for obj in PKIterator(qs, set(lookups)):
-                    base = bases[obj.pk]
+            remaining = []
+            for pk in pks:
+                obj = bases[pk]
+                for accessor, cache_name in path:
+                    # Only follow relations cached by the join
+                    obj = getattr(obj, cache_name, None)
+                    if obj is None:
+                        break
+                if obj is None:
+                    remaining.append(pk)
+                    continue
+                base = bases[pk]
+                if obj is not base:
                     base._downcasted = obj
                     obj.content_type = content_type
                     obj._downcasted_from = base
-                    downcasts[obj.pk] = obj
-
-            out = []
-            for pk in order:
-                out.append(downcasts[pk])
-            
-            return out
+                downcasts[pk] = obj
+                
+            if remaining:
+                lookups[content_type] = remaining
+            else:
+                del lookups[content_type]
 
     def _clone(self, *args, **kwargs):
         clone = super(PolymorphicQuerySet, self)._clone(*args, **kwargs)
         clone._downcast = self._downcast
+        clone._downcast_strategy = self._downcast_strategy
         clone._can_downcast = self._can_downcast
         clone._defered_calls = list(self._defered_calls)
         return clone
 
-    def polymorphic(self):
+    def polymorphic(self, strategy='query'):
+        """
+        Downcasts the resulting objects to their actual type. By default
+        an additional query is performed for each content type in the
+        result. With the 'join' strategy all subtypes are joined in the
+        original query instead, which downcasts in a single query. Calls
+        to select_related, only, defer and annotate made after the
+        polymorphic call apply to subtypes, when made these are queried
+        instead of joined.
+        """
         if not self._can_downcast:
             raise Exception("Too late to downcast this queryset")
+        if strategy not in ('query', 'join'):
+            raise ValueError(strategy)
             
         clone = self._clone()
         if not self._downcast:
             clone = super(PolymorphicQuerySet, clone) \
                         .select_related('content_type')
             clone._downcast = True
+        if strategy == 'join' and clone._downcast_strategy != 'join':
+            paths = get_subtype_paths(self.model)
+            if paths:
+                clone = super(PolymorphicQuerySet, clone).select_related(*[
+                    '__'.join(accessor for accessor, cache_name in path)
+                    for path in paths.itervalues()])
+        clone._downcast_strategy = strategy
         return clone
     
     def select_related(self, *args, **kwargs):
@@ -212,6 +629,9 @@ class PolymorphicManager(models.Manager):
     def polymorphic(self, *args, **kwargs):
         return self.get_queryset().polymorphic(*args, **kwargs)
 
+    def prefetch_polymorphic(self, *args, **kwargs):
+        return self.get_queryset().prefetch_polymorphic(*args, **kwargs)
+
 
 class PolymorphicModel(models.Model):
 
@@ -240,8 +660,12 @@ class PolymorphicModel(models.Model):
         if not self._downcasted:
             downcasted = self
             if not self.content_type_id is None:
-                model = self.content_type.model_class()
+                model = ContentType.objects.get_for_id(
+                    self.content_type_id).model_class()
                 if model is not self.__class__:
+                    downcasted = identity_map.get(
+                        self.content_type_id, self.pk)
+                if downcasted is None:
                     try:
                         downcasted = model.objects.get(pk=self.pk)
                     except model.DoesNotExist:
@@ -249,10 +673,14 @@ class PolymorphicModel(models.Model):
                             "Could not downcast to model class '{0}', "
                             "lookup failed for pk '{1}'"
                             .format(model, self.pk))
-            self._downcasted = downcasted
-            self._downcasted._downcasted_from = self
+                    identity_map.add(self.content_type_id, downcasted)
+            self._set_downcasted(downcasted)
         return self._downcasted
 
+    def _set_downcasted(self, downcasted):
+        self._downcasted = downcasted
+        self._downcasted._downcasted_from = self
+
     def can_downcast(self):
         if not self.content_type_id is None:
             model = self.content_type.model_class()
@@ -274,3 +702,7 @@ class PolymorphicModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+post_save.connect(identity_map.on_change)
+post_delete.connect(identity_map.on_change)
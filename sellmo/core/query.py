@@ -28,43 +28,162 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+import uuid
+
+from django.db import connections, models
 from django.db.models.query import QuerySet
 
+from sellmo.api.configuration import define_setting
+
 
 class PKIterator(object):
 
     """
-    Queries a set of pks against the given model. Seperate 
-    queries are used if the length of 'pks' exceeds 'step'.
-    This in order to limit the length of the sql IN clause.
-    Order of pks is kept. If pk is not found, it will be 
-    ignored.
+    Queries a set of pks against the given model. Order of pks is
+    kept. If pk is not found, it will be ignored. The way pks are
+    queried depends on the backend and the amount of pks:
+
+    - 'in', separate queries with an IN clause of at most 'step' pks,
+      by default as many as the backend allows.
+    - 'array', on PostgreSQL, pks are passed as a single array
+      parameter, 'array_step' pks at a time.
+    - 'temp_table', for at least 'temp_table_threshold' pks, these are
+      written to a temporary table which is joined in a single query.
+
+    Results are kept, unless 'stream' is given. Results are then
+    yielded as they come in, memory use does not grow with the
+    amount of pks.
     """
 
     _result_cache = None
     _queryset = None
 
-    def __init__(self, model_or_queryset, pks, step=250):
+    #: Amount of pks from which a temporary table is joined
+    temp_table_threshold = define_setting(
+        'PK_ITERATOR_TEMP_TABLE_THRESHOLD',
+        default=10000)
+
+    #: Amount of pks passed at once as an array
+    array_step = 10000
+
+    def __init__(self, model_or_queryset, pks, step=None, stream=False):
         if not isinstance(model_or_queryset, QuerySet):
             # Must be a Model then
             model_or_queryset = model_or_queryset.objects.all()
         self._queryset = model_or_queryset
         self._pks = list(pks)
         self._step = step
+        self._stream = stream
+
+    def get_connection(self):
+        return connections[self._queryset.db]
+
+    def get_strategy(self):
+        connection = self.get_connection()
+        if self._step is None:
+            if connection.vendor == 'postgresql':
+                return 'array'
+            elif len(self._pks) >= self.temp_table_threshold:
+                return 'temp_table'
+        return 'in'
+
+    def get_step(self):
+        if self._step is not None:
+            return self._step
+        connection = self.get_connection()
+        step = connection.ops.max_in_list_size()
+        if step is None:
+            if connection.features.supports_1000_query_parameters:
+                step = 1000
+            else:
+                # SQLite allows 999 parameters per query, leave
+                # room for the parameters of the queryset itself.
+                step = 900
+        return step
 
     def __iter__(self):
+        if self._stream:
+            return self._iter_results()
         if self._result_cache is None:
-            self._result_cache = {}
-            for i in xrange(0, len(self._pks), self._step):
-                sliced = self._pks[i:i+self._step]
-                for obj in self._queryset.filter(pk__in=sliced):
-                    self._result_cache[obj.pk] = obj
+            self._result_cache = {
+                obj.pk: obj for obj in self._iter_results()}
+        return self._iter_cached()
+
+    def _iter_cached(self):
         for pk in self._pks:
             obj = self._result_cache.get(pk, None)
             if obj is not None:
                 yield obj
 
+    def _iter_results(self):
+        strategy = self.get_strategy()
+        if strategy == 'temp_table':
+            for obj in self._iter_temp_table():
+                yield obj
+            return
+
+        if strategy == 'array':
+            step = self.array_step
+        else:
+            step = self.get_step()
+        for i in xrange(0, len(self._pks), step):
+            sliced = self._pks[i:i + step]
+            if strategy == 'array':
+                queryset = self._filter_array(sliced)
+            else:
+                queryset = self._queryset.filter(pk__in=sliced)
+            objs = {obj.pk: obj for obj in queryset}
+            for pk in sliced:
+                obj = objs.get(pk, None)
+                if obj is not None:
+                    yield obj
+
+    def _filter_array(self, pks):
+        qn = self.get_connection().ops.quote_name
+        opts = self._queryset.model._meta
+        return self._queryset.extra(
+            where=['{0}.{1} = ANY(%s)'.format(
+                qn(opts.db_table), qn(opts.pk.column))],
+            params=[pks])
+
+    def _iter_temp_table(self):
+        connection = self.get_connection()
+        qn = connection.ops.quote_name
+        opts = self._queryset.model._meta
+        table = 'sellmo_pks_{0}'.format(uuid.uuid4().hex[:12])
+
+        if isinstance(opts.pk, models.AutoField):
+            db_type = models.IntegerField().db_type(connection)
+        else:
+            # Related pks get the type of the field they relate to
+            db_type = opts.pk.db_type(connection)
+
+        cursor = connection.cursor()
+        cursor.execute(
+            "CREATE TEMPORARY TABLE {0} (ordinal integer NOT NULL, "
+            "value {1} NOT NULL)".format(qn(table), db_type))
+        try:
+            cursor.executemany(
+                "INSERT INTO {0} (ordinal, value) VALUES (%s, %s)"
+                .format(qn(table)), list(enumerate(self._pks)))
+            # Rows come back in the order of pks
+            queryset = self._queryset.extra(
+                tables=[table],
+                where=['{0}.value = {1}.{2}'.format(
+                    qn(table), qn(opts.db_table), qn(opts.pk.column))],
+                order_by=['{0}.ordinal'.format(table)])
+            for obj in queryset.iterator():
+                yield obj
+        finally:
+            if connection.vendor == 'mysql':
+                # Avoids an implicit commit
+                drop = "DROP TEMPORARY TABLE {0}"
+            else:
+                drop = "DROP TABLE {0}"
+            connection.cursor().execute(drop.format(qn(table)))
+
     def __len__(self):
         if self._result_cache is None:
-            list(self.__iter__())
-        return len(self._result_cache)
\ No newline at end of file
+            self._result_cache = {
+                obj.pk: obj for obj in self._iter_results()}
+        return len(self._result_cache)
@@ -28,17 +28,14 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
-from optparse import make_option
+from sellmo import params
+from sellmo.management.indexing import IndexCommand
+params.building_indexes = True
 
-from django.core.management.base import BaseCommand, CommandError
-from django.utils import six
 
-from sellmo import modules, params
-params.building_indexes = True
+class Command(IndexCommand):
 
+    help = ("Builds (or rebuilds) the structure of each index and "
+            "indexes all documents.")
 
-class Command(BaseCommand):
-    
-    def handle(self, *args, **options):
-        for name, index in six.iteritems(modules.indexing.get_indexes()):
-            pass
\ No newline at end of file
+    checkpoint_name = 'buildindexes'
@@ -0,0 +1,69 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sellmo.core.instrumentation import profiler
+
+
+class Command(BaseCommand):
+
+    help = ("Dumps chain and link timings collected across processes "
+            "while SELLMO_CHAIN_PROFILING is enabled.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--limit',
+            dest='limit', type='int', default=None,
+            help='Only show the given amount of rows.'),
+        make_option('--sort',
+            dest='sort', default='time',
+            help='Sort on time, calls, queries or p95 (default: time).'),
+        make_option('--reset',
+            dest='reset', action='store_true', default=False,
+            help='Reset collected timings after dumping.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['sort'] not in ('time', 'calls', 'queries', 'p95'):
+            raise CommandError("Cannot sort on '{0}'".format(options['sort']))
+
+        stats = profiler.get_shared_stats()
+        if not stats:
+            self.stdout.write("No chain timings collected.")
+        else:
+            for kind in ('chains', 'links'):
+                self.stdout.write(stats.summary(
+                    kind, limit=options['limit'], sort=options['sort']))
+                self.stdout.write("")
+
+        if options['reset']:
+            profiler.reset()
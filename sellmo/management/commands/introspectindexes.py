@@ -0,0 +1,71 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sellmo import modules
+from sellmo.api.indexing.exceptions import IndexMissingException
+
+
+class Command(BaseCommand):
+
+    help = ("Introspects the structure of each index again, instead of "
+            "relying on a cached introspection.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--index',
+            dest='indexes', action='append', default=None,
+            help='Only introspect the given index. '
+                 'Use multiple times for multiple indexes.'),
+    )
+
+    def handle(self, *args, **options):
+        names = options['indexes']
+        if names is None:
+            names = sorted(modules.indexing.get_index_names())
+
+        for name in names:
+            try:
+                index = modules.indexing.get_index(name=name)
+            except KeyError:
+                raise CommandError("Index {0} does not exist".format(name))
+            except IndexMissingException:
+                self.stdout.write(
+                    "Index '{0}' is missing, run buildindexes.".format(name))
+                continue
+
+            index.adapter.reset_introspection(index)
+            index.invalidate()
+            index = modules.indexing.get_index(name=name)
+            self.stdout.write(
+                "Introspected index '{0}', {1} fields in use.".format(
+                    name, len(index.fields)))
@@ -0,0 +1,292 @@
+# Copyright (c) 2014, Adaptiv Design
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import json
+import time
+import multiprocessing
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from sellmo import modules
+from sellmo.api.indexing.exceptions import IndexMissingException
+from sellmo.core.local import new_context, release_context
+
+
+def close_connections():
+    for connection in connections.all():
+        connection.close()
+
+
+def init_worker():
+    # Forked workers must not share the parent's database connections,
+    # each of them opens it's own.
+    close_connections()
+
+
+def update_chunk(name, low, high):
+    """
+    Updates the documents within the given pk range, or backfills
+    them while the index is being rebuilt. Runs within a worker
+    process.
+    """
+    start = time.time()
+    new_context()
+    try:
+        index = modules.indexing.get_index(name=name)
+        documents = index.model.objects.filter(pk__gte=low, pk__lte=high)
+        if index.rebuilding:
+            index.backfill(documents)
+        else:
+            index.update(documents)
+    finally:
+        release_context()
+    return low, high, time.time() - start
+
+
+def update_chunk_star(args):
+    return update_chunk(*args)
+
+
+class Checkpoint(object):
+
+    """
+    Keeps track of the pk ranges which have been indexed into the given
+    structure, so that an interrupted run can be resumed.
+    """
+
+    def __init__(self, command, name, structure):
+        self.path = os.path.join(
+            modules.indexing.checkpoint_dir,
+            'sellmo-{0}-{1}.json'.format(command, name))
+        self.structure = structure
+        self.ranges = []
+
+    def load(self):
+        """
+        Loads the ranges indexed into the same structure, ranges
+        indexed elsewhere are discarded.
+        """
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+            if (isinstance(data, dict) and
+                    data.get('structure') == self.structure):
+                self.ranges = [tuple(value) for value in data['ranges']]
+            else:
+                self.clear()
+        return bool(self.ranges)
+
+    def add(self, low, high):
+        self.ranges.append((low, high))
+        with open(self.path, 'wb') as f:
+            json.dump({'structure': self.structure,
+                       'ranges': self.ranges}, f)
+
+    def get_range(self, pk):
+        """
+        Returns the indexed range containing the given pk, if any.
+        """
+        for low, high in self.ranges:
+            if low <= pk <= high:
+                return low, high
+        return None
+
+    def get_next_low(self, pk):
+        """
+        Returns the start of the first indexed range after the given pk.
+        """
+        lows = [low for low, high in self.ranges if low > pk]
+        return min(lows) if lows else None
+
+    def clear(self):
+        self.ranges = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class IndexCommand(BaseCommand):
+
+    """
+    Indexes all documents of each index. Documents are split up in pk
+    ranges which are indexed in parallel by a pool of worker processes.
+    """
+
+    option_list = BaseCommand.option_list + (
+        make_option('--index',
+            dest='indexes', action='append', default=None,
+            help='Only handle the given index. '
+                 'Use multiple times for multiple indexes.'),
+        make_option('--workers',
+            dest='workers', type='int', default=multiprocessing.cpu_count(),
+            help='Amount of worker processes (default: amount of CPUs).'),
+        make_option('--chunk-size',
+            dest='chunk_size', type='int', default=None,
+            help='Amount of documents per chunk.'),
+        make_option('--since',
+            dest='since', type='int', default=None,
+            help='Only handle documents from the given pk onwards.'),
+        make_option('--restart',
+            dest='restart', action='store_true', default=False,
+            help='Ignore the checkpoint of an interrupted run.'),
+    )
+
+    checkpoint_name = None
+
+    def get_indexes(self, names):
+        if names is None:
+            return modules.indexing.get_indexes()
+        return {name: modules.indexing.get_index(name=name)
+                for name in names}
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("Workers should be at least 1")
+        chunk_size = options['chunk_size']
+        if chunk_size is None:
+            chunk_size = modules.indexing.update_chunk_size
+        if chunk_size < 1:
+            raise CommandError("Chunk size should be at least 1")
+
+        try:
+            indexes = self.get_indexes(options['indexes'])
+        except KeyError as ex:
+            raise CommandError("Index {0} does not exist".format(ex))
+        except IndexMissingException:
+            raise CommandError("Index does not exist, run buildindexes.")
+
+        for name, index in sorted(indexes.iteritems()):
+            self.update(name, index, chunk_size=chunk_size,
+                        workers=options['workers'], since=options['since'],
+                        restart=options['restart'])
+
+    def get_chunks(self, index, chunk_size, since=None, checkpoint=None):
+        """
+        Steps through the pks in order, only querying the boundaries of
+        each chunk. Ranges found in the checkpoint are skipped as a
+        whole.
+        """
+        pks = index.get_queryset().order_by('pk') \
+                                  .values_list('pk', flat=True)
+        if since is not None:
+            pks = pks.filter(pk__gte=since)
+
+        chunks = []
+        last = None
+        while True:
+            remaining = pks if last is None else pks.filter(pk__gt=last)
+            try:
+                low = remaining[0]
+            except IndexError:
+                break
+
+            window = remaining
+            if checkpoint is not None:
+                indexed = checkpoint.get_range(low)
+                if indexed is not None:
+                    last = indexed[1]
+                    continue
+                # End this chunk before the next indexed range
+                next_low = checkpoint.get_next_low(low)
+                if next_low is not None:
+                    window = remaining.filter(pk__lt=next_low)
+
+            try:
+                high = window[chunk_size - 1]
+                size = chunk_size
+            except IndexError:
+                # Less than a chunk left (before an indexed range)
+                rest = list(window[:chunk_size])
+                high = rest[-1]
+                size = len(rest)
+            chunks.append((low, high, size))
+            last = high
+        return chunks
+
+    def update(self, name, index, chunk_size, workers, since=None,
+               restart=False):
+        checkpoint = Checkpoint(
+            self.checkpoint_name, name,
+            index.adapter.get_structure_name(index))
+        if restart or index.built:
+            # Nothing has been indexed into a structure just built
+            checkpoint.clear()
+        elif checkpoint.load():
+            self.stdout.write(
+                "Resuming index '{0}' from checkpoint.".format(name))
+
+        chunks = self.get_chunks(index, chunk_size, since=since,
+                                 checkpoint=checkpoint)
+        total = sum(size for low, high, size in chunks)
+        sizes = {(low, high): size for low, high, size in chunks}
+        tasks = [(name, low, high) for low, high, size in chunks]
+        self.stdout.write("Indexing {0} documents in {1} chunks for "
+                          "index '{2}'.".format(total, len(chunks), name))
+
+        if workers > 1 and len(tasks) > 1:
+            # Don't let workers inherit connections
+            close_connections()
+            pool = multiprocessing.Pool(
+                min(workers, len(tasks)), initializer=init_worker)
+            results = pool.imap_unordered(update_chunk_star, tasks)
+        else:
+            pool = None
+            results = (update_chunk(*task) for task in tasks)
+
+        start = time.time()
+        done = 0
+        try:
+            for low, high, duration in results:
+                checkpoint.add(low, high)
+                done += sizes[(low, high)]
+                elapsed = time.time() - start
+                rate = done / elapsed if elapsed else 0
+                eta = (total - done) / rate if rate else 0
+                self.stdout.write(
+                    "Index '{0}': {1}/{2} documents, {3:.1f} documents/s, "
+                    "ETA {4:.0f}s".format(name, done, total, rate, eta))
+        except KeyboardInterrupt:
+            if pool is not None:
+                pool.terminate()
+            raise CommandError("Interrupted, run again to resume.")
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        if index.rebuilding:
+            index.swap()
+            self.stdout.write(
+                "Swapped in the rebuilt index '{0}'.".format(name))
+
+        checkpoint.clear()
+        self.stdout.write("Index '{0}' done in {1:.1f}s.".format(
+            name, time.time() - start))
@@ -60,7 +60,12 @@ class PriceTag(Tag):
     )
 
     def render_tag(self, context, kwargs, varname, nodelist):
-        price = modules.pricing.get_price(**kwargs)
+        prices = kwargs.pop('prices', None)
+        product = kwargs.get('product', None)
+        if prices is not None and product is not None and product.pk in prices:
+            price = prices[product.pk]
+        else:
+            price = modules.pricing.get_price(**kwargs)
         context.push()
         context[varname] = price
         output = nodelist.render(context)
@@ -68,3 +73,23 @@ class PriceTag(Tag):
         return output
 
 register.tag(PriceTag)
+
+
+class PricesTag(Tag):
+    name = 'prices'
+    options = Options(
+        MultiKeywordArgument('kwargs', required=False),
+        'as',
+        Argument('varname', default='prices', required=False, resolve=False),
+        blocks=[('endprices', 'nodelist')],
+    )
+
+    def render_tag(self, context, kwargs, varname, nodelist):
+        prices = modules.pricing.get_prices(**kwargs)
+        context.push()
+        context[varname] = prices
+        output = nodelist.render(context)
+        context.pop()
+        return output
+
+register.tag(PricesTag)
@@ -38,8 +38,9 @@ class UntrackableError(Exception):
     pass
 
 
-def trackable(session_key):
-    manager = TrackingManager()
+def trackable(session_key, manager=None):
+    if manager is None:
+        manager = TrackingManager()
     manager._session_key = session_key
     
     class TrackableModel(models.Model):
@@ -0,0 +1 @@
+default_app_config = 'indexing.apps.DefaultConfig'
\ No newline at end of file
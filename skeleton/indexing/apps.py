@@ -0,0 +1,5 @@
+from sellmo.api.apps import SellmoAppConfig
+
+
+class DefaultConfig(SellmoAppConfig):
+    name = 'indexing'
\ No newline at end of file
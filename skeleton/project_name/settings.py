@@ -195,6 +195,11 @@ INSTALLED_APPS += tuple(reversed((
     'availability',
     {% endif %}
     
+    {% if 'indexing' in apps %}
+    'sellmo.contrib.indexing',
+    'indexing',
+    {% endif %}
+    
     {% if 'search' in apps %}
     'sellmo.contrib.search',
     'search',
@@ -249,6 +254,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'sellmo.core.middleware.LocalContextMiddleware',
+    'sellmo.core.middleware.IndexingMiddleware',
 )
 
 TEMPLATE_CONTEXT_PROCESSORS = (